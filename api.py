@@ -1,6 +1,6 @@
 # api.py
 from fastapi import  Depends, HTTPException, APIRouter,FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from decimal import Decimal
 from handlers import products
@@ -9,17 +9,19 @@ from typing import List, Optional, Sequence
 from sqlalchemy import select, update, delete, func
 from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import SQLAlchemyError
-from pydantic import BaseModel
-from db.session import get_async_session
-from db.crud import UserCRUD, ProductCRUD, OrderCRUD, CartCRUD
+from pydantic import BaseModel, TypeAdapter
+from db.session import get_async_session, get_read_session, pool_stats
+from db.crud import ProductCRUD, OrderCRUD, CartCRUD, UserCRUD
+from db.loaders import user_loader
 from config.settings import get_app_settings, settings
 from services.orders import get_orders_by_user
 from handlers.payment import get_payment_service
 from uuid import UUID
 from db.models import OrderStatus
 from datetime import datetime
-from services import orders as order_service
-from utils.cache import cache_get, cache_set
+from utils.cache import TwoTierCache
+from utils.metrics import registry
+from services.catalog import catalog
 
 
 
@@ -78,6 +80,20 @@ class OrderOut(BaseModel):
 
     model_config = {"from_attributes": True}
 
+# 列表接口整批校验（ProductRow / OrderRow 按属性读取），避免逐条 model_validate；
+# 路由 response_model=None，直接返回 dump_json 的结果，FastAPI 不再按 response_model 校验第二遍
+ProductListAdapter = TypeAdapter(List[ProductOut])
+OrderListAdapter = TypeAdapter(List[OrderOut])
+
+
+def _json_list(adapter: TypeAdapter, rows: Sequence) -> Response:
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(rows, from_attributes=True)),
+        media_type="application/json",
+    )
+
+user_out_cache = TwoTierCache("api_user", ttl=300, l1_ttl=30)
+
 @app.get("/some")
 async def some_handler(request: Request):
     redis = request.app.state.redis  # 拿到共享的 Redis 客户端
@@ -94,7 +110,11 @@ async def root():
 
 @router.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "db_pool": pool_stats()}
+
+@router.get("/metrics")
+async def metrics():
+    return registry.snapshot()
 
 @router.get("/features")
 async def get_features():
@@ -109,23 +129,23 @@ async def get_features():
         ]
     })
 
-@router.get("/users/{telegram_id}", response_model=UserOut)
-async def get_user_cached(
-    telegram_id: int,
-    request: Request,  # ✅ 加上这个
-    session: AsyncSession = Depends(get_async_session)
-):
-    cached = await cache_get(request, f"user:{telegram_id}")  # ✅ 正确传参
-    if cached:
-        return {"user": cached, "source": "cache"}
-
-    user = await UserCRUD.get_by_telegram_id(session, telegram_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def _load_user_out(telegram_id: int) -> Optional[dict]:
+    # 缓存未命中的并发请求合批查询；user_loader 有副本时读主库，失效后回填不会读到旧数据
+    user = await user_loader.load(telegram_id)
+    return UserOut.model_validate(user).model_dump() if user else None
 
-    await cache_set(request, f"user:{telegram_id}", user.username)
 
-    return UserOut.model_validate(user)
+@router.get("/users/{telegram_id}", response_model=UserOut)
+async def get_user_cached(telegram_id: int):
+    # 命中与未命中返回同一结构；用户资料变更时按 user:<telegram_id> 标签失效
+    user = await user_out_cache.get_or_load(
+        telegram_id,
+        lambda: _load_user_out(telegram_id),
+        tags=[f"user:{telegram_id}"],
+    )
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 @router.post("/products", response_model=List[ProductOut])
 async def create_product(
@@ -148,13 +168,10 @@ async def create_product(
         await session.rollback()
         raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
 
-@router.get("/products", response_model=List[ProductOut])
-async def list_products(
-    search: Optional[str] = None,
-    session: AsyncSession = Depends(get_async_session),
-):
-    products = await ProductCRUD.search_products(session, search=search)
-    return [ProductOut.model_validate(p) for p in products]
+@router.get("/products", response_model=None, responses={200: {"model": List[ProductOut]}})
+async def list_products(search: Optional[str] = None) -> Response:
+    products = await catalog.search(search)
+    return _json_list(ProductListAdapter, products)
 
 @router.post("/cart/add")
 async def add_to_cart(
@@ -181,32 +198,14 @@ async def add_to_cart(
         "unit_price": str(cart_item.unit_price),
     }
 
-@router.get("/orders/{user_id}", response_model=List[OrderOut])
-async def list_orders(user_id: UUID, session: AsyncSession = Depends(get_async_session)):
-    orders = await order_service.get_orders_by_user(user_id, session)
-
-    result = []
-    for o in orders:
-        items_out = [
-            OrderItemOut(
-                product_id=item.product_id,
-                quantity=item.quantity,
-                unit_price=item.unit_price  # 必须提供
-            )
-            for item in getattr(o, "items", [])
-        ]
-        result.append(
-            OrderOut(
-                id=o.id,
-                user_id=o.user_id,
-                items=items_out,
-                total_amount=o.total_amount,
-                status=OrderStatus(o.status.value),
-                created_at=o.created_at
-            )
-        )
-
-    return result
+@router.get("/orders/{user_id}", response_model=None, responses={200: {"model": List[OrderOut]}})
+async def list_orders(user_id: UUID) -> Response:
+    # read-your-writes 按 telegram_id 记录：用户行早已存在，从副本换算即可
+    async with get_read_session() as session:
+        telegram_id = await UserCRUD.get_telegram_id(session, user_id)
+    async with get_read_session(telegram_id) as session:
+        orders = await OrderCRUD.list_rows_by_user(session, user_id)
+    return _json_list(OrderListAdapter, orders)
 
 @router.post("/pay")
 async def pay(total_amount: Decimal):
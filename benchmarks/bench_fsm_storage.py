@@ -0,0 +1,161 @@
+# benchmarks/bench_fsm_storage.py
+"""
+FSM 存储对比：MemoryStorage vs aiogram RedisStorage（JSON，状态 / 数据分两个 key）vs utils.fsm_storage.RedisFSMStorage
+
+--users 个用户各走一遍新增商品流程（5 步，和 handlers/admin_products 相同的调用顺序：
+中间件 get_state → handler get_data → update_data → set_state），报告：
+
+- 每步延迟 p50 / p99；
+- 每步 Redis 往返次数（客户端发包次数，pipeline / 脚本算一次）；
+- 所有用户停在流程中途时的内存占用（MemoryStorage 用 tracemalloc，Redis 用 used_memory 差值）。
+
+⚠️ 会写入并删除 fsmbench:* 键，请指向测试用的 Redis 库：
+
+    python -m benchmarks.bench_fsm_storage --users 10000
+    BENCH_REDIS_URL=redis://localhost:6379/15 python -m benchmarks.bench_fsm_storage
+"""
+import argparse
+import asyncio
+import gc
+import os
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
+from redis.asyncio.connection import AbstractConnection
+
+from utils.fsm_storage import RedisFSMStorage
+
+DEFAULT_URL = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+PREFIX = "fsmbench"
+BOT_ID = 42
+
+
+class AddProductState(StatesGroup):
+    """与 handlers.admin_products.AddProductState 同名（不导入 handlers，避免拉起整个应用）"""
+    waiting_name = State()
+    waiting_price = State()
+    waiting_stock = State()
+    waiting_description = State()
+    waiting_image = State()
+
+# (下一个状态, 本步写入的数据)
+STEPS = [
+    (AddProductState.waiting_price, {"name": "示例商品 A"}),
+    (AddProductState.waiting_stock, {"price": str(Decimal("19.90"))}),
+    (AddProductState.waiting_description, {"stock": 100}),
+    (AddProductState.waiting_image, {"description": "一段不太长的商品介绍"}),
+]
+
+
+def _context(storage: BaseStorage, user_id: int) -> FSMContext:
+    return FSMContext(storage, StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id))
+
+
+async def _step(state: FSMContext, next_state, data: Dict) -> None:
+    await state.get_state()          # FSMContextMiddleware
+    await state.get_data()           # handler 读取已填的字段
+    await state.update_data(**data)
+    await state.set_state(next_state)
+
+
+_round_trips = 0
+_send_packed_command = AbstractConnection.send_packed_command
+
+
+async def _counting_send(self, *args, **kwargs):
+    global _round_trips
+    _round_trips += 1
+    return await _send_packed_command(self, *args, **kwargs)
+
+
+AbstractConnection.send_packed_command = _counting_send
+
+
+async def _used_memory(redis: Optional[Redis]) -> int:
+    if redis is None:
+        return 0
+    try:
+        return int((await redis.info("memory"))["used_memory"])
+    except Exception:
+        return 0
+
+
+async def _run(name: str, storage: BaseStorage, redis: Optional[Redis], users: int) -> None:
+    latencies: List[float] = []
+    gc.collect()
+    if redis is None:
+        tracemalloc.start()
+    memory_before = await _used_memory(redis)
+    trips_before = _round_trips
+
+    for user_id in range(1, users + 1):
+        state = _context(storage, user_id)
+        await state.set_state(AddProductState.waiting_name)
+        for next_state, data in STEPS:
+            start = time.perf_counter()
+            await _step(state, next_state, data)
+            latencies.append(time.perf_counter() - start)
+
+    trips = _round_trips - trips_before - (2 if redis is not None else 0)  # 去掉两次 INFO
+    if redis is None:
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        memory = await _used_memory(redis) - memory_before
+
+    # 数据能原样读回
+    data = await _context(storage, 1).get_data()
+    assert data["stock"] == 100 and data["name"] == "示例商品 A", data
+
+    steps = len(latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    per_step = f"{(trips - users) / steps:.1f}" if redis is not None else "-"  # 去掉每个用户开头的 set_state
+    print(
+        f"{name:<16} p50={quantiles[49] * 1e6:8.1f}µs p99={quantiles[98] * 1e6:8.1f}µs "
+        f"往返/步={per_step:>4} 内存={memory / users:7.0f} B/用户（{memory / 1024 / 1024:.1f} MiB）"
+    )
+
+
+async def _cleanup(redis: Redis) -> None:
+    async for key in redis.scan_iter(match=f"{PREFIX}*", count=1000):
+        await redis.delete(key)
+
+
+async def main(url: str, users: int, fake: bool) -> None:
+    await _run("MemoryStorage", MemoryStorage(), None, users)
+
+    if fake:
+        import fakeredis  # 仅用于没有 Redis 的开发机：延迟和内存数字没有参考意义
+        redis = fakeredis.FakeAsyncRedis()
+    else:
+        redis = Redis.from_url(url)
+    try:
+        await _cleanup(redis)
+        targets: List[Tuple[str, BaseStorage]] = [
+            ("RedisStorage", RedisStorage(redis, key_builder=DefaultKeyBuilder(prefix=f"{PREFIX}:json"))),
+            ("RedisFSMStorage", RedisFSMStorage(redis, key_builder=DefaultKeyBuilder(prefix=f"{PREFIX}:hash", with_destiny=True))),
+        ]
+        for name, storage in targets:
+            await _run(name, storage, redis, users)
+            await _cleanup(redis)
+    finally:
+        await redis.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--fake", action="store_true", help="用 fakeredis 代替真实 Redis（只验证流程）")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.users, args.fake))
@@ -1,7 +1,7 @@
 # config/settings.py
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator
-from typing import List,Optional
+from typing import Dict, List,Optional
 
 import json
 import logging
@@ -28,9 +28,116 @@ class AppSettings(BaseSettings):
     currency: str = Field(default="USD", alias="CURRENCY")
     database_url: Optional[str] = Field(default="sqlite:///default.db", alias="DATABASE_URL")
 
+    # 数据库连接池
+    db_echo: bool = Field(default=False, alias="DB_ECHO")
+    db_pool_size: int = Field(default=10, alias="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=20, alias="DB_MAX_OVERFLOW")
+    db_pool_pre_ping: bool = Field(default=True, alias="DB_POOL_PRE_PING")
+    db_pool_recycle: int = Field(default=1800, alias="DB_POOL_RECYCLE", description="连接回收秒数")
+    db_pool_timeout: float = Field(default=10.0, alias="DB_POOL_TIMEOUT", description="获取连接超时秒数")
+    db_statement_cache_size: int = Field(default=100, alias="DB_STATEMENT_CACHE_SIZE", description="asyncpg 预编译语句缓存，pgbouncer 下设 0")
+
+    # SQLite 模式（DATABASE_URL 为 sqlite 时生效）
+    sqlite_busy_timeout_ms: int = Field(default=5000, alias="SQLITE_BUSY_TIMEOUT_MS", description="等待其他进程写锁的毫秒数")
+    sqlite_mmap_size: int = Field(default=256 * 1024 * 1024, alias="SQLITE_MMAP_SIZE", description="mmap 字节数，0 关闭")
+    sqlite_cache_size_kib: int = Field(default=64 * 1024, alias="SQLITE_CACHE_SIZE_KIB", description="每个连接的页缓存 KiB")
+    sqlite_reader_pool_size: int = Field(default=4, alias="SQLITE_READER_POOL_SIZE", description="只读连接数")
+    sqlite_write_timeout: float = Field(default=30.0, alias="SQLITE_WRITE_TIMEOUT", description="排队等写连接的超时秒数")
+
+    # 商品目录进程内缓存
+    catalog_max_age: float = Field(default=300.0, alias="CATALOG_MAX_AGE", description="快照最长使用秒数，pub/sub 失效漏消息时兜底")
+
+    # 并发点查合批（db.loaders）
+    batch_window_ms: float = Field(default=1.5, alias="BATCH_WINDOW_MS", description="收集同类点查的窗口，窗口内的键合并成一条 IN / ANY 查询")
+    batch_max_size: int = Field(default=500, alias="BATCH_MAX_SIZE", description="单批最多键数，攒满立即发出")
+
+    # 商品菜单 / 卡片渲染结果缓存（services.views）
+    view_cache_size: int = Field(default=5000, alias="VIEW_CACHE_SIZE", description="最多缓存的渲染结果条数（视图 × 商品 × 语言）")
+
+    # 二维码缓存（services.qr_cache）
+    qr_cache_dir: str = Field(default="/tmp/sokphy_qr_cache", alias="QR_CACHE_DIR", description="PNG 磁盘缓存目录")
+    qr_cache_disk_bytes: int = Field(default=64 * 1024 * 1024, alias="QR_CACHE_DISK_BYTES", description="磁盘缓存总大小上限，超出按最近访问淘汰")
+    qr_cache_memory_bytes: int = Field(default=8 * 1024 * 1024, alias="QR_CACHE_MEMORY_BYTES", description="进程内 LRU 的字节上限")
+    qr_file_id_ttl: float = Field(default=30 * 86400.0, alias="QR_FILE_ID_TTL", description="已上传二维码 file_id 的保留秒数")
+
+    # 商品图片 file_id 预热（services.photos）
+    photo_warmup_chat_id: Optional[int] = Field(default=None, alias="PHOTO_WARMUP_CHAT_ID", description="预热上传用的私有会话，未配置时发到执行命令的管理员会话")
+    photo_warmup_interval: float = Field(default=1.0, alias="PHOTO_WARMUP_INTERVAL", description="预热时两次上传的间隔秒数（同一会话约 1 条/秒）")
+
+    # 用户身份缓存（telegram_id -> id / 角色 / 封禁 / 语言）
+    identity_cache_ttl: float = Field(default=600.0, alias="IDENTITY_CACHE_TTL", description="Redis 中的过期秒数")
+    identity_l1_ttl: float = Field(default=60.0, alias="IDENTITY_L1_TTL", description="进程内过期秒数，跨 worker 失效广播丢失时兜底")
+
+    # 只读副本（未配置时读请求仍走主库）
+    database_replica_url: Optional[str] = Field(default=None, alias="DATABASE_REPLICA_URL")
+    db_read_your_writes_seconds: float = Field(default=5.0, alias="DB_READ_YOUR_WRITES_SECONDS", description="用户写入后多少秒内读主库，0 关闭")
+
+    # last_active 写回缓冲
+    activity_backend: str = Field(default="memory", alias="ACTIVITY_BACKEND", description="memory / redis")
+    activity_flush_interval: float = Field(default=5.0, alias="ACTIVITY_FLUSH_INTERVAL", description="刷盘间隔秒数")
+    activity_flush_batch_size: int = Field(default=1000, alias="ACTIVITY_FLUSH_BATCH_SIZE", description="单条 UPDATE 最多行数")
+    activity_max_pending: int = Field(default=50_000, alias="ACTIVITY_MAX_PENDING", description="缓冲上限，超过立即刷盘")
+    activity_flush_timeout: float = Field(default=10.0, alias="ACTIVITY_FLUSH_TIMEOUT", description="单次刷盘超时秒数")
+
+    # site_stats 对账
+    site_stats_reconcile_interval: float = Field(default=3600.0, alias="SITE_STATS_RECONCILE_INTERVAL", description="对账间隔秒数，0 关闭")
+    site_stats_slots: int = Field(default=16, alias="SITE_STATS_SLOTS", description="计数器分散到几行，写入随机挑一行")
+
+    # orders / order_items 月分区
+    order_hot_window_days: int = Field(default=90, alias="ORDER_HOT_WINDOW_DAYS", description="hot_window_start() 的窗口天数，查询传 since 时才生效")
+    partition_months_ahead: int = Field(default=3, alias="PARTITION_MONTHS_AHEAD", description="提前创建几个月的分区")
+    partition_archive_after_months: int = Field(default=12, alias="PARTITION_ARCHIVE_AFTER_MONTHS")
+    partition_archive_schema: str = Field(default="archive", alias="PARTITION_ARCHIVE_SCHEMA")
+    partition_archive_tablespace: Optional[str] = Field(default=None, alias="PARTITION_ARCHIVE_TABLESPACE", description="冷库 tablespace，可选")
+
     bot_token: str = Field(default="test-bot-token", alias="BOT_TOKEN")
     BOT_ADMINS: str = Field(default="", alias="BOT_ADMINS")
     default_lang: str = "zh"
+
+    # 发往 Telegram 的限速（utils.rate_limit）
+    outbound_backend: str = Field(default="memory", alias="OUTBOUND_BACKEND", description="memory / redis；多进程（webhook、worker.py）请用 redis 共用额度")
+    outbound_global_rate: float = Field(default=30.0, alias="OUTBOUND_GLOBAL_RATE", description="全局每秒消息数")
+    outbound_chat_rate: float = Field(default=1.0, alias="OUTBOUND_CHAT_RATE", description="同一私聊每秒消息数")
+    outbound_group_per_minute: float = Field(default=20.0, alias="OUTBOUND_GROUP_PER_MINUTE", description="同一群组 / 频道每分钟消息数")
+    outbound_chat_burst: int = Field(default=3, alias="OUTBOUND_CHAT_BURST", description="单个会话允许的突发条数")
+    outbound_bulk_reserve: int = Field(default=5, alias="OUTBOUND_BULK_RESERVE", description="全局额度里留给交互回复、广播用不到的令牌数")
+    outbound_max_retries: int = Field(default=3, alias="OUTBOUND_MAX_RETRIES", description="收到 429 后最多重发几次")
+
+    # update 队列（services.update_queue）：接收和 handler 执行分开
+    update_queue: str = Field(default="off", alias="UPDATE_QUEUE", description="off：接收端直接处理；local：进程内队列；redis：Redis Streams + worker.py")
+    update_queue_partitions: int = Field(default=16, alias="UPDATE_QUEUE_PARTITIONS", description="分区数，按 chat_id 分区；上线后修改会打乱进行中会话的顺序")
+    update_queue_maxlen: int = Field(default=100_000, alias="UPDATE_QUEUE_MAXLEN", description="每个分区 Stream 的近似长度上限")
+    update_queue_batch: int = Field(default=10, alias="UPDATE_QUEUE_BATCH", description="每次从分区读取的条数")
+    update_queue_claim_idle: float = Field(default=60.0, alias="UPDATE_QUEUE_CLAIM_IDLE", description="别的消费者名下未 ack 超过多少秒视为卡住并接管")
+    update_queue_max_deliveries: int = Field(default=5, alias="UPDATE_QUEUE_MAX_DELIVERIES", description="超过后转入死信 updates:dead")
+    update_worker_index: int = Field(default=0, alias="UPDATE_WORKER_INDEX", description="worker.py 的编号（0 起）")
+    update_worker_count: int = Field(default=1, alias="UPDATE_WORKER_COUNT", description="worker.py 的进程总数")
+
+    # FSM 状态存储（utils.fsm_storage）
+    fsm_storage: str = Field(default="memory", alias="FSM_STORAGE", description="memory / redis；多 worker 或 webhook 模式请用 redis")
+    fsm_ttl: int = Field(default=86400, alias="FSM_TTL", description="状态和数据在 Redis 中的默认保留秒数，放弃的流程到期自动清理")
+    fsm_state_ttls: Dict[str, int] = Field(
+        default={
+            "AddProductState": 1800,
+            "EditProductState": 1800,
+            "DeleteProductState": 600,
+            "RegisterForm": 3600,
+            "ProfileStates": 3600,
+        },
+        alias="FSM_STATE_TTLS",
+        description="按状态覆盖 TTL（JSON，键为完整状态名或 StatesGroup 名）",
+    )
+
+    # Telegram 更新接收方式（services.webhook）
+    bot_mode: str = Field(default="polling", alias="BOT_MODE", description="polling：单进程轮询；webhook：多 worker / 多实例")
+    webhook_base_url: Optional[str] = Field(default=None, alias="WEBHOOK_BASE_URL", description="公网 https 地址，如 https://bot.example.com")
+    webhook_path: str = Field(default="/telegram/webhook", alias="WEBHOOK_PATH")
+    webhook_secret: str = Field(default="", alias="WEBHOOK_SECRET", description="X-Telegram-Bot-Api-Secret-Token，留空时由 BOT_TOKEN 派生（各 worker 一致）")
+    webhook_max_connections: int = Field(default=40, alias="WEBHOOK_MAX_CONNECTIONS", description="Telegram 向本服务并发推送的连接数（1-100）")
+    webhook_concurrency: int = Field(default=64, alias="WEBHOOK_CONCURRENCY", description="每个 worker 同时处理的 update 数")
+    webhook_max_pending: int = Field(default=2000, alias="WEBHOOK_MAX_PENDING", description="每个 worker 排队 + 处理中的上限，超过返回 503 让 Telegram 稍后重投")
+    webhook_drain_timeout: float = Field(default=20.0, alias="WEBHOOK_DRAIN_TIMEOUT", description="停机时等待处理中 update 的秒数")
+    webhook_delete_on_shutdown: bool = Field(default=False, alias="WEBHOOK_DELETE_ON_SHUTDOWN", description="停机时 delete_webhook；多实例滚动发布时保持关闭")
     log_level: str = Field(default="INFO", alias="LOG_LEVEL")
 
     @field_validator("log_level", mode="before")
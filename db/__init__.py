@@ -4,6 +4,7 @@ from .base import Base
 from .models import User, Product, CartItem, Order, OrderItem
 from .crud import UserCRUD, ProductCRUD, CartCRUD, OrderCRUD
 from .session import async_session_maker, get_async_session  
+from . import stats  # noqa: F401  注册 ORM 钩子（site_stats 增量统计）
 
 class MessageResponse:
     def __init__(self):
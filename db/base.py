@@ -1,4 +1,7 @@
 # base.py
+import secrets
+import threading
+import time
 import uuid
 from datetime import datetime, timezone
 from sqlalchemy.orm import Mapped, DeclarativeBase, mapped_column
@@ -17,13 +20,50 @@ class Base(DeclarativeBase):
     pass
 
 
+# ✅ UUIDv7（RFC 9562）：48 位毫秒时间戳 + 12 位同毫秒计数 + 62 位随机
+# 按时间递增，新行总是追加在主键 B-tree 右侧；旧的 v4 主键照常可用
+_uuid7_lock = threading.Lock()
+_uuid7_last_ms = 0
+_uuid7_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    global _uuid7_last_ms, _uuid7_counter
+    with _uuid7_lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _uuid7_last_ms:
+            _uuid7_last_ms = ms
+            _uuid7_counter = secrets.randbits(11)  # 随机起点，留一半空间给同毫秒递增
+        else:
+            # 同一毫秒（或时钟回拨）：计数 +1，溢出就借用下一毫秒，保证单调
+            _uuid7_counter += 1
+            if _uuid7_counter > 0xFFF:
+                _uuid7_last_ms += 1
+                _uuid7_counter = 0
+        ms, counter = _uuid7_last_ms, _uuid7_counter
+    value = (
+        (ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | secrets.randbits(62)
+    )
+    return uuid.UUID(int=value)
+
+
+def uuid7_datetime(value: uuid.UUID) -> datetime | None:
+    """取出 v7 主键里的时间；v4 返回 None"""
+    if value.version != 7:
+        return None
+    return datetime.fromtimestamp((value.int >> 80) / 1000, timezone.utc)
+
+
 # ✅ 公用 UUIDMixin
 class UUIDMixin:
     id: Mapped[UUID_PK] = mapped_column(
         PG_UUID(as_uuid=True) if PG_UUID else String(36),
-        default=uuid.uuid4,
-        index=True,
-        comment="主键UUID",
+        default=uuid7,
+        comment="主键UUID",  # 主键自带唯一索引，不要再加 index=True
     )
 
 
@@ -1,12 +1,21 @@
 # db/crud.py
-from typing import Optional, List, Sequence
+from typing import Dict, Iterable, Optional, List, Sequence, Tuple
+from datetime import datetime
 from decimal import Decimal
+from uuid import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete, func
+from sqlalchemy import select, update, delete, func, values, column, bindparam, or_, BigInteger, DateTime
 from .models import User, Product, CartItem, Order, OrderItem, OrderStatus, Role
-from sqlalchemy.orm import selectinload
+from .dto import (
+    ORDER_ITEM_ROW_COLUMNS, ORDER_ROW_COLUMNS, PRODUCT_ROW_COLUMNS, USER_IDENTITY_COLUMNS,
+    OrderItemRow, OrderRow, ProductRow, UserIdentity,
+)
+from sqlalchemy.orm import selectinload, load_only, raiseload
 from sqlalchemy.sql import Executable
 from sqlalchemy.exc import SQLAlchemyError
+from .session import is_read_only, transaction
+from .dialects import upsert_insert, dialect_name, in_keys
+from .partitions import created_at_bounds
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,6 +24,24 @@ logger = logging.getLogger(__name__)
 class BaseCRUD:
     """CRUD 基类，提供公共方法"""
 
+    # 加载方案：名字 -> 查询 options；子类按自己的查询场景定义
+    LOAD_PROFILES: Dict[str, tuple] = {}
+
+    @classmethod
+    def _load(cls, profile: str) -> tuple:
+        try:
+            return cls.LOAD_PROFILES[profile]
+        except KeyError:
+            raise ValueError(
+                f"{cls.__name__} 没有加载方案 {profile!r}，可选: {', '.join(cls.LOAD_PROFILES)}"
+            ) from None
+
+    @staticmethod
+    def _ensure_writable(session: AsyncSession) -> None:
+        """写操作不允许落在只读（副本）会话上"""
+        if is_read_only(session):
+            raise RuntimeError("只读会话不能执行写操作，请使用 get_async_session()")
+
     @classmethod
     async def _execute_commit(
         cls, session: AsyncSession, stmt: Executable, error_msg: str
@@ -22,6 +49,7 @@ class BaseCRUD:
         """
         安全执行并提交，兼容 rowcount 可能为 None 的情况。
         """
+        cls._ensure_writable(session)
         try:
             result = await session.execute(stmt)
             await session.commit()
@@ -37,17 +65,65 @@ class BaseCRUD:
 
 
 class UserCRUD(BaseCRUD):
+    # bare：鉴权 / 下单等热路径只要身份和权限字段，访问其他列或关系直接报错，
+    # 而不是悄悄多发一条查询
+    LOAD_PROFILES = {
+        "bare": (
+            load_only(
+                User.id, User.telegram_id, User.username, User.role,
+                User.is_admin, User.is_blocked, User.is_banned, User.language,
+                raiseload=True,
+            ),
+            raiseload("*"),
+        ),
+        "detail": (raiseload("*"),),
+        "with_items": (selectinload(User.cart_items), raiseload("*")),
+    }
+
     @staticmethod
     async def get_by_telegram_id(
-        session: AsyncSession, telegram_id: int
+        session: AsyncSession, telegram_id: int, profile: str = "bare"
     ) -> Optional[User]:
         result = await session.execute(
             select(User)
             .where(User.telegram_id == telegram_id)
-            .options(selectinload(User.cart_items))
+            .options(*UserCRUD._load(profile))
         )
         return result.scalars().first()
 
+    @staticmethod
+    async def get_by_telegram_ids(
+        session: AsyncSession, telegram_ids: Iterable[int], profile: str = "bare"
+    ) -> Dict[int, User]:
+        """一条查询取多个用户（db.loaders 批量加载用），不存在的不在结果里"""
+        telegram_ids = list(telegram_ids)
+        if not telegram_ids:
+            return {}
+        result = await session.execute(
+            select(User)
+            .where(in_keys(session, User.telegram_id, telegram_ids))
+            .options(*UserCRUD._load(profile))
+        )
+        return {user.telegram_id: user for user in result.scalars()}
+
+    @staticmethod
+    async def get_identities(
+        session: AsyncSession, telegram_ids: Iterable[int]
+    ) -> Dict[int, UserIdentity]:
+        """只取身份字段（services.identity 的批量加载用）"""
+        telegram_ids = list(telegram_ids)
+        if not telegram_ids:
+            return {}
+        result = await session.execute(
+            select(*USER_IDENTITY_COLUMNS).where(in_keys(session, User.telegram_id, telegram_ids))
+        )
+        return {row.telegram_id: UserIdentity(*row) for row in result}
+
+    @staticmethod
+    async def get_telegram_id(session: AsyncSession, user_id: UUID) -> Optional[int]:
+        """内部 UUID -> telegram_id（read-your-writes 统一按 telegram_id 记录）"""
+        return await session.scalar(select(User.telegram_id).where(User.id == user_id))
+
     @staticmethod
     async def create_user(
         session: AsyncSession, telegram_id: int, username: str, role: Role = Role.USER
@@ -71,28 +147,202 @@ class UserCRUD(BaseCRUD):
 
     @staticmethod
     async def update_last_active(session: AsyncSession, user_id: str) -> bool:
+        """立即写库；消息路径请用 services.activity.activity_buffer 批量写回"""
         return await UserCRUD._execute_commit(
             session,
             update(User).where(User.id == user_id).values(last_active=func.now()),
             "更新活跃时间失败",
         )
 
+    @staticmethod
+    async def bulk_update_last_active(
+        session: AsyncSession, rows: Sequence[Tuple[int, datetime]]
+    ) -> None:
+        """
+        批量写回 last_active（telegram_id, 时间）。
+        PostgreSQL：一条 UPDATE ... FROM (VALUES ...)；其他方言：executemany。
+        只会把时间往后推，不会覆盖更新的值。不负责 commit。
+        """
+        UserCRUD._ensure_writable(session)
+        if not rows:
+            return
+        if dialect_name(session) == "postgresql":
+            v = values(
+                column("telegram_id", BigInteger),
+                column("ts", DateTime(timezone=True)),
+                name="v",
+            ).data(list(rows))
+            stmt = (
+                update(User.__table__)
+                .where(User.telegram_id == v.c.telegram_id)
+                .where(or_(User.last_active.is_(None), User.last_active < v.c.ts))
+                .values(last_active=v.c.ts)
+            )
+            await session.execute(stmt)
+            return
+        stmt = (
+            update(User.__table__)
+            .where(User.telegram_id == bindparam("tg_id"))
+            .where(or_(User.last_active.is_(None), User.last_active < bindparam("ts")))
+            .values(last_active=bindparam("ts"))
+        )
+        await session.execute(stmt, [{"tg_id": tg_id, "ts": ts} for tg_id, ts in rows])
+
 
 class ProductCRUD(BaseCRUD):
+    # bare：下单 / 加购只需要价格和库存；with_items 会带出该商品的全部订单行，只给报表用
+    LOAD_PROFILES = {
+        "bare": (
+            load_only(
+                Product.id, Product.name, Product.price, Product.stock, Product.is_active,
+                raiseload=True,
+            ),
+            raiseload("*"),
+        ),
+        "detail": (raiseload("*"),),
+        "with_items": (selectinload(Product.order_items), raiseload("*")),
+    }
+
     @staticmethod
-    async def get_by_id(session: AsyncSession, product_id: int) -> Optional[Product]:
+    async def get_by_id(
+        session: AsyncSession, product_id: int, profile: str = "bare"
+    ) -> Optional[Product]:
         result = await session.execute(
             select(Product)
             .where(Product.id == product_id)
-            .options(selectinload(Product.order_items))
+            .options(*ProductCRUD._load(profile))
         )
         return result.scalars().first()
 
     @staticmethod
-    async def list_active(session: AsyncSession) -> Sequence[Product]:
-        stmt = select(Product).where(Product.is_active == True)
+    async def get_by_ids(
+        session: AsyncSession, product_ids: Iterable[UUID], profile: str = "bare"
+    ) -> Dict[UUID, Product]:
+        """一条查询取多个商品（含已下架，与 get_by_id 一致），不存在的不在结果里"""
+        product_ids = list(product_ids)
+        if not product_ids:
+            return {}
+        result = await session.execute(
+            select(Product)
+            .where(in_keys(session, Product.id, product_ids))
+            .options(*ProductCRUD._load(profile))
+        )
+        return {product.id: product for product in result.scalars()}
+
+    @staticmethod
+    async def list_active(session: AsyncSession) -> List[ProductRow]:
+        """上架商品目录：只取列，返回 ProductRow，不经过 ORM 实体"""
+        return await ProductCRUD.search_products(session)
+
+    @staticmethod
+    async def list_active_by_ids(session: AsyncSession, product_ids) -> List[ProductRow]:
+        """只补查指定商品（目录缓存局部更新用），已下架 / 不存在的不返回"""
+        if not product_ids:
+            return []
+        result = await session.execute(
+            select(*PRODUCT_ROW_COLUMNS)
+            .where(Product.id.in_(list(product_ids)))
+            .where(Product.is_active == True)
+            .order_by(Product.created_at.desc())
+        )
+        return [ProductRow(*row) for row in result]
+
+    @staticmethod
+    async def get_all(session: AsyncSession) -> List[Product]:
+        """后台管理用：含已下架商品"""
+        result = await session.execute(select(Product).order_by(Product.created_at.desc()))
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def _update_fields(session: AsyncSession, product_id, **values) -> bool:
+        # 走 ORM 修改，提交后目录缓存的 after_commit 钩子才能感知到
+        ProductCRUD._ensure_writable(session)
+        try:
+            if not isinstance(product_id, UUID):
+                product_id = UUID(str(product_id))  # FSM 里存的是字符串
+            product = await session.get(Product, product_id)
+            if product is None:
+                return False
+            for key, value in values.items():
+                setattr(product, key, value)
+            await session.commit()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"更新商品失败: {e}", exc_info=True)
+            await session.rollback()
+            return False
+
+    @staticmethod
+    async def update_price(session: AsyncSession, product_id, price) -> bool:
+        return await ProductCRUD._update_fields(
+            session, product_id, price=Decimal(str(price))
+        )
+
+    @staticmethod
+    async def update_stock(session: AsyncSession, product_id, stock: int) -> bool:
+        return await ProductCRUD._update_fields(session, product_id, stock=stock)
+
+    @staticmethod
+    async def delete(session: AsyncSession, product_id) -> bool:
+        """下架（is_active=False），保留历史订单引用的商品行"""
+        return await ProductCRUD._update_fields(session, product_id, is_active=False)
+
+    @staticmethod
+    async def fill_image_file_ids(
+        session: AsyncSession, rows: Sequence[Tuple[UUID, str, str]]
+    ) -> int:
+        """
+        批量回填 Telegram file_id（商品 id, 发送时的 image_url, file_id），返回实际回填的行数。
+        只填 image_url 没变、还没有 file_id 的行；绕过 ORM，调用方负责 catalog.changed()。不负责 commit。
+        PostgreSQL：一条 UPDATE ... FROM (VALUES ...) RETURNING id，按返回行计数
+        （asyncpg 的 executemany 没有可靠的 rowcount）；其他方言：executemany。
+        """
+        ProductCRUD._ensure_writable(session)
+        if not rows:
+            return 0
+        if dialect_name(session) == "postgresql":
+            v = values(
+                column("pid", Product.id.type),
+                column("url", Product.image_url.type),
+                column("fid", Product.image_file_id.type),
+                name="v",
+            ).data(list(rows))
+            stmt = (
+                update(Product.__table__)
+                .where(Product.id == v.c.pid)
+                .where(Product.image_url == v.c.url)
+                .where(Product.image_file_id.is_(None))
+                .values(image_file_id=v.c.fid)
+                .returning(Product.id)
+            )
+            return len((await session.execute(stmt)).all())
+        stmt = (
+            update(Product.__table__)
+            .where(Product.id == bindparam("pid"))
+            .where(Product.image_url == bindparam("url"))
+            .where(Product.image_file_id.is_(None))
+            .values(image_file_id=bindparam("fid"))
+        )
+        result = await session.execute(
+            stmt, [{"pid": pid, "url": url, "fid": fid} for pid, url, fid in rows]
+        )
+        return result.rowcount
+
+    @staticmethod
+    async def search_products(
+        session: AsyncSession, search: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[ProductRow]:
+        stmt = (
+            select(*PRODUCT_ROW_COLUMNS)
+            .where(Product.is_active == True)
+            .order_by(Product.created_at.desc())
+        )
+        if search:
+            stmt = stmt.where(Product.name.ilike(f"%{search}%"))
+        if limit:
+            stmt = stmt.limit(limit)
         result = await session.execute(stmt)
-        return result.scalars().all()
+        return [ProductRow(*row) for row in result]
 
     @staticmethod
     async def create(
@@ -115,7 +365,7 @@ class CartCRUD(BaseCRUD):
         session: AsyncSession, user_id: str, items: List[dict]
     ) -> bool:
         try:
-            async with session.begin():
+            async with transaction(session):
                 await session.execute(
                     delete(CartItem).where(CartItem.user_id == user_id)
                 )
@@ -165,28 +415,34 @@ class CartCRUD(BaseCRUD):
         unit_price: float,
     ) -> CartItem:
         """
-        加入购物车：如果有相同商品，数量叠加；否则新增，并保存 name 和 price。
+        加入购物车：单条 INSERT ... ON CONFLICT DO UPDATE ... RETURNING。
+        已有相同商品则数量叠加（并刷新 name / price），否则新增；
+        依赖 cart_items(user_id, product_id) 唯一约束，连点两次也不会产生重复行。
         """
+        CartCRUD._ensure_writable(session)
         try:
-            stmt = select(CartItem).where(
-                CartItem.user_id == user_id, CartItem.product_id == product_id
+            insert_stmt = upsert_insert(session, CartItem).values(
+                user_id=user_id,
+                product_id=product_id,
+                quantity=quantity,
+                product_name=product_name,
+                unit_price=unit_price,
             )
-            result = await session.execute(stmt)
-            cart_item = result.scalars().first()
-            if cart_item:
-                cart_item.quantity += quantity
-            else:
-                cart_item = CartItem(
-                    user_id=user_id,
-                    product_id=product_id,
-                    quantity=quantity,
-                    product_name=product_name,
-                    unit_price=unit_price,
+            stmt = (
+                insert_stmt.on_conflict_do_update(
+                    index_elements=[CartItem.user_id, CartItem.product_id],
+                    set_={
+                        "quantity": CartItem.quantity + insert_stmt.excluded.quantity,
+                        "product_name": insert_stmt.excluded.product_name,
+                        "unit_price": insert_stmt.excluded.unit_price,
+                        "updated_at": func.now(),
+                    },
                 )
-                session.add(cart_item)
-
+                .returning(CartItem)
+                .execution_options(populate_existing=True)
+            )
+            cart_item = (await session.execute(stmt)).scalar_one()
             await session.commit()
-            await session.refresh(cart_item)
             return cart_item
 
         except SQLAlchemyError as e:
@@ -241,6 +497,12 @@ class CartCRUD(BaseCRUD):
 
 
 class OrderCRUD(BaseCRUD):
+    LOAD_PROFILES = {
+        "bare": (),
+        "with_items": (selectinload(Order.items),),
+        "detail": (selectinload(Order.items), selectinload(Order.user)),
+    }
+
     @staticmethod
     async def create_with_items(
         session: AsyncSession,
@@ -249,8 +511,9 @@ class OrderCRUD(BaseCRUD):
         status: OrderStatus = OrderStatus.PENDING,
         **kwargs,
     ) -> Optional[Order]:
+        OrderCRUD._ensure_writable(session)
         try:
-            async with session.begin():
+            async with transaction(session):
                 total = sum(
                     Decimal(str(item["unit_price"])) * item["quantity"]
                     for item in items
@@ -271,7 +534,7 @@ class OrderCRUD(BaseCRUD):
                         for item in items
                     ]
                 )
-                return order
+            return order
         except SQLAlchemyError as e:
             logger.error(f"创建订单失败: {e}", exc_info=True)
             await session.rollback()
@@ -279,28 +542,60 @@ class OrderCRUD(BaseCRUD):
 
     @staticmethod
     async def mark_paid(session: AsyncSession, order_id: int) -> bool:
-        return await OrderCRUD._execute_commit(
-            session,
-            update(Order)
-            .where(Order.id == order_id)
-            .values(status=OrderStatus.PAID.value, is_paid=True),
-            "订单标记支付失败",
+        return await OrderCRUD.update_status(
+            session, order_id, OrderStatus.PAID, is_paid=True
         )
 
     @staticmethod
-    async def get_with_items(session: AsyncSession, order_id: str) -> Optional[Order]:
+    def _by_id(order_id):
+        """按 id 查订单；UUIDv7 时附带 created_at 范围，只扫对应月份分区"""
+        stmt = select(Order).where(Order.id == order_id)
+        bounds = created_at_bounds(order_id)
+        if bounds:
+            stmt = stmt.where(Order.created_at.between(*bounds))
+        return stmt
+
+    @staticmethod
+    async def get_with_items(
+        session: AsyncSession, order_id: str, profile: str = "detail"
+    ) -> Optional[Order]:
         result = await session.execute(
-            select(Order)
-            .where(Order.id == order_id)
-            .options(selectinload(Order.items), selectinload(Order.user))
+            OrderCRUD._by_id(order_id).options(*OrderCRUD._load(profile))
         )
         return result.scalars().first()
 
     @staticmethod
-    async def get_by_id(session: AsyncSession, order_id: int) -> Optional[Order]:
-        result = await session.execute(select(Order).where(Order.id == order_id))
+    async def get_by_id(
+        session: AsyncSession, order_id: int, profile: str = "bare"
+    ) -> Optional[Order]:
+        result = await session.execute(
+            OrderCRUD._by_id(order_id).options(*OrderCRUD._load(profile))
+        )
         return result.scalar_one_or_none()
 
+    @staticmethod
+    async def list_rows_by_user(session: AsyncSession, user_id) -> List[OrderRow]:
+        """
+        用户订单列表（只读）：订单、订单行各一条列查询，
+        在内存里按 order_id 归组，返回 OrderRow
+        """
+        orders = (
+            await session.execute(
+                select(*ORDER_ROW_COLUMNS)
+                .where(Order.user_id == user_id)
+                .order_by(Order.created_at.desc())
+            )
+        ).all()
+        if not orders:
+            return []
+        items: Dict[object, List[OrderItemRow]] = {row[0]: [] for row in orders}
+        result = await session.execute(
+            select(*ORDER_ITEM_ROW_COLUMNS).where(OrderItem.order_id.in_(list(items)))
+        )
+        for row in result:
+            items[row[0]].append(OrderItemRow(*row))
+        return [OrderRow(*row, items[row[0]]) for row in orders]
+
     @staticmethod
     async def list_by_user(session: AsyncSession, user_id: int) -> List[Order]:
         result = await session.execute(select(Order).where(Order.user_id == user_id))
@@ -308,16 +603,25 @@ class OrderCRUD(BaseCRUD):
 
     @staticmethod
     async def update_status(
-        session: AsyncSession, order_id: int, status: OrderStatus
+        session: AsyncSession, order_id: int, status: OrderStatus, **values
     ) -> bool:
-        result = await session.execute(
-            update(Order)
-            .where(Order.id == order_id)
-            .values(status=status.value)
-            .execution_options(synchronize_session="fetch")
-        )
-        await session.commit()
-        return result.rowcount > 0
+        """
+        走 ORM 改状态（先 FOR UPDATE 取行），让 site_stats 增量钩子拿到新旧状态。
+        """
+        OrderCRUD._ensure_writable(session)
+        try:
+            order = await session.get(Order, order_id, with_for_update=True)
+            if order is None:
+                return False
+            order.status = status
+            for key, value in values.items():
+                setattr(order, key, value)
+            await session.commit()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"更新订单状态失败: {e}", exc_info=True)
+            await session.rollback()
+            return False
 
     @staticmethod
     async def get_by_user_id(session: AsyncSession, user_id: int) -> List[Order]:
@@ -337,14 +641,20 @@ class OrderCRUD(BaseCRUD):
 
     @staticmethod
     async def list_by_status(
-        session: AsyncSession, status: OrderStatus, limit: int = 100
+        session: AsyncSession,
+        status: OrderStatus,
+        limit: int = 100,
+        since: Optional[datetime] = None,
     ) -> List[Order]:
-        """按状态筛选订单"""
-        result = await session.execute(
+        """按状态筛选订单；传 since（例如 hot_window_start()）只看这之后创建的，分区裁剪后只扫近期分区"""
+        stmt = (
             select(Order)
             .where(Order.status == status)
             .order_by(Order.created_at.desc())
             .limit(limit)
             .options(selectinload(Order.user))
         )
+        if since is not None:
+            stmt = stmt.where(Order.created_at >= since)
+        result = await session.execute(stmt)
         return list(result.scalars().all())
@@ -0,0 +1,38 @@
+# db/dialects.py
+"""
+按方言选择 INSERT 构造：PostgreSQL / SQLite 都支持
+INSERT ... ON CONFLICT DO UPDATE ... RETURNING，写法一致。
+"""
+from typing import Iterable
+
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def dialect_name(session: AsyncSession) -> str:
+    return session.get_bind().dialect.name
+
+
+def insert_for_dialect(name: str, table):
+    """返回支持 on_conflict_do_update 的 insert()；其余方言直接报错"""
+    if name == "postgresql":
+        return postgresql.insert(table)
+    if name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"不支持的数据库方言: {name}")
+
+
+def upsert_insert(session: AsyncSession, table):
+    return insert_for_dialect(dialect_name(session), table)
+
+
+def in_keys(session: AsyncSession, column, keys: Iterable):
+    """
+    批量按键查询的 WHERE 条件。PostgreSQL 用 column = ANY(:keys)：
+    不管多少个键都只有一个数组参数，asyncpg 的预编译语句可以复用；其他方言 IN (...)。
+    """
+    keys = list(keys)
+    if dialect_name(session) == "postgresql":
+        return column == any_(bindparam("keys", keys, type_=postgresql.ARRAY(column.type), unique=True))
+    return column.in_(keys)
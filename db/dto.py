@@ -0,0 +1,75 @@
+# db/dto.py
+"""
+只读列表用的轻量行对象
+
+商品目录、订单列表这类只读热路径直接 select 列，
+结果装进带 __slots__ 的 dataclass：没有 identity map / 属性插桩开销，
+可以直接交给 pydantic TypeAdapter(from_attributes=True) 批量校验。
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional
+from uuid import UUID
+
+from .models import Order, OrderItem, OrderStatus, Product, Role, User
+
+
+@dataclass(slots=True, frozen=True)
+class ProductRow:
+    id: UUID
+    name: str
+    price: Decimal
+    stock: int
+    description: Optional[str]
+    image_url: Optional[str]
+    image_file_id: Optional[str]
+
+
+@dataclass(slots=True, frozen=True)
+class OrderItemRow:
+    order_id: UUID
+    product_id: UUID
+    quantity: int
+    unit_price: Decimal
+
+
+@dataclass(slots=True, frozen=True)
+class OrderRow:
+    id: UUID
+    user_id: UUID
+    total_amount: Decimal
+    status: OrderStatus
+    created_at: datetime
+    items: List[OrderItemRow]
+
+
+@dataclass(slots=True, frozen=True)
+class UserIdentity:
+    """每个 update 都要用的用户身份：内部 id + 权限 / 封禁 / 语言"""
+    id: UUID
+    telegram_id: int
+    role: Role
+    is_admin: bool
+    is_blocked: bool
+    language: Optional[str]
+
+    @property
+    def is_staff(self) -> bool:
+        return self.role in (Role.ADMIN, Role.SUPERADMIN)
+
+
+# select() 的列顺序与上面字段顺序一一对应，行元组可以直接 *row 展开
+PRODUCT_ROW_COLUMNS = (
+    Product.id, Product.name, Product.price, Product.stock, Product.description,
+    Product.image_url, Product.image_file_id,
+)
+ORDER_ITEM_ROW_COLUMNS = (
+    OrderItem.order_id, OrderItem.product_id, OrderItem.quantity, OrderItem.unit_price,
+)
+ORDER_ROW_COLUMNS = (
+    Order.id, Order.user_id, Order.total_amount, Order.status, Order.created_at,
+)
+USER_IDENTITY_COLUMNS = (
+    User.id, User.telegram_id, User.role, User.is_admin, User.is_blocked, User.language,
+)
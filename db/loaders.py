@@ -0,0 +1,131 @@
+# db/loaders.py
+"""
+并发点查合批（DataLoader）
+
+同时在处理的多个 update 各自按主键 / telegram_id 点查时，
+BATCH_WINDOW_MS 窗口内到达的键合并成一条 `= ANY(:keys)` / `IN (...)` 查询：
+
+    product = await product_loader.load(product_id)
+
+- 同一批里重复的键只查一次，结果共享给所有等待者；
+- 批量查询用自己的会话，返回的 ORM 实体已脱离会话，只读已加载的字段；
+  需要在当前事务里修改的对象仍然用 session 上的 CRUD 方法；
+- 单个调用方被取消不影响同批其他请求；查询失败时这一批的等待者都收到同一个异常。
+"""
+import asyncio
+import logging
+from typing import (
+    Any, AsyncContextManager, Awaitable, Callable, Dict, Generic, Hashable, List, Mapping,
+    Optional, Set, TypeVar,
+)
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import get_app_settings
+from utils.metrics import registry
+from .crud import ProductCRUD, UserCRUD
+from .session import get_async_session, get_primary_read_session, get_read_session
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class BatchLoader(Generic[K, V]):
+    def __init__(
+        self,
+        name: str,
+        batch_fn: Callable[[AsyncSession, List[K]], Awaitable[Mapping[K, V]]],
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]] = get_async_session,
+        window: float = settings.batch_window_ms / 1000,
+        max_batch: int = settings.batch_max_size,
+    ):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[K, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batch_size = registry.histogram(
+            f"loader_{name}_batch_size", "每批合并的键数", buckets=BATCH_SIZE_BUCKETS
+        )
+        self.queries = registry.counter(f"loader_{name}_queries_total", "实际发出的批量查询")
+        self.loads = registry.counter(f"loader_{name}_loads_total", "load() 调用次数")
+
+    async def load(self, key: K) -> Optional[V]:
+        """不存在返回 None"""
+        self.loads.inc()
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._dispatch)
+        # shield：调用方被取消时不取消同批共享的 future
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: List[K]) -> List[Optional[V]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[K, asyncio.Future]) -> None:
+        self.batch_size.observe(len(batch))
+        self.queries.inc()
+        try:
+            async with self.session_factory() as session:
+                results = await self.batch_fn(session, list(batch))
+        except Exception as e:
+            logger.warning(f"⚠️ 批量加载 {self.name} 失败（{len(batch)} 个键）: {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # 调用方都已取消时不打印 "never retrieved"
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loads": self.loads.value,
+            "queries": self.queries.value,
+            "avg_batch": round(self.loads.value / self.queries.value, 2) if self.queries.value else 0.0,
+            "pending": len(self._pending),
+        }
+
+
+# 身份：有副本时读主库（刚注册 / 刚被封禁的用户马上就要读到），
+# 否则走只读连接池，SQLite 模式下不和写入抢唯一的写连接
+identity_loader: BatchLoader[int, Any] = BatchLoader(
+    "identity", UserCRUD.get_identities, session_factory=get_primary_read_session
+)
+# 只给 /api/users 的 user_out_cache 回填用：标签失效后紧接着回填，有副本时同样读主库
+user_loader: BatchLoader[int, Any] = BatchLoader(
+    "user", UserCRUD.get_by_telegram_ids, session_factory=get_primary_read_session
+)
+# 展示类点查走只读会话（副本 / SQLite 读连接）
+product_loader: BatchLoader[Any, Any] = BatchLoader(
+    "product", ProductCRUD.get_by_ids, session_factory=get_read_session
+)
+
+for _loader in (user_loader, identity_loader, product_loader):
+    registry.register_collector(f"loader_{_loader.name}", _loader.stats)
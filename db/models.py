@@ -1,12 +1,12 @@
 # db/models.py
-from uuid import UUID
+from uuid import UUID, uuid4
 from datetime import datetime
 from decimal import Decimal
 from typing import Optional, List
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
-from sqlalchemy import String, Integer, Numeric, ForeignKey, Text, DateTime,Enum as SQLEnum,Boolean,BigInteger
-from sqlalchemy.sql import func
+from sqlalchemy import String, Integer, Numeric, ForeignKey, Text, DateTime,Enum as SQLEnum,Boolean,BigInteger,UniqueConstraint,Index
+from sqlalchemy.sql import func, text
 from db.base import Base, UUIDMixin, TimestampMixin
 import enum
 import bcrypt
@@ -33,6 +33,10 @@ class Role(str, enum.Enum):
 # ===============================
 class User(Base, UUIDMixin, TimestampMixin):
     __tablename__ = "users"
+    __table_args__ = (
+        # /users 后台列表的 keyset 分页
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
 
     telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True, nullable=False)
     username: Mapped[str] = mapped_column(nullable=False)
@@ -81,6 +85,14 @@ class User(Base, UUIDMixin, TimestampMixin):
 # ──────────────────────────────
 class Product(Base, UUIDMixin, TimestampMixin):
     __tablename__ = "products"
+    __table_args__ = (
+        # 只索引上架商品（部分索引）
+        Index(
+            "ix_products_active_created_at", "created_at",
+            postgresql_where=text("is_active"),
+            sqlite_where=text("is_active = 1"),
+        ),
+    )
 
     # 删除了 int 主键，使用 UUIDMixin 中的 id
 
@@ -102,6 +114,10 @@ class Product(Base, UUIDMixin, TimestampMixin):
 # ──────────────────────────────
 class CartItem(Base, UUIDMixin, TimestampMixin):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        # 同一用户同一商品只有一行，加购走 ON CONFLICT 叠加数量
+        UniqueConstraint("user_id", "product_id", name="uq_cart_items_user_product"),
+    )
 
     product_id: Mapped[UUID] = mapped_column(ForeignKey("products.id"))
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
@@ -116,18 +132,32 @@ class CartItem(Base, UUIDMixin, TimestampMixin):
 # ──────────────────────────────
 # ✅ 订单表
 # ──────────────────────────────
+# PostgreSQL 上 orders / order_items 按 created_at 月分区（见迁移 b8e2f71a4c09、db/partitions.py）：
+# 数据库主键是 (id, created_at)，ORM 仍只用 id；order_items.order_id 没有数据库级外键
 class Order(Base, UUIDMixin, TimestampMixin):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_user_id_created_at", "user_id", text("created_at DESC")),
+        Index("ix_orders_status_created_at", "status", text("created_at DESC")),
+    )
 
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
-    status: Mapped[OrderStatus] = mapped_column(SQLEnum(OrderStatus), default=OrderStatus.PENDING)
-    total_amount: Mapped[Decimal] = mapped_column(Numeric(10, 2))
+    # active_history：改状态时保留旧值，site_stats 增量统计要用
+    status: Mapped[OrderStatus] = mapped_column(SQLEnum(OrderStatus), default=OrderStatus.PENDING, active_history=True)
+    total_amount: Mapped[Decimal] = mapped_column(Numeric(10, 2), active_history=True)
     is_paid: Mapped[bool] = mapped_column(default=False)
     payment_date: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
-    out_no: Mapped[str] = mapped_column(String, unique=True, nullable=False, index=True)
+    # 商户订单号：未显式传入时（按钮直接下单）自动生成
+    out_no: Mapped[str] = mapped_column(
+        String, unique=True, nullable=False, index=True, default=lambda: str(uuid4())
+    )
     user: Mapped["User"] = relationship(back_populates="orders")
-    items: Mapped[List["OrderItem"]] = relationship(back_populates="order", cascade="all, delete-orphan")
+    items: Mapped[List["OrderItem"]] = relationship(
+        back_populates="order",
+        cascade="all, delete-orphan",
+        primaryjoin="Order.id == foreign(OrderItem.order_id)",
+    )
 
 
 # ──────────────────────────────
@@ -136,12 +166,15 @@ class Order(Base, UUIDMixin, TimestampMixin):
 class OrderItem(Base, UUIDMixin, TimestampMixin):
     __tablename__ = "order_items"
 
-    order_id: Mapped[UUID] = mapped_column(ForeignKey("orders.id", ondelete="CASCADE"))
+    # 分区后引用不到 orders 的唯一列，没有外键：关联和级联删除都在 ORM 里做
+    order_id: Mapped[UUID] = mapped_column(PG_UUID(as_uuid=True), index=True)
     product_id: Mapped[UUID] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"))
     quantity: Mapped[int] = mapped_column(Integer, default=1)
     unit_price: Mapped[Decimal] = mapped_column(Numeric(12, 2))
 
-    order: Mapped["Order"] = relationship(back_populates="items")
+    order: Mapped["Order"] = relationship(
+        back_populates="items", primaryjoin="foreign(OrderItem.order_id) == Order.id"
+    )
     product: Mapped["Product"] = relationship(back_populates="order_items")
 
 
@@ -150,3 +183,19 @@ class Config(Base, UUIDMixin, TimestampMixin):
 
     key: Mapped[str] = mapped_column(String(50), unique=True, index=True)
     value: Mapped[str] = mapped_column(Text, nullable=False)
+
+
+# ──────────────────────────────
+# ✅ 站点统计（计数器分槽，id 1..SITE_STATS_SLOTS，读时相加）
+# ──────────────────────────────
+class SiteStatsCounter(Base):
+    __tablename__ = "site_stats"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    total_users: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    total_orders: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    total_revenue: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=0, nullable=False)
+    shipped_orders: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    refunded_orders: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    reconciled_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,238 @@
+# db/partitions.py
+"""
+orders / order_items 按 created_at 月分区（仅 PostgreSQL）
+
+- ensure_future_partitions()：提前建好未来几个月的分区，后台每天跑一次；
+  DEFAULT 分区里已有该月的行时先搬出来再建（否则 CREATE ... PARTITION OF 直接报错）
+- archive_partitions()：把 N 个月前、已经没有未完成订单的分区 DETACH 出来，
+  挪到冷库 schema（可选再换 tablespace）
+
+命令行：
+    python -m db.partitions maintain --months-ahead 3
+    python -m db.partitions archive --older-than 12
+"""
+import argparse
+import asyncio
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config.settings import get_app_settings
+from .base import uuid7_datetime
+from .session import engine
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+PARTITIONED_TABLES = ("orders", "order_items")
+# 归档前检查：父表 orders 的分区里不能还有这些状态的订单
+OPEN_ORDER_STATUSES = ("PENDING", "UNPAID", "PAID")
+# 建 / 归档分区前取的 pg_advisory_xact_lock：每个 API 进程都会跑维护循环，同一时刻只让一个进程改分区
+PARTITION_LOCK_ID = 0x5061_7274
+_PARTITION_RE = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, months: int) -> date:
+    y, m = divmod(d.month - 1 + months, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def hot_window_start(now: Optional[datetime] = None) -> datetime:
+    """热数据窗口起点：查询带上 created_at >= 它，分区裁剪后只扫最近几个分区"""
+    now = now or datetime.now(timezone.utc)
+    return now - timedelta(days=settings.order_hot_window_days)
+
+
+def created_at_bounds(row_id: UUID) -> Optional[Tuple[datetime, datetime]]:
+    """
+    UUIDv7 主键自带生成时间，按 id 查订单时顺手加上 created_at 范围，
+    让分区裁剪生效；v4 主键返回 None（只能扫全部分区）。
+    """
+    generated = uuid7_datetime(row_id) if isinstance(row_id, UUID) else None
+    if generated is None:
+        return None
+    slack = timedelta(days=1)  # id 在应用侧生成，created_at 取数据库时间，留出时钟误差
+    return generated - slack, generated + slack
+
+
+async def _is_postgres(conn: AsyncConnection) -> bool:
+    if conn.dialect.name != "postgresql":
+        logger.info(f"ℹ️ {conn.dialect.name} 不支持声明式分区，跳过")
+        return False
+    return True
+
+
+async def _lock_partitions(conn: AsyncConnection) -> None:
+    """事务级锁，提交 / 回滚时自动释放；后到的进程等前一个建完，再看 to_regclass 就会跳过"""
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_ID})
+
+
+async def _is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    row = await conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+             "WHERE c.relname = :t AND c.relnamespace = 'public'::regnamespace"),
+        {"t": table},
+    )
+    return row.first() is not None
+
+
+async def _create_month_partition(conn: AsyncConnection, table: str, start: date) -> None:
+    """
+    建 [start, 下月) 的分区。DEFAULT 分区里已经落了这个月的行时（维护循环停过 / 时钟跳变），
+    PostgreSQL 会拒绝建分区：DETACH DEFAULT → 建分区 → 把这些行搬进去 → 重新 ATTACH。
+    """
+    name = partition_name(table, start)
+    default = f"{table}_default"
+    bounds = {"lo": start, "hi": add_months(start, 1)}
+    create = text(
+        f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+    )
+    has_default = await conn.scalar(text("SELECT to_regclass(:n)"), {"n": f"public.{default}"})
+    stray = has_default and await conn.scalar(text(
+        f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE created_at >= :lo AND created_at < :hi)'
+    ), bounds)
+    if not stray:
+        await conn.execute(create)
+        return
+    await conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"'))
+    await conn.execute(create)
+    moved = await conn.execute(text(
+        f'WITH moved AS (DELETE FROM "{default}" WHERE created_at >= :lo AND created_at < :hi RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved'
+    ), bounds)
+    await conn.execute(text(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT'))
+    logger.warning(f"⚠️ {default} 里有 {moved.rowcount} 行属于 {name}，已搬入新分区")
+
+
+async def ensure_future_partitions(months_ahead: int = settings.partition_months_ahead) -> List[str]:
+    """创建本月到 months_ahead 个月之后的分区（已存在则跳过），返回新建的分区名"""
+    created: List[str] = []
+    this_month = month_start(datetime.now(timezone.utc).date())
+    async with engine.begin() as conn:
+        if not await _is_postgres(conn):
+            return created
+        await _lock_partitions(conn)
+        for table in PARTITIONED_TABLES:
+            if not await _is_partitioned(conn, table):
+                logger.warning(f"⚠️ {table} 还不是分区表，请先执行 alembic upgrade")
+                continue
+            for i in range(months_ahead + 1):
+                start = add_months(this_month, i)
+                name = partition_name(table, start)
+                exists = await conn.scalar(text("SELECT to_regclass(:n)"), {"n": f"public.{name}"})
+                if exists:
+                    continue
+                await _create_month_partition(conn, table, start)
+                created.append(name)
+    if created:
+        logger.info(f"✅ 已创建分区: {', '.join(created)}")
+    return created
+
+
+async def _month_partitions(conn: AsyncConnection, table: str) -> List[date]:
+    rows = await conn.execute(
+        text("SELECT c.relname FROM pg_inherits i "
+             "JOIN pg_class c ON c.oid = i.inhrelid "
+             "JOIN pg_class p ON p.oid = i.inhparent "
+             "WHERE p.relname = :t AND p.relnamespace = 'public'::regnamespace"),
+        {"t": table},
+    )
+    months = []
+    for (name,) in rows:
+        m = _PARTITION_RE.match(name)
+        if m and m.group("table") == table:
+            months.append(date(int(m.group("year")), int(m.group("month")), 1))
+    return sorted(months)
+
+
+async def archive_partitions(
+    older_than_months: int = settings.partition_archive_after_months,
+    schema: str = settings.partition_archive_schema,
+    tablespace: Optional[str] = settings.partition_archive_tablespace,
+    dry_run: bool = False,
+) -> List[str]:
+    """
+    把结束时间早于 older_than_months 个月前的分区 DETACH 到冷库 schema。
+    orders 分区里还有未完成订单（待支付 / 已支付未发货）的月份整月跳过，
+    同月的 order_items 分区跟着 orders 一起归档。
+    """
+    archived: List[str] = []
+    cutoff = add_months(month_start(datetime.now(timezone.utc).date()), -older_than_months)
+    async with engine.begin() as conn:
+        if not await _is_postgres(conn):
+            return archived
+        await _lock_partitions(conn)
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+        for month in await _month_partitions(conn, "orders"):
+            if add_months(month, 1) > cutoff:
+                continue
+            orders_part = partition_name("orders", month)
+            still_open = await conn.scalar(text(
+                f'SELECT EXISTS (SELECT 1 FROM "{orders_part}" WHERE status::text = ANY(:s))'
+            ), {"s": list(OPEN_ORDER_STATUSES)})
+            if still_open:
+                logger.warning(f"⚠️ {orders_part} 仍有未完成订单，跳过归档")
+                continue
+            for table in PARTITIONED_TABLES:
+                name = partition_name(table, month)
+                if not await conn.scalar(text("SELECT to_regclass(:n)"), {"n": f"public.{name}"}):
+                    continue
+                if dry_run:
+                    archived.append(name)
+                    continue
+                await conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+                await conn.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{schema}"'))
+                if tablespace:
+                    await conn.execute(text(f'ALTER TABLE "{schema}"."{name}" SET TABLESPACE "{tablespace}"'))
+                archived.append(f"{schema}.{name}")
+    if archived:
+        logger.info(f"📦 {'将归档' if dry_run else '已归档'}: {', '.join(archived)}")
+    return archived
+
+
+async def run_partition_maintenance_loop(interval: float = 86400, retry_interval: float = 300) -> None:
+    """后台定期补齐未来分区；失败后 retry_interval 秒重试，不等到第二天"""
+    while True:
+        try:
+            await ensure_future_partitions()
+        except Exception as e:
+            logger.error(f"❌ 分区维护失败，{retry_interval:.0f} 秒后重试: {e}", exc_info=True)
+            await asyncio.sleep(retry_interval)
+            continue
+        await asyncio.sleep(interval)
+
+
+async def _main(args: argparse.Namespace) -> None:
+    try:
+        if args.command == "maintain":
+            await ensure_future_partitions(args.months_ahead)
+        else:
+            await archive_partitions(args.older_than, dry_run=args.dry_run)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="orders / order_items 分区维护")
+    sub = parser.add_subparsers(dest="command", required=True)
+    maintain = sub.add_parser("maintain", help="创建未来分区")
+    maintain.add_argument("--months-ahead", type=int, default=settings.partition_months_ahead)
+    archive = sub.add_parser("archive", help="归档旧分区到冷库 schema")
+    archive.add_argument("--older-than", type=int, default=settings.partition_archive_after_months, help="月数")
+    archive.add_argument("--dry-run", action="store_true")
+    asyncio.run(_main(parser.parse_args()))
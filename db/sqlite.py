@@ -0,0 +1,110 @@
+# db/sqlite.py
+"""
+SQLite 模式（单机 / 测试部署，DATABASE_URL=sqlite:///...）
+
+- 每个连接都设置 WAL、synchronous=NORMAL、mmap_size、busy_timeout、外键约束；
+- 写 engine 只有 1 个连接：写事务在连接池里按 FIFO 排队，这就是串行写队列，
+  进程内的并发 handler 不会再互相撞出 "database is locked"；
+  事务用 BEGIN IMMEDIATE 一开始就拿写锁，其他进程（迁移、CLI）靠 busy_timeout 等待；
+- 读 engine 多连接 + query_only，WAL 下读不阻塞写，也总能读到已提交的数据。
+
+排队耗时记在 db_pool_wait_seconds，超过 SQLITE_WRITE_TIMEOUT 计入 db_pool_timeouts_total。
+"""
+import logging
+import sqlite3
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config.settings import AppSettings
+
+logger = logging.getLogger(__name__)
+
+# ON CONFLICT DO UPDATE 需要 3.24，RETURNING 需要 3.35（CRUD 的 upsert 都依赖它们）
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_url(url: str) -> str:
+    """sqlite:// / postgresql:// 补上异步驱动，已指定驱动的原样返回"""
+    scheme, sep, rest = url.partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+def is_sqlite_url(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def is_memory_url(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:" or "mode=memory" in url
+
+
+def check_sqlite_version() -> None:
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(
+            f"SQLite {sqlite3.sqlite_version} 过旧，需要 >= "
+            f"{'.'.join(map(str, MIN_SQLITE_VERSION))}（ON CONFLICT ... RETURNING）"
+        )
+
+
+def writer_kwargs(cfg: AppSettings, poolclass=AsyncAdaptedQueuePool) -> Dict[str, Any]:
+    return {
+        "echo": cfg.db_echo,
+        "poolclass": poolclass,
+        "pool_size": 1,
+        "max_overflow": 0,
+        "pool_timeout": cfg.sqlite_write_timeout,
+        "pool_recycle": -1,  # :memory: 库回收连接就等于清库
+        "pool_pre_ping": False,
+    }
+
+
+def reader_kwargs(cfg: AppSettings) -> Dict[str, Any]:
+    return {
+        "echo": cfg.db_echo,
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": cfg.sqlite_reader_pool_size,
+        "max_overflow": 0,
+        "pool_timeout": cfg.db_pool_timeout,
+        "pool_recycle": -1,
+        "pool_pre_ping": False,
+    }
+
+
+def configure_engine(engine: AsyncEngine, cfg: AppSettings, writer: bool) -> None:
+    """注册连接级 PRAGMA，并接管事务开始语句（pysqlite 默认的隐式事务不支持 BEGIN IMMEDIATE）"""
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={cfg.sqlite_busy_timeout_ms}",
+        f"PRAGMA mmap_size={cfg.sqlite_mmap_size}",
+        f"PRAGMA cache_size=-{cfg.sqlite_cache_size_kib}",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA foreign_keys=ON",
+    ]
+    if not writer:
+        pragmas.append("PRAGMA query_only=ON")
+    begin = "BEGIN IMMEDIATE" if writer else "BEGIN"
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None  # 由下面的 begin 事件显式开事务
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _on_begin(conn):
+        conn.exec_driver_sql(begin)
+
+    logger.info(f"🗄️ SQLite {'写' if writer else '读'} engine 已配置: {engine.url.database}")
@@ -0,0 +1,267 @@
+# db/stats.py
+"""
+站点统计计数器（site_stats，分槽）
+
+- 计数器分散在 SITE_STATS_SLOTS 行（id 1..N）里，读的时候 SUM 所有槽：
+  每次写入随机挑一个槽做增量，并发的下单 / 注册分散在不同行上，不会都排队等同一把行锁；
+- ORM 新增 User / Order、修改 Order.status / total_amount、删除 Order 时，
+  after_flush 钩子在同一事务里对一个槽做增量更新；
+- 绕过 ORM 的写入（Core INSERT / UPDATE）自己调用 bump_site_stats()；
+- reconcile_site_stats() 定期全量重算，纠正漏记（例如 Core DELETE）造成的偏差：
+  不加行锁，只把偏差作为增量补到一个槽上。
+"""
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from sqlalchemy import case, event, func, inspect, select, text, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config.settings import get_app_settings
+from utils.metrics import registry
+from .dialects import dialect_name, insert_for_dialect
+from .models import Order, OrderStatus, SiteStatsCounter, User
+from .session import get_async_session
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+RECONCILE_LOCK_ID = 0x5173_7461  # pg_advisory_xact_lock 的键，同一时刻只有一个进程对账
+REVENUE_STATUSES = frozenset({OrderStatus.PAID, OrderStatus.SHIPPED})
+COUNTER_FIELDS = ("total_users", "total_orders", "total_revenue", "shipped_orders", "refunded_orders")
+
+RECONCILE_DRIFT = registry.counter("site_stats_reconcile_drift_total", "对账发现的计数偏差（绝对值累计）")
+
+
+@dataclass(slots=True)
+class SiteStatsTotals:
+    """所有槽相加后的计数"""
+    total_users: int
+    total_orders: int
+    total_revenue: Decimal
+    shipped_orders: int
+    refunded_orders: int
+    reconciled_at: Optional[datetime] = None
+
+
+def _status(value: Any) -> Optional[OrderStatus]:
+    if value is None or isinstance(value, OrderStatus):
+        return value
+    try:
+        return OrderStatus(value)
+    except ValueError:
+        return OrderStatus[str(value)]
+
+
+def _order_contrib(status: Optional[OrderStatus], amount: Any) -> Dict[str, Any]:
+    """单个订单对各计数器的贡献"""
+    return {
+        "total_revenue": Decimal(str(amount or 0)) if status in REVENUE_STATUSES else Decimal(0),
+        "shipped_orders": int(status == OrderStatus.SHIPPED),
+        "refunded_orders": int(status == OrderStatus.REFUNDED),
+    }
+
+
+def _old_value(history, current: Any) -> Any:
+    if not history.has_changes():
+        return current
+    if history.deleted:
+        return history.deleted[0]
+    raise LookupError("旧值未加载")
+
+
+def _merge(into: Dict[str, Any], deltas: Dict[str, Any], sign: int = 1) -> None:
+    for key, value in deltas.items():
+        into[key] = into.get(key, 0) + sign * value
+
+
+def _slot() -> int:
+    return random.randint(1, max(1, settings.site_stats_slots))
+
+
+def _bump_stmt(dialect: str, deltas: Dict[str, Any], slot: Optional[int] = None):
+    insert_stmt = insert_for_dialect(dialect, SiteStatsCounter).values(id=slot or _slot(), **deltas)
+    return insert_stmt.on_conflict_do_update(
+        index_elements=[SiteStatsCounter.id],
+        set_={
+            **{k: getattr(SiteStatsCounter, k) + getattr(insert_stmt.excluded, k) for k in deltas},
+            "updated_at": func.now(),
+        },
+    )
+
+
+def _nonzero(deltas: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in deltas.items() if v}
+
+
+async def bump_site_stats(session: AsyncSession, **deltas: Any) -> None:
+    """Core 写入路径手动增量，例如 bump_site_stats(session, total_users=1)"""
+    deltas = _nonzero(deltas)
+    if deltas:
+        await session.execute(_bump_stmt(dialect_name(session), deltas))
+
+
+def _collect_deltas(session: Session) -> Dict[str, Any]:
+    deltas: Dict[str, Any] = {}
+    for obj in session.new:
+        if isinstance(obj, User):
+            _merge(deltas, {"total_users": 1})
+        elif isinstance(obj, Order):
+            _merge(deltas, {"total_orders": 1})
+            _merge(deltas, _order_contrib(_status(obj.status), obj.total_amount))
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            _merge(deltas, {"total_users": 1}, sign=-1)
+        elif isinstance(obj, Order):
+            _merge(deltas, {"total_orders": 1}, sign=-1)
+            _merge(deltas, _order_contrib(_status(obj.status), obj.total_amount), sign=-1)
+    for obj in session.dirty:
+        if not isinstance(obj, Order):
+            continue
+        attrs = inspect(obj).attrs
+        status_hist, amount_hist = attrs.status.history, attrs.total_amount.history
+        if not status_hist.has_changes() and not amount_hist.has_changes():
+            continue
+        try:
+            old_status = _old_value(status_hist, obj.status)
+            old_amount = _old_value(amount_hist, obj.total_amount)
+        except LookupError:
+            logger.debug(f"订单 {obj.id} 旧值未加载，统计留待对账")
+            continue
+        _merge(deltas, _order_contrib(_status(obj.status), obj.total_amount))
+        _merge(deltas, _order_contrib(_status(old_status), old_amount), sign=-1)
+    return _nonzero(deltas)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_site_stats(session: Session, flush_context) -> None:
+    if session.info.get("read_only"):
+        return
+    deltas = _collect_deltas(session)
+    if deltas:
+        conn = session.connection()
+        conn.execute(_bump_stmt(conn.dialect.name, deltas))
+
+
+def _totals_query():
+    """所有槽相加；读不到任何槽时 slots = 0"""
+    return select(
+        func.count(SiteStatsCounter.id).label("slots"),
+        *(func.coalesce(func.sum(getattr(SiteStatsCounter, k)), 0).label(k) for k in COUNTER_FIELDS),
+        func.max(SiteStatsCounter.reconciled_at).label("reconciled_at"),
+    )
+
+
+def _to_totals(row) -> SiteStatsTotals:
+    return SiteStatsTotals(
+        total_users=int(row.total_users),
+        total_orders=int(row.total_orders),
+        total_revenue=Decimal(str(row.total_revenue)),
+        shipped_orders=int(row.shipped_orders),
+        refunded_orders=int(row.refunded_orders),
+        reconciled_at=row.reconciled_at,
+    )
+
+
+async def read_site_stats(session: AsyncSession) -> SiteStatsTotals:
+    """读计数器（SUM 所有槽）；还没有任何槽时（新库）先对账生成"""
+    row = (await session.execute(_totals_query())).one()
+    if row.slots:
+        return _to_totals(row)
+    # 对账会 commit，用独立会话，不影响调用方事务
+    async with get_async_session() as write_session:
+        await reconcile_site_stats(write_session)
+        return _to_totals((await write_session.execute(_totals_query())).one())
+
+
+async def _try_lock(session: AsyncSession) -> bool:
+    """PostgreSQL 上抢对账的事务级 advisory lock；SQLite 只有一个写进程，不需要"""
+    if dialect_name(session) != "postgresql":
+        return True
+    return bool(
+        (await session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": RECONCILE_LOCK_ID})).scalar()
+    )
+
+
+async def reconcile_site_stats(session: AsyncSession, min_age: float = 0) -> Optional[Dict[str, Any]]:
+    """
+    全量重算，把偏差补到一个槽上；返回偏差，没轮到本进程对账时返回 None。
+
+    - 聚合和当前计数在同一条 SELECT 里读，是同一个快照：增量和业务行在同一事务提交，
+      快照里要么都可见、要么都不可见，偏差 = 真实值 - 计数器；
+    - 偏差以增量写入，和快照之后提交的增量可以交换，不需要锁住计数器行，
+      扫描期间下单 / 注册照常进行；
+    - pg_try_advisory_xact_lock 保证同一时刻只有一个进程对账（抢不到就跳过），
+      min_age 秒内别的进程刚对过账也跳过，多个 API 进程不会重复全表扫描。
+    """
+    if not await _try_lock(session):
+        await session.rollback()
+        return None
+    if min_age:
+        reconciled_at = (await session.execute(select(func.max(SiteStatsCounter.reconciled_at)))).scalar()
+        if reconciled_at is not None and reconciled_at.tzinfo is None:
+            reconciled_at = reconciled_at.replace(tzinfo=timezone.utc)  # SQLite 读回来不带时区
+        if reconciled_at is not None and datetime.now(timezone.utc) - reconciled_at < timedelta(seconds=min_age):
+            await session.rollback()
+            return None
+    totals = _totals_query().subquery()
+    order_aggregates = select(
+        func.count(Order.id).label("total_orders"),
+        func.coalesce(
+            func.sum(case((Order.status.in_(REVENUE_STATUSES), Order.total_amount), else_=0)), 0
+        ).label("total_revenue"),
+        func.count(case((Order.status == OrderStatus.SHIPPED, 1))).label("shipped_orders"),
+        func.count(case((Order.status == OrderStatus.REFUNDED, 1))).label("refunded_orders"),
+    ).subquery()
+    row = (
+        await session.execute(
+            select(
+                *(totals.c[k].label(f"counted_{k}") for k in COUNTER_FIELDS),
+                select(func.count(User.id)).scalar_subquery().label("total_users"),
+                *(order_aggregates.c[k] for k in COUNTER_FIELDS[1:]),
+            ).select_from(totals.join(order_aggregates, true()))
+        )
+    ).one()
+    drift = _nonzero({
+        k: Decimal(str(getattr(row, k))) - Decimal(str(getattr(row, f"counted_{k}")))
+        if k == "total_revenue"
+        else int(getattr(row, k)) - int(getattr(row, f"counted_{k}"))
+        for k in COUNTER_FIELDS
+    })
+    if drift:
+        logger.warning(f"⚠️ site_stats 计数偏差已纠正: {drift}")
+        RECONCILE_DRIFT.inc(float(sum(abs(v) for v in drift.values())))
+    # 偏差补到槽 1 上（+0 的 upsert 也保证新库至少有一个槽），顺带记录对账时间
+    insert_stmt = insert_for_dialect(dialect_name(session), SiteStatsCounter).values(
+        id=1, reconciled_at=datetime.now(timezone.utc), **drift
+    )
+    await session.execute(
+        insert_stmt.on_conflict_do_update(
+            index_elements=[SiteStatsCounter.id],
+            set_={
+                **{k: getattr(SiteStatsCounter, k) + getattr(insert_stmt.excluded, k) for k in drift},
+                "reconciled_at": insert_stmt.excluded.reconciled_at,
+                "updated_at": func.now(),
+            },
+        )
+    )
+    await session.commit()
+    return drift
+
+
+async def run_reconcile_loop(interval: float) -> None:
+    """后台定期对账；每个 API 进程都跑，但一个周期内只有一个进程真正扫表"""
+    while True:
+        try:
+            async with get_async_session() as session:
+                drift = await reconcile_site_stats(session, min_age=interval / 2)
+            if drift is not None:
+                logger.info("✅ site_stats 对账完成")
+        except Exception as e:
+            logger.error(f"❌ site_stats 对账失败: {e}", exc_info=True)
+        await asyncio.sleep(interval)
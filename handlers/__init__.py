@@ -1,5 +1,10 @@
 # handlers/__init__.py
-from aiogram import Router
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from config.settings import AppSettings
+from utils.fsm_storage import build_fsm_storage
+from utils.middlewares import setup_db_middlewares
 from .start import router as start_router
 from .admin_products import router as admin_products_router
 from .auth import router as auth_router
@@ -36,3 +41,18 @@ def setup_all_handlers(dp: Router):
     dp.include_router(admin_users_router)
     dp.include_router(admin_config_router)
     dp.include_router(errors_router)
+
+
+def create_bot(settings: AppSettings) -> Bot:
+    return Bot(
+        token=settings.bot_token,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+
+def create_dispatcher(settings: AppSettings, bot: Bot) -> Dispatcher:
+    """执行 handler 的 Dispatcher：API 进程（轮询 / webhook / 本地队列）和 worker.py 共用"""
+    dp = Dispatcher(storage=build_fsm_storage(settings))
+    setup_db_middlewares(dp, bot)
+    setup_all_handlers(dp)
+    return dp
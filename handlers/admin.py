@@ -7,13 +7,14 @@ from aiogram import Router, types, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,InaccessibleMessage
 from aiogram.filters import Command,or_f
 from config.settings import settings
-from db.session import get_async_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from db.models import User, Role,Product
 from sqlalchemy import select, update
 from sqlalchemy.sql import func
 from utils.formatting import _safe_reply
 from aiogram.fsm.context import FSMContext
-from services.user_service import db_get_user
+from services.identity import get_identity
+from db.dto import UserIdentity
 from utils.decorators import db_session, handle_errors
 from services.products import create_product_db
 from decimal import Decimal
@@ -32,12 +33,13 @@ def require_role(required_roles):
             if not message.from_user:
                 await _safe_reply(message, "⚠️ 用户信息获取失败")
                 return
-            async with get_async_session() as session:
-                res = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-                user = res.scalar_one_or_none()
-                if not user or user.role not in required_roles:
-                    await _safe_reply(message, "🚫 权限不足")
-                    return
+            # 中间件已注入 identity 时直接用；handler 没声明该参数时再查缓存
+            identity = kwargs.get("identity")
+            if identity is None:
+                identity = await get_identity(message.from_user.id)
+            if not identity or identity.role not in required_roles:
+                await _safe_reply(message, "🚫 权限不足")
+                return
             return await handler(message, *args, **kwargs)
         return wrapper
     return deco
@@ -45,7 +47,7 @@ def require_role(required_roles):
 def require_superadmin(handler):
     return require_role([Role.SUPERADMIN])(handler)
 
-def is_admin_user(user: Optional[User]) -> bool:
+def is_admin_user(user: Optional[User | UserIdentity]) -> bool:
     return bool(user and user.role in (Role.ADMIN, Role.SUPERADMIN))
 
 
@@ -55,7 +57,7 @@ def is_admin_user(user: Optional[User]) -> bool:
     F.text == "/admin"
 ))
 @handle_errors
-async def admin_menu(message: Message, state: FSMContext):
+async def admin_menu(message: Message, state: FSMContext, identity: Optional[UserIdentity] = None):
     if not message.from_user:
         await message.answer("⚠️ 用户信息获取失败")
         return
@@ -69,8 +71,7 @@ async def admin_menu(message: Message, state: FSMContext):
         await message.answer("❌ 你没有权限访问此菜单。")
         return
 
-    user = await db_get_user(message.from_user.id)
-    if not is_admin_user(user):
+    if not is_admin_user(identity):
         await _safe_reply(message, "❌ 你不是管理员或权限不足。")
         return
 
@@ -105,41 +106,39 @@ async def handle_step(message: types.Message, state: FSMContext):
 # -----------------------------
 @router.message(F.text.startswith("/ban"))
 @handle_errors
-async def ban_user(message: Message):
+async def ban_user(message: Message, db: AsyncSession):
     parts = (message.text or "").strip().split()
     if len(parts) != 2 or not parts[1].isdigit():
         return await _safe_reply(message, "❌ 格式：/ban <用户ID>")
     target = int(parts[1])
-    async with get_async_session() as session:
-        res = await session.execute(select(User).where(User.telegram_id == target))
-        u = res.scalar_one_or_none()
-        if not u:
-            return await _safe_reply(message, "⚠️ 用户不存在")
-        u.is_blocked = True
-        await session.commit()
+    res = await db.execute(select(User).where(User.telegram_id == target))
+    u = res.scalar_one_or_none()
+    if not u:
+        return await _safe_reply(message, "⚠️ 用户不存在")
+    u.is_blocked = True
+    await db.commit()
     await _safe_reply(message, f"✅ 用户 {target} 已被封禁")
 
 
 @router.message(F.text.startswith("/unban"))
 @handle_errors
-async def unban_user(message: Message):
+async def unban_user(message: Message, db: AsyncSession):
     parts = (message.text or "").strip().split()
     if len(parts) != 2 or not parts[1].isdigit():
         return await _safe_reply(message, "❌ 格式：/unban <用户ID>")
     target = int(parts[1])
-    async with get_async_session() as session:
-        res = await session.execute(select(User).where(User.telegram_id == target))
-        u = res.scalar_one_or_none()
-        if not u:
-            return await _safe_reply(message, "⚠️ 用户不存在")
-        u.is_blocked = False
-        await session.commit()
+    res = await db.execute(select(User).where(User.telegram_id == target))
+    u = res.scalar_one_or_none()
+    if not u:
+        return await _safe_reply(message, "⚠️ 用户不存在")
+    u.is_blocked = False
+    await db.commit()
     await _safe_reply(message, f"✅ 用户 {target} 已解封")
 
 
 @router.message(F.text.startswith("/setadmin"))
 @handle_errors
-async def set_admin(message: Message):
+async def set_admin(message: Message, db: AsyncSession):
     parts = (message.text or "").strip().split()
     if len(parts) != 3:
         return await _safe_reply(message, "❌ 格式：/setadmin <用户ID> <角色>")
@@ -147,49 +146,46 @@ async def set_admin(message: Message):
     if not target_str.isdigit() or role_str not in ("ADMIN", "SUPERADMIN"):
         return await _safe_reply(message, "❌ 参数错误：ID 必须为数字，角色为 ADMIN 或 SUPERADMIN")
     target = int(target_str)
-    async with get_async_session() as session:
-        res = await session.execute(select(User).where(User.telegram_id == target))
-        u = res.scalar_one_or_none()
-        if not u:
-            return await _safe_reply(message, "⚠️ 用户不存在")
-        u.role = Role[role_str]
-        await session.commit()
+    res = await db.execute(select(User).where(User.telegram_id == target))
+    u = res.scalar_one_or_none()
+    if not u:
+        return await _safe_reply(message, "⚠️ 用户不存在")
+    u.role = Role[role_str]
+    await db.commit()
     await _safe_reply(message, f"✅ 用户 {target} 已设为 {role_str}")
 
 
 @router.message(F.text.startswith("/resetpw"))
 @handle_errors
-async def reset_password(message: Message):
+async def reset_password(message: Message, db: AsyncSession):
     parts = (message.text or "").strip().split()
     if len(parts) != 3:
         return await _safe_reply(message, "❌ 格式：/resetpw <用户ID> <新密码>")
     target = int(parts[1])
     newpw = parts[2]
     hashed = bcrypt.hashpw(newpw.encode(), bcrypt.gensalt()).decode()
-    async with get_async_session() as session:
-        res = await session.execute(select(User).where(User.telegram_id == target))
-        u = res.scalar_one_or_none()
-        if not u:
-            return await _safe_reply(message, "⚠️ 用户不存在")
-        u.password = hashed
-        await session.commit()
+    res = await db.execute(select(User).where(User.telegram_id == target))
+    u = res.scalar_one_or_none()
+    if not u:
+        return await _safe_reply(message, "⚠️ 用户不存在")
+    u.password = hashed
+    await db.commit()
     await _safe_reply(message, f"🔑 用户 {target} 密码已重置")
 
 
 @router.message(F.text.startswith("/userinfo"))
 @handle_errors
-async def user_info(message: Message):
+async def user_info(message: Message, db: AsyncSession):
     parts = (message.text or "").strip().split()
     if len(parts) != 2 or not parts[1].isdigit():
         return await _safe_reply(message, "❌ 格式应为：/userinfo <用户ID>")
     uid = int(parts[1])
-    async with get_async_session() as session:
-        res = await session.execute(select(User).where(User.telegram_id == uid))
-        u = res.scalar_one_or_none()
-        if not u:
-            return await _safe_reply(message, "⚠️ 用户不存在")
-        txt = (
-            f"👤 用户信息\nID: {u.telegram_id}\n用户名: @{u.username or '无'}\n"
-            f"邮箱: {u.email or '未绑定'}\n状态: {'✅ 正常' if not u.is_blocked else '🚫 已封禁'}"
-        )
-        await _safe_reply(message, txt)
+    res = await db.execute(select(User).where(User.telegram_id == uid))
+    u = res.scalar_one_or_none()
+    if not u:
+        return await _safe_reply(message, "⚠️ 用户不存在")
+    txt = (
+        f"👤 用户信息\nID: {u.telegram_id}\n用户名: @{u.username or '无'}\n"
+        f"邮箱: {u.email or '未绑定'}\n状态: {'✅ 正常' if not u.is_blocked else '🚫 已封禁'}"
+    )
+    await _safe_reply(message, txt)
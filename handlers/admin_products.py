@@ -3,17 +3,21 @@ from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message,InlineKeyboardMarkup, InlineKeyboardButton,CallbackQuery
-from typing import cast,Sequence
+from typing import cast
 from db.crud import ProductCRUD
-from db.session import get_async_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from utils.formatting import _safe_reply
 import logging
-from db.models import Product
-from sqlalchemy import select
 from config.settings import settings
 from decimal import Decimal
 from aiogram.filters import Command
 from services.products import create_product_db
+from services.catalog import catalog
+from uuid import UUID
+import asyncio
+from db.models import Role
+from services.photos import warm_product_photos
+from .admin import require_role
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -41,9 +45,7 @@ async def handle_inventory_view(call: CallbackQuery):
     if call.message is None:
         await call.answer("⚠️ 消息不存在", show_alert=True)
         return
-    async with get_async_session() as session:
-        res = await session.execute(select(Product).where(Product.is_active == True))
-        products: Sequence[Product] = res.scalars().all()
+    products = await catalog.active_products()
     if not products:
         await call.answer("📭 当前库存为空")
         return
@@ -51,6 +53,35 @@ async def handle_inventory_view(call: CallbackQuery):
     await _safe_reply(call, "\n".join(lines))
 
 
+# --- 商品图片 file_id 预热 ---
+_warmup_tasks: set[asyncio.Task] = set()
+
+
+@router.message(Command("warm_photos"))
+@require_role([Role.ADMIN, Role.SUPERADMIN])
+async def warm_photos(message: Message):
+    """后台把只有 image_url 的商品图片各上传一次，回填 file_id"""
+    if _warmup_tasks:
+        return await _safe_reply(message, "⏳ 预热已在进行中")
+    bot = message.bot
+    if bot is None:
+        return await _safe_reply(message, "⚠️ Bot 不可用")
+    chat_id = settings.photo_warmup_chat_id or message.chat.id
+
+    async def run():
+        try:
+            filled, total = await warm_product_photos(bot, chat_id)
+            await message.answer(f"✅ 商品图片预热完成：{filled}/{total}")
+        except Exception as e:
+            logger.exception(f"❌ 商品图片预热失败: {e}")
+            await message.answer("❌ 商品图片预热失败，请查看日志")
+
+    task = asyncio.create_task(run())
+    _warmup_tasks.add(task)
+    task.add_done_callback(_warmup_tasks.discard)
+    await _safe_reply(message, "🔥 已开始预热商品图片，完成后会通知你")
+
+
 # --- 新增：FSM 流程 ---
 @router.callback_query(F.data == "admin_add_product")
 async def start_add_product(call: CallbackQuery, state: FSMContext):
@@ -104,20 +135,19 @@ async def product_desc(message: Message, state: FSMContext):
 
 
 @router.message(AddProductState.waiting_image, F.text == "/skip")
-async def skip_image(message: Message, state: FSMContext):
+async def skip_image(message: Message, state: FSMContext, db: AsyncSession):
     data = await state.get_data()
     name = data.get("name") or "未知商品"
     price = Decimal(data.get("price") or "0")
     stock = int(data.get("stock") or 0)
     description = data.get("description") or ""
-    async with get_async_session() as session:
-        product = await create_product_db(session=session, name=name, price=price, stock=stock, description=description, image_file_id=None)
+    product = await create_product_db(session=db, name=name, price=price, stock=stock, description=description, image_file_id=None)
     await _safe_reply(message, f"✅ 商品已添加：{product.name} ¥{product.price} 库存:{product.stock}")
     await state.clear()
 
 
 @router.message(AddProductState.waiting_image, F.photo)
-async def receive_image(message: Message, state: FSMContext):
+async def receive_image(message: Message, state: FSMContext, db: AsyncSession):
     if not message.photo:
         return await _safe_reply(message, "❌ 未检测到图片，请重试或发送 /skip 跳过")
     photo = message.photo[-1]
@@ -126,17 +156,15 @@ async def receive_image(message: Message, state: FSMContext):
     price = Decimal(data.get("price") or "0")
     stock = int(data.get("stock") or 0)
     description = data.get("description") or ""
-    async with get_async_session() as session:
-        product = await create_product_db(session=session, name=name, price=price, stock=stock, description=description, image_file_id=photo.file_id)
+    product = await create_product_db(session=db, name=name, price=price, stock=stock, description=description, image_file_id=photo.file_id)
     await _safe_reply(message, f"✅ 商品已添加（含图片）：{product.name} ¥{product.price} 库存:{product.stock}")
     await state.clear()
 
 
 # --- 编辑商品（通过 ProductCRUD） ---
 @router.callback_query(F.data == "admin_edit_product")
-async def list_products_for_edit(call: CallbackQuery, state: FSMContext):
-    async with get_async_session() as session:
-        products = await ProductCRUD.get_all(session)
+async def list_products_for_edit(call: CallbackQuery, state: FSMContext, db: AsyncSession):
+    products = await ProductCRUD.get_all(db)
     if not products:
         return await _safe_reply(call, "⚠️ 没有商品可以修改")
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -173,35 +201,33 @@ async def ask_new_value(call: CallbackQuery, state: FSMContext):
 
 
 @router.message(EditProductState.waiting_new_value)
-async def save_new_value(message: Message, state: FSMContext):
+async def save_new_value(message: Message, state: FSMContext, db: AsyncSession):
     data = await state.get_data()
     product_id = data.get("product_id")
     field = data.get("field")
     if not product_id or not field:
         return await _safe_reply(message, "❌ 状态丢失，请重新开始")
     new_text = (message.text or "").strip()
-    async with get_async_session() as session:
-        if field == "price":
-            try:
-                new_price = float(new_text)
-            except Exception:
-                return await _safe_reply(message, "❌ 价格格式错误")
-            await ProductCRUD.update_price(session, product_id, new_price)
-        else:  # stock
-            try:
-                new_stock = int(new_text)
-            except Exception:
-                return await _safe_reply(message, "❌ 库存必须为整数")
-            await ProductCRUD.update_stock(session, product_id, new_stock)
+    if field == "price":
+        try:
+            new_price = float(new_text)
+        except Exception:
+            return await _safe_reply(message, "❌ 价格格式错误")
+        await ProductCRUD.update_price(db, product_id, new_price)
+    else:  # stock
+        try:
+            new_stock = int(new_text)
+        except Exception:
+            return await _safe_reply(message, "❌ 库存必须为整数")
+        await ProductCRUD.update_stock(db, product_id, new_stock)
     await _safe_reply(message, "✅ 修改成功")
     await state.clear()
 
 
 # --- 下架 / 删除 ---
 @router.callback_query(F.data == "admin_delete_product")
-async def list_products_for_delete(call: CallbackQuery, state: FSMContext):
-    async with get_async_session() as session:
-        products = await ProductCRUD.get_all(session)
+async def list_products_for_delete(call: CallbackQuery, state: FSMContext, db: AsyncSession):
+    products = await ProductCRUD.get_all(db)
     if not products:
         return await _safe_reply(call, "⚠️ 没有商品可以下架")
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -212,12 +238,14 @@ async def list_products_for_delete(call: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("delete_product:"))
-async def delete_product(call: CallbackQuery, state: FSMContext):
+async def delete_product(call: CallbackQuery, state: FSMContext, db: AsyncSession):
     parts = (call.data or "").split(":", 1)
     if len(parts) != 2:
         return await _safe_reply(call, "❌ 数据错误")
-    product_id = int(parts[1])
-    async with get_async_session() as session:
-        await ProductCRUD.delete(session, product_id)
+    try:
+        product_id = UUID(parts[1])
+    except ValueError:
+        return await _safe_reply(call, "❌ 商品ID格式错误")
+    await ProductCRUD.delete(db, product_id)
     await _safe_reply(call, "✅ 商品已下架")
     await state.clear()
@@ -2,16 +2,22 @@
 # handlers/admin_users.py
 from utils.decorators import db_session, handle_errors
 from aiogram import Router, F
+import asyncio
 import logging
+import time
+from datetime import datetime
 from functools import wraps
-from typing import cast,Optional, Sequence
-from aiogram.types import Message,  InlineKeyboardMarkup, InlineKeyboardButton,InaccessibleMessage
+from typing import cast,Optional, Sequence, Tuple
+from uuid import UUID
+from aiogram.types import Message,  InlineKeyboardMarkup, InlineKeyboardButton,InaccessibleMessage, CallbackQuery
 from config.settings import settings
-from db.session import get_async_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from db.models import User, Role
-from sqlalchemy import select, update
+from sqlalchemy import select, update, tuple_
+from db.session import get_read_session
+from db.stats import read_site_stats
+from utils.callback_utils import encode_keyset_cursor, decode_keyset_cursor
 
-from sqlalchemy.sql import func
 from utils.formatting import _safe_reply
 from services.user_service import db_get_user
 
@@ -19,39 +25,133 @@ logger = logging.getLogger(__name__)
 router = Router()
 ADMIN_IDS = settings.admin_ids or []
 
+USERS_CB = "users"  # callback_data: users:<n|p>:<页码>:<游标>
+COUNT_TTL = 300  # 用户总数缓存秒数
+
+_approx_total = {"value": None, "at": 0.0}
+_count_refreshing: Optional[asyncio.Task] = None
+
+
+async def _refresh_user_count() -> None:
+    try:
+        async with get_read_session() as session:
+            row = await read_site_stats(session)
+        _approx_total.update(value=row.total_users, at=time.monotonic())
+    except Exception as e:
+        logger.warning(f"⚠️ 刷新用户总数失败: {e}")
+
+
+async def approx_user_count() -> Optional[int]:
+    """近似用户总数：读缓存，过期了在后台刷新，不阻塞翻页"""
+    global _count_refreshing
+    stale = time.monotonic() - _approx_total["at"] > COUNT_TTL
+    if stale and (_count_refreshing is None or _count_refreshing.done()):
+        _count_refreshing = asyncio.create_task(_refresh_user_count())
+    if _approx_total["value"] is None:
+        await asyncio.shield(_count_refreshing)  # 第一次没有缓存时等一下
+    return _approx_total["value"]
+
+
+async def fetch_users_page(
+    db: AsyncSession,
+    per_page: int,
+    cursor: Optional[Tuple[datetime, UUID]] = None,
+    backward: bool = False,
+) -> Tuple[Sequence[User], bool]:
+    """
+    keyset 分页，按 (created_at, id) 排序。
+    返回 (本页用户, 该方向上是否还有更多)。
+    """
+    key = tuple_(User.created_at, User.id)
+    stmt = select(User)
+    if backward:
+        if cursor:
+            stmt = stmt.where(key < tuple_(*cursor))
+        stmt = stmt.order_by(User.created_at.desc(), User.id.desc())
+    else:
+        if cursor:
+            stmt = stmt.where(key > tuple_(*cursor))
+        stmt = stmt.order_by(User.created_at, User.id)
+    rows = list((await db.execute(stmt.limit(per_page + 1))).scalars().all())
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+    return rows, has_more
+
+
+def _users_page_kb(users: Sequence[User], page: int, has_prev: bool, has_next: bool) -> Optional[InlineKeyboardMarkup]:
+    buttons = []
+    if has_prev:
+        first = users[0]
+        buttons.append(InlineKeyboardButton(
+            text="◀", callback_data=f"{USERS_CB}:p:{page - 1}:{encode_keyset_cursor(first.created_at, first.id)}"
+        ))
+    if has_next:
+        last = users[-1]
+        buttons.append(InlineKeyboardButton(
+            text="▶", callback_data=f"{USERS_CB}:n:{page + 1}:{encode_keyset_cursor(last.created_at, last.id)}"
+        ))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+async def _render_users_page(
+    db: AsyncSession, page: int, cursor: Optional[Tuple[datetime, UUID]] = None, backward: bool = False
+) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    per_page = getattr(settings, "items_per_page", 10)
+    users, has_more = await fetch_users_page(db, per_page, cursor, backward)
+    if not users:
+        return f"📭 没有用户 (第 {page} 页)", None
+    if backward:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    if page <= 1:
+        has_prev = False
+
+    total = await approx_user_count()
+    if total:
+        max_page = max((total + per_page - 1) // per_page, page)
+        header = f"👥 用户列表 (第 {page}/≈{max_page} 页，约 {total} 人):\n"
+    else:
+        header = f"👥 用户列表 (第 {page} 页):\n"
+    lines = [f"ID:{u.telegram_id} 用户名:@{u.username or '无'} 状态:{'🚫' if u.is_blocked else '✅'}" for u in users]
+    return header + "\n".join(lines), _users_page_kb(users, page, has_prev, has_next)
+
+
 @router.message(F.text.startswith("/users"))
-async def list_or_show_user(message: Message):
-    # 参数解析与分页
+async def list_or_show_user(message: Message, db: AsyncSession):
     parts = (message.text or "").strip().split()
-    per_page = getattr(settings, "items_per_page", 10)
-    async with get_async_session() as session:
-        # 单用户查询 /users <tg_id>
-        if len(parts) == 2 and parts[1].isdigit():
-            user_id = int(parts[1])
-            res = await session.execute(select(User).where(User.telegram_id == user_id))
-            u = res.scalar_one_or_none()
-            if not u:
-                return await _safe_reply(message, "⚠️ 用户不存在")
-            txt = (
-                f"👤 用户信息\nID: {u.telegram_id}\n用户名: @{u.username or '无'}\n"
-                f"状态: {'✅' if not u.is_blocked else '🚫 封禁'}"
-            )
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="设置为管理员", callback_data=f"setadmin:{u.telegram_id}")]
-            ])
-            await _safe_reply(message, txt, reply_markup=kb)
-            return
-
-        # 列表（分页）
-        page = int(parts[1]) if len(parts) >= 2 and parts[1].isdigit() else 1
-        total = await session.scalar(select(func.count()).select_from(User)) or 0
-        max_page = (total + per_page - 1) // per_page if total else 1
-        if page < 1: page = 1
-        if page > max_page: page = max_page
-        offset = (page - 1) * per_page
-        res = await session.execute(select(User).offset(offset).limit(per_page))
-        users = res.scalars().all()
-        if not users:
-            return await _safe_reply(message, f"📭 没有用户 (第 {page} 页)")
-        lines = [f"ID:{u.telegram_id} 用户名:@{u.username or '无'} 状态:{'🚫' if u.is_blocked else '✅'}" for u in users]
-        await _safe_reply(message, f"👥 用户列表 (第 {page} 页):\n" + "\n".join(lines))
+    # 单用户查询 /users <tg_id>
+    if len(parts) == 2 and parts[1].isdigit():
+        user_id = int(parts[1])
+        res = await db.execute(select(User).where(User.telegram_id == user_id))
+        u = res.scalar_one_or_none()
+        if not u:
+            return await _safe_reply(message, "⚠️ 用户不存在")
+        txt = (
+            f"👤 用户信息\nID: {u.telegram_id}\n用户名: @{u.username or '无'}\n"
+            f"状态: {'✅' if not u.is_blocked else '🚫 封禁'}"
+        )
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="设置为管理员", callback_data=f"setadmin:{u.telegram_id}")]
+        ])
+        await _safe_reply(message, txt, reply_markup=kb)
+        return
+
+    # 列表（第一页），之后用 ◀ ▶ 按钮翻页
+    text, kb = await _render_users_page(db, page=1)
+    await _safe_reply(message, text, reply_markup=kb)
+
+
+@router.callback_query(F.data.startswith(f"{USERS_CB}:"))
+async def page_users(call: CallbackQuery, db: AsyncSession):
+    parts = (call.data or "").split(":")
+    cursor = decode_keyset_cursor(parts[3]) if len(parts) == 4 else None
+    if cursor is None or parts[1] not in ("n", "p") or not parts[2].isdigit():
+        return await _safe_reply(call, "❌ 数据错误", show_alert=True)
+    text, kb = await _render_users_page(
+        db, page=max(int(parts[2]), 1), cursor=cursor, backward=parts[1] == "p"
+    )
+    await _safe_reply(call, text, reply_markup=kb)
+    await call.answer()
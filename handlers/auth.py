@@ -3,12 +3,16 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from db.session import transaction
+from db.dialects import dialect_name, upsert_insert
+from db.stats import bump_site_stats
+from services.identity import get_identity
+from db.dto import UserIdentity
+from sqlalchemy import Boolean, literal_column, select, func, update
 from typing import Optional, Dict
 import logging
 from datetime import datetime, timezone
 from db.models import User
-from db.session import get_async_session
 from config.settings import settings
 from utils.formatting import _safe_reply
 from aiogram.fsm.state import StatesGroup, State
@@ -71,7 +75,7 @@ async def process_email(message: Message, state: FSMContext):
 
 
 @router.message(RegisterForm.waiting_for_phone)
-async def process_phone(message: Message, state: FSMContext):
+async def process_phone(message: Message, state: FSMContext, db: AsyncSession):
     if not message.text:
         await _safe_reply(message, "❌ 手机号不能为空")
         return
@@ -84,15 +88,14 @@ async def process_phone(message: Message, state: FSMContext):
     data = await state.get_data()
     email = data.get("email")
 
-    async with get_async_session() as session:
-        async with session.begin():
-            stmt = select(User).where(User.telegram_id == message.from_user.id)
-            result = await session.execute(stmt)
-            user = result.scalar_one_or_none()
+    async with transaction(db):
+        stmt = select(User).where(User.telegram_id == message.from_user.id)
+        result = await db.execute(stmt)
+        user = result.scalar_one_or_none()
 
-            if user:
-                user.email = email
-                user.phone = phone
+        if user:
+            user.email = email
+            user.phone = phone
 
     await state.clear()
     await _safe_reply(message, f"✅ 注册成功！\n邮箱: {email}\n手机号: {phone}")
@@ -101,86 +104,100 @@ async def process_phone(message: Message, state: FSMContext):
 # 账户信息
 # -------------------------------
 @router.message(Command("account"))
-async def handle_account(message: Message):
+async def handle_account(message: Message, db: AsyncSession):
     if not message.from_user:
         await _safe_reply(message, "⚠️ 无法获取用户信息")
         return
     
-    async with get_async_session() as session:
-        stmt = select(User).where(User.telegram_id == message.from_user.id)
-        result = await session.execute(stmt)
-        user = result.scalar_one_or_none()
+    stmt = select(User).where(User.telegram_id == message.from_user.id)
+    result = await db.execute(stmt)
+    user = result.scalar_one_or_none()
 
-        if not user:
-            await _safe_reply(message, "⚠️ 你还没有注册，请先使用 /register")
-            return
-
-        text = (
-            f"👤 账户信息：\n"
-            f"ID: {user.telegram_id}\n"
-            f"用户名: {user.username or '-'}\n"
-            f"邮箱: {user.email or '-'}\n"
-            f"手机号: {user.phone or '-'}\n"
-            f"语言: {user.language or '未设置'}\n"
-            f"注册时间: {user.created_at}\n"
-        )
-
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="✏ 修改邮箱", callback_data="profile_edit_email")],
-                [InlineKeyboardButton(text="📱 修改手机号", callback_data="profile_edit_phone")],
-                [InlineKeyboardButton(text="🌐 切换语言", callback_data="profile_edit_language")],
-            ]
-        )
-
-        await _safe_reply(message, text, reply_markup=kb)
+    if not user:
+        await _safe_reply(message, "⚠️ 你还没有注册，请先使用 /register")
+        return
+
+    text = (
+        f"👤 账户信息：\n"
+        f"ID: {user.telegram_id}\n"
+        f"用户名: {user.username or '-'}\n"
+        f"邮箱: {user.email or '-'}\n"
+        f"手机号: {user.phone or '-'}\n"
+        f"语言: {user.language or '未设置'}\n"
+        f"注册时间: {user.created_at}\n"
+    )
+
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="✏ 修改邮箱", callback_data="profile_edit_email")],
+            [InlineKeyboardButton(text="📱 修改手机号", callback_data="profile_edit_phone")],
+            [InlineKeyboardButton(text="🌐 切换语言", callback_data="profile_edit_language")],
+        ]
+    )
+
+    await _safe_reply(message, text, reply_markup=kb)
 
 # -------------------------------
 # 工具函数
 # -------------------------------
 async def get_or_create_user(session: AsyncSession, tg_user: TgUser | None) -> DbUser:
+    """
+    单条 INSERT ... ON CONFLICT (telegram_id) DO UPDATE ... RETURNING：
+    新用户插入，老用户只刷新 last_active，不再 SELECT ... FOR UPDATE 锁行。
+    是否新插入由数据库明确返回（PostgreSQL 的 xmax = 0），新用户才给 site_stats 加一。
+    """
     if tg_user is None:
         raise ValueError("Telegram 用户信息为空")
-    async with session.begin():
-        stmt = select(DbUser).where(DbUser.telegram_id == tg_user.id).with_for_update()
-        result = await session.execute(stmt)
-        user = result.scalar_one_or_none()
-        
-        now = datetime.now(timezone.utc)
-
-        if not user:
-            user = User(
-                telegram_id=tg_user.id,
-                username=tg_user.username,
-                first_name=tg_user.first_name,
-                last_name=tg_user.last_name,
-                is_admin=tg_user.id in settings.admin_ids,
-                created_at=now,
+    now = datetime.now(timezone.utc)
+    insert_stmt = upsert_insert(session, DbUser).values(
+        telegram_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+        is_admin=tg_user.id in settings.admin_ids,
+        created_at=now,
+        last_active=now,
+    )
+    async with transaction(session):
+        if dialect_name(session) == "postgresql":
+            # 本语句插入的行 xmax = 0，冲突后走 UPDATE 的行 xmax 是本事务 id
+            stmt = (
+                insert_stmt.on_conflict_do_update(
+                    index_elements=[DbUser.telegram_id],
+                    set_={"last_active": insert_stmt.excluded.last_active},
+                )
+                .returning(DbUser, literal_column("xmax = 0", Boolean).label("inserted"))
+                .execution_options(populate_existing=True)
             )
-            session.add(user)
-
-        user.last_active = now
+            user, inserted = (await session.execute(stmt)).one()
+        else:
+            # SQLite 没有 xmax：DO NOTHING 有返回行就是新插入，否则再刷新 last_active
+            stmt = (
+                insert_stmt.on_conflict_do_nothing(index_elements=[DbUser.telegram_id])
+                .returning(DbUser)
+                .execution_options(populate_existing=True)
+            )
+            user = (await session.execute(stmt)).scalar_one_or_none()
+            inserted = user is not None
+            if user is None:
+                stmt = (
+                    update(DbUser)
+                    .where(DbUser.telegram_id == tg_user.id)
+                    .values(last_active=now)
+                    .returning(DbUser)
+                    .execution_options(populate_existing=True)
+                )
+                user = (await session.execute(stmt)).scalar_one()
+        if inserted:
+            await bump_site_stats(session, total_users=1)
         return user
 
 
-async def is_user_blocked(db: AsyncSession, telegram_id: int) -> bool:
-    stmt = select(User).where(User.telegram_id == telegram_id)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
-    return user.is_blocked if user else False
-
-
-async def update_user_activity(db: AsyncSession, user_id: int) -> None:
-    now = datetime.now(timezone.utc)
-    async with db.begin():
-        stmt = select(User).where(User.telegram_id == user_id).with_for_update()
-        result = await db.execute(stmt)
-        user = result.scalar_one_or_none()
-        if user:
-            user.last_active = now
+async def is_user_blocked(telegram_id: int) -> bool:
+    identity = await get_identity(telegram_id)
+    return identity.is_blocked if identity else False
 
 
-async def get_cached_user(session: AsyncSession, telegram_id: int) -> Optional[User]:
-    stmt = select(User).where(User.telegram_id == telegram_id)
-    result = await session.execute(stmt)
-    return result.scalar_one_or_none()
+async def get_cached_user(telegram_id: int) -> Optional[UserIdentity]:
+    """身份缓存里的用户（id / 角色 / 封禁 / 语言）；要改资料请另查 ORM 实体"""
+    return await get_identity(telegram_id)
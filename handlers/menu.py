@@ -1,15 +1,18 @@
 # handlers/menu.py
 from uuid import UUID
 from aiogram import Router, types, F
-from sqlalchemy import select
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery,InlineKeyboardMarkup, InlineKeyboardButton,BufferedInputFile
+from aiogram.types import Message, CallbackQuery
 import logging
-from db.session import get_async_session
-from db.models import Product
-from db.crud import ProductCRUD, OrderCRUD, UserCRUD
-from handlers.payment import PaymentService, generate_payment_qr
-from utils.formatting import _safe_reply, build_product_menu, build_product_detail_kb
+from db.session import mark_recent_write
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.crud import OrderCRUD
+from services.identity import get_identity
+from services.views import product_buy_list_view, product_detail_view, product_menu_view, view_lang
+from db.dto import UserIdentity
+from typing import Optional
+from db.loaders import product_loader
+from utils.formatting import _safe_reply
 from utils.decorators import handle_errors
 
 router = Router()
@@ -20,79 +23,54 @@ logger = logging.getLogger(__name__)
 # 展示商品菜单
 # ----------------------------
 @router.message(Command("menu"))
-async def handle_menu_command(message: Message):
-    await show_product_menu_logic(message)
+async def handle_menu_command(message: Message, identity: Optional[UserIdentity] = None):
+    await show_product_menu_logic(message, view_lang(identity))
     
 @router.callback_query(F.data == "open_menu")
-async def handle_menu_callback(callback: CallbackQuery):
+async def handle_menu_callback(callback: CallbackQuery, identity: Optional[UserIdentity] = None):
     await callback.answer()
-    await show_product_menu_logic(callback)
+    await show_product_menu_logic(callback, view_lang(identity))
     
-async def show_product_menu_logic(event: Message | CallbackQuery):
-    async with get_async_session() as session:
-        stmt = select(Product).where(Product.is_active == True)
-        result = await session.execute(stmt)
-        products = result.scalars().all()
-
-        if not products:
-            await _safe_reply(event, "❌ 暂无商品上架")
-            return
+async def show_product_menu_logic(event: Message | CallbackQuery, lang: str = "zh"):
+    # 渲染结果按 (目录版本, 语言) 缓存，目录不变时不再重建键盘
+    view = await product_menu_view(lang)
+    if view is None:
+        await _safe_reply(event, "❌ 暂无商品上架")
+        return
 
-        kb = build_product_menu(products)
-        await _safe_reply(event, "🛍️ 请选择商品：", reply_markup=kb)
+    await _safe_reply(event, view.caption, reply_markup=view.reply_markup)
   
 @router.message(Command("products"))
 @handle_errors
-async def handle_products(message: Message):
-    async with get_async_session() as session:
-        products = await ProductCRUD.get_all(session)
-        products = [p for p in products if p.is_active]
-        if not products:
-            await _safe_reply(message,"目前没有商品")
-            return
+async def handle_products(message: Message, identity: Optional[UserIdentity] = None):
+    view = await product_buy_list_view(view_lang(identity))
+    if view is None:
+        await _safe_reply(message,"目前没有商品")
+        return
 
-        # 生成 InlineKeyboardMarkup（二维列表）
-        inline_buttons = [
-            [InlineKeyboardButton(text=f"{p.name} — ¥{p.price} (库存: {p.stock})", callback_data=f"buy:{p.id}")]
-            for p in products
-        ]
-        kb = InlineKeyboardMarkup(inline_keyboard=inline_buttons)
-
-        await _safe_reply(message,
-            "📦 可选商品列表：点击下方按钮直接购买",
-            reply_markup=kb,
-        )
+    await _safe_reply(message, view.caption, reply_markup=view.reply_markup)
 # ----------------------------
 # 商品详情
 # ----------------------------
 @router.callback_query(F.data.startswith("product_detail:"))
-async def show_product_detail(callback: types.CallbackQuery):
+async def show_product_detail(callback: types.CallbackQuery, identity: Optional[UserIdentity] = None):
     if not callback.data:
         await _safe_reply(callback, "⚠️ 数据异常", show_alert=True)
         return
 
-    async with get_async_session() as session:
-        try:
-            product_id = UUID(callback.data.split(":")[1])
-            product = await session.get(Product, product_id)
-
-            if not product:
-                await _safe_reply(callback, "❌ 商品不存在", show_alert=True)
-                return
+    try:
+        product_id = UUID(callback.data.split(":")[1])
+        view = await product_detail_view(product_id, view_lang(identity))
 
-            text = (
-                f"📦 商品：{product.name}\n"
-                f"💰 价格：¥{product.price}\n"
-                f"📝 介绍：{product.description or '暂无介绍'}"
-            )
+        if view is None:
+            await _safe_reply(callback, "❌ 商品不存在", show_alert=True)
+            return
 
-            # ✅ 同步函数，不需要 await
-            kb = build_product_detail_kb(product.id)
-            await _safe_reply(callback, text, reply_markup=kb)
+        await _safe_reply(callback, view.caption, reply_markup=view.reply_markup)
 
-        except ValueError as e:
-            logger.exception(f"商品详情展示失败: {e}")
-            await callback.answer("❌ 加载失败，请稍后重试", show_alert=True)
+    except ValueError as e:
+        logger.exception(f"商品详情展示失败: {e}")
+        await callback.answer("❌ 加载失败，请稍后重试", show_alert=True)
 
 
 # ----------------------------
@@ -100,7 +78,7 @@ async def show_product_detail(callback: types.CallbackQuery):
 # ----------------------------
 @router.callback_query(lambda c: c.data and c.data.startswith("buy:"))
 @handle_errors
-async def handle_buy(callback: CallbackQuery):
+async def handle_buy(callback: CallbackQuery, db: AsyncSession):
     if not callback.data:
         await _safe_reply(callback, "⚠️ 参数错误")
         return
@@ -111,50 +89,42 @@ async def handle_buy(callback: CallbackQuery):
         await _safe_reply(callback, "⚠️ 商品ID格式错误")
         return
 
-    async with get_async_session() as session:
-        # 获取商品
-        product = await ProductCRUD.get_by_id(session, product_id)
-        if not product:
-            await _safe_reply(callback, "❌ 商品不存在")
-            return
+    # 获取商品
+    product = await product_loader.load(product_id)
+    if not product:
+        await _safe_reply(callback, "❌ 商品不存在")
+        return
 
-        # 获取用户
-        user = await UserCRUD.get_by_telegram_id(session, callback.from_user.id)
-        if not user:
-            await _safe_reply(callback, "⚠️ 用户未注册")
-            return
+    # 获取用户
+    user = await get_identity(callback.from_user.id)
+    if not user:
+        await _safe_reply(callback, "⚠️ 用户未注册")
+        return
 
-        # 创建订单和订单项
-        items = [{
-            "product_id": product.id,
-            "quantity": 1,
-            "unit_price": product.price
-        }]
-        order = await OrderCRUD.create_with_items(session, user.id, items)
-        if not order:
-            await _safe_reply(callback, "❌ 创建订单失败")
-            return
+    # 创建订单和订单项
+    items = [{
+        "product_id": product.id,
+        "quantity": 1,
+        "unit_price": product.price
+    }]
+    order = await OrderCRUD.create_with_items(db, user.id, items)
+    if not order:
+        await _safe_reply(callback, "❌ 创建订单失败")
+        return
+    mark_recent_write(callback.from_user.id)
 
-        # 生成支付链接和二维码
-        payment_url = PaymentService.create_payment(
-            order_id=str(order.id),
-            amount=float(product.price),  # ✅ Decimal 转 float
-        )
-        qr_img = await generate_payment_qr(payment_url)
-        photo = BufferedInputFile(qr_img.getvalue(), filename="qrcode.png")
-
-        # 回复用户
-        if callback.message and not isinstance(callback.message, types.InaccessibleMessage):
-            await _safe_reply(callback.message, "✅ 下单成功！...", reply_markup=None)
-        else:
-            await callback.answer("✅ 下单成功！消息不可用，使用弹窗显示", show_alert=True)
+    # 回复用户
+    if callback.message and not isinstance(callback.message, types.InaccessibleMessage):
+        await _safe_reply(callback.message, "✅ 下单成功！...", reply_markup=None)
+    else:
+        await callback.answer("✅ 下单成功！消息不可用，使用弹窗显示", show_alert=True)
             
 
 # ----------------------------
 # 下单并支付（引用 CartService）
 # ----------------------------
 @router.callback_query(lambda c: c.data and c.data.startswith("pay:"))
-async def handle_pay(callback: CallbackQuery):
+async def handle_pay(callback: CallbackQuery, db: AsyncSession):
     data = callback.data
     if not data:
         await _safe_reply(callback, "数据异常")
@@ -172,24 +142,23 @@ async def handle_pay(callback: CallbackQuery):
         await _safe_reply(callback, "支付参数无效")
         return
 
-    async with get_async_session() as session:
-        try:
-            from services.orders import mark_order_paid, get_order_by_id
+    try:
+        from services.orders import mark_order_paid, get_order_by_id
 
-            success = await mark_order_paid(db=session, order_id=order_id, payment_id=payment_id)
-            if not success:
-                await _safe_reply(callback, "❌ 订单不存在或支付失败")
-                return
+        success = await mark_order_paid(db=db, order_id=order_id, payment_id=payment_id)
+        if not success:
+            await _safe_reply(callback, "❌ 订单不存在或支付失败")
+            return
 
-            order = await get_order_by_id(session=session, order_id=order_id)
-            if not order:
-                await _safe_reply(callback, "❌ 无法获取订单详情")
-                return
+        order = await get_order_by_id(session=db, order_id=order_id)
+        if not order:
+            await _safe_reply(callback, "❌ 无法获取订单详情")
+            return
 
-            text = f"✅ 支付成功！\n📦 订单号: {order.id}\n💵 总金额: ¥{order.total_amount}"
-            await _safe_reply(callback, text)
+        text = f"✅ 支付成功！\n📦 订单号: {order.id}\n💵 总金额: ¥{order.total_amount}"
+        await _safe_reply(callback, text)
 
-        except Exception as e:
-            logger.exception(f"支付失败: {e}")
-            await _safe_reply(callback, "❌ 支付失败，请稍后重试")
+    except Exception as e:
+        logger.exception(f"支付失败: {e}")
+        await _safe_reply(callback, "❌ 支付失败，请稍后重试")
             
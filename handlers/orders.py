@@ -10,6 +10,7 @@ from sqlalchemy import select
 from utils.formatting import _safe_reply,format_order_detail,parse_order_id
 from utils.decorators import handle_errors, db_session
 from db import get_async_session
+from db.session import get_read_session
 from db.crud import OrderCRUD
 from config.settings import settings
 from services import orders as order_service
@@ -25,7 +26,7 @@ def is_admin(user_id: int) -> bool:
 # 用户查询订单详情
 # -----------------------------
 @router.message(Command("order"))
-async def get_order_handler(message: types.Message):
+async def get_order_handler(message: types.Message, db: AsyncSession):
     """
     用户输入 /order <订单ID> 查询订单详情
     """
@@ -41,19 +42,18 @@ async def get_order_handler(message: types.Message):
         await _safe_reply(message,"❌ 订单ID格式不正确")
         return
 
-    async with get_async_session() as session:
-        order = await order_service.get_order_by_id(session, order_id)
-        if not order:
-            await _safe_reply(message,"❌ 未找到该订单")
-            return
+    order = await order_service.get_order_by_id(db, order_id)
+    if not order:
+        await _safe_reply(message,"❌ 未找到该订单")
+        return
 
-        await _safe_reply(message,
-            f"📦 订单详情:\n"
-            f"订单ID: {order.id}\n"
-            f"用户ID: {order.user_id}\n"
-            f"总金额: ¥{order.total_amount}\n"
-            f"状态: {getattr(order.status, 'value', order.status)}"
-        )
+    await _safe_reply(message,
+        f"📦 订单详情:\n"
+        f"订单ID: {order.id}\n"
+        f"用户ID: {order.user_id}\n"
+        f"总金额: ¥{order.total_amount}\n"
+        f"状态: {getattr(order.status, 'value', order.status)}"
+    )
 
 # -----------------------------
 # 用户查询自己的所有订单
@@ -68,7 +68,7 @@ async def list_user_orders(message: types.Message):
         await _safe_reply(message,"❌ 无法识别用户")
         return
 
-    async with get_async_session() as session:
+    async with get_read_session(user_id) as session:
         orders = await order_service.get_orders_by_user(user_id, session)
         if not orders:
             await _safe_reply(message,"📭 你还没有订单")
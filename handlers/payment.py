@@ -3,7 +3,8 @@ import asyncio
 import logging
 from io import BytesIO
 import qrcode
-from db.session import get_async_session
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.session import transaction
 from db.models import Order, OrderStatus 
 from sqlalchemy import select
 from qrcode.constants import ERROR_CORRECT_L
@@ -77,7 +78,7 @@ async def pay_command(message: types.Message):
     await message.answer(f"请扫码支付：\n{qr_url}")
 
 @router.message(lambda m: m.text.startswith("/callback"))
-async def callback_demo(message: types.Message):
+async def callback_demo(message: types.Message, db: AsyncSession):
     data = {"out_no": "test123", "amount": 9.99, "sign": "abc"}
     out_no = data["out_no"]
     success = PaymentService.verify_callback(data)
@@ -85,18 +86,17 @@ async def callback_demo(message: types.Message):
     await message.answer("✅ 支付成功" if success else "❌ 支付验证失败")
 
     # 更新订单状态
-    async with get_async_session() as session:
-        async with session.begin():
-            stmt = select(Order).where(Order.out_no == out_no)
-            result = await session.execute(stmt)
-            order = result.scalar_one_or_none()
-            if order and order.status != "paid":              
-                order.status = OrderStatus.PAID 
-                # 通知用户
-                await bot.send_message(
-                    chat_id=order.user.telegram_id,
-                    text=f"✅ 您的订单 {out_no} 已支付成功！"
-                )
+    async with transaction(db):
+        stmt = select(Order).where(Order.out_no == out_no)
+        result = await db.execute(stmt)
+        order = result.scalar_one_or_none()
+        if order and order.status != "paid":              
+            order.status = OrderStatus.PAID 
+            # 通知用户
+            await bot.send_message(
+                chat_id=order.user.telegram_id,
+                text=f"✅ 您的订单 {out_no} 已支付成功！"
+            )
 
     return "success"
 
@@ -109,7 +109,7 @@ async def get_payment_service(sandbox: bool = False) -> PaymentService:
 # ──────────────────────────────
 # ✅ 生成二维码（同步 + 异步封装）
 # ──────────────────────────────
-def _generate_qr_sync(payment_url: str) -> BytesIO:
+def _generate_qr_sync(payment_url: str) -> bytes:
     qr = qrcode.QRCode(
         version=1,
         error_correction=ERROR_CORRECT_L,
@@ -121,11 +121,11 @@ def _generate_qr_sync(payment_url: str) -> BytesIO:
     img = qr.make_image(fill_color="black", back_color="white")
     buf = BytesIO()
     img.save(buf)
-    buf.seek(0)
-    return buf
+    return buf.getvalue()
 
 async def generate_payment_qr(payment_url: str) -> BytesIO:
-    return await asyncio.to_thread(_generate_qr_sync, payment_url)
+    """支付链接（Stripe 会话）一次性使用，不进 qr_cache：只在线程池里渲染"""
+    return BytesIO(await asyncio.to_thread(_generate_qr_sync, payment_url))
 
 # ──────────────────────────────
 # ✅ 流程封装：处理支付请求
@@ -152,6 +152,7 @@ async def handle_generate_payment_qr(message: Message):
 
     try:
         amount = int(parts[1])
+        # 每次都是新的 Stripe 会话，二维码不会再被用到：直接上传，不写缓存
         link, qr_image = await handle_payment_request(message.from_user.id, amount)
         photo = BufferedInputFile(qr_image.getvalue(), filename="qrcode.png")
         await message.answer_photo(photo=photo, caption=f"✅ 请扫码完成支付\n{link}")
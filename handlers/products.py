@@ -4,17 +4,17 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from db.session import get_async_session,settings
-from db.models import Product, User
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message, BufferedInputFile
+from db.session import mark_recent_write, settings
+from db.models import Product
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from utils.decorators import handle_errors, db_session
-from db.crud import ProductCRUD, OrderCRUD, CartCRUD
+from db.crud import OrderCRUD, CartCRUD
 from utils.formatting import format_product_detail, _safe_reply
 from uuid import UUID
 from decimal import Decimal
 from services.products import get_all_products
-from handlers.payment import generate_payment_qr
-from services.payment_service import PaymentService
+from services.identity import get_identity
+from db.loaders import product_loader
 logger = logging.getLogger(__name__)
 router = Router()
 admin_ids = settings.admin_ids 
@@ -44,7 +44,7 @@ async def list_products(message: Message):
 # -----------------------------
 @router.callback_query(F.data.startswith("buy:"))
 @handle_errors
-async def handle_buy(callback: CallbackQuery):
+async def handle_buy(callback: CallbackQuery, db: AsyncSession):
     if not callback.data:
         await _safe_reply(callback,"⚠️ 参数错误", show_alert=True)
         return
@@ -55,48 +55,41 @@ async def handle_buy(callback: CallbackQuery):
         await _safe_reply(callback,"⚠️ 商品ID格式错误", show_alert=True)
         return
 
-    async with get_async_session() as db:
-        product = await ProductCRUD.get_by_id(db, product_id)
-        if not product:
-            await _safe_reply(callback,"❌ 商品不存在", show_alert=True)
-            return
-
-        # 获取用户
-        result = await db.execute(select(User).where(User.telegram_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await _safe_reply(callback, "⚠️ 用户未注册", show_alert=True)
-            return
-
-        # 创建订单和订单项
-        items = [{"product_id": product.id, "quantity": 1, "unit_price": product.price}]
-        order = await OrderCRUD.create_with_items(db, user.id, items)
-        if not order:
-            await _safe_reply(callback, "❌ 创建订单失败", show_alert=True)
-            return
-   
-        # 生成支付链接
-        payment_url = PaymentService.create_payment(str(order.id), float(product.price))
-        qr_img = await generate_payment_qr(payment_url)
-        photo = BufferedInputFile(qr_img.getvalue(), filename="qrcode.png")
-  
-
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="去支付", callback_data=f"pay:{order.id}")]
-        ])
+    product = await product_loader.load(product_id)
+    if not product:
+        await _safe_reply(callback,"❌ 商品不存在", show_alert=True)
+        return
+
+    # 获取用户
+    user = await get_identity(callback.from_user.id)
+    if not user:
+        await _safe_reply(callback, "⚠️ 用户未注册", show_alert=True)
+        return
+
+    # 创建订单和订单项
+    items = [{"product_id": product.id, "quantity": 1, "unit_price": product.price}]
+    order = await OrderCRUD.create_with_items(db, user.id, items)
+    if not order:
+        await _safe_reply(callback, "❌ 创建订单失败", show_alert=True)
+        return
+    mark_recent_write(callback.from_user.id)
+
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="去支付", callback_data=f"pay:{order.id}")]
+    ])
         
-        msg = callback.message
-        caption = f"✅ 下单成功！\n🧾 订单号: {order.id}\n📦 商品: {product.name}\n💵 金额: ¥{product.price:.2f}"
+    msg = callback.message
+    caption = f"✅ 下单成功！\n🧾 订单号: {order.id}\n📦 商品: {product.name}\n💵 金额: ¥{product.price:.2f}"
 
-        if isinstance(msg, Message):
-            await _safe_reply(callback, caption, reply_markup=kb)
+    if isinstance(msg, Message):
+        await _safe_reply(callback, caption, reply_markup=kb)
           
-        else:       
-            await _safe_reply(callback, 
-                f"✅ 下单成功！\n🧾 订单号: {order.id}\n📦 商品: {product.name}\n💵 金额: ¥{product.price:.2f}",
-                reply_markup=kb,
-                show_alert=False
-            )
+    else:       
+        await _safe_reply(callback, 
+            f"✅ 下单成功！\n🧾 订单号: {order.id}\n📦 商品: {product.name}\n💵 金额: ¥{product.price:.2f}",
+            reply_markup=kb,
+            show_alert=False
+        )
 
 # -----------------------------
 # 添加到购物车
@@ -119,8 +112,7 @@ async def add_to_cart(callback: CallbackQuery, db: AsyncSession):
     tg_id = callback.from_user.id
 
     # 查询用户
-    result = await db.execute(select(User).where(User.telegram_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await get_identity(tg_id)
     if not user:
         await _safe_reply(callback, "⚠️ 用户未注册", show_alert=True)
         return
@@ -149,5 +141,6 @@ async def add_to_cart(callback: CallbackQuery, db: AsyncSession):
         logger.error(f"加入购物车失败: {e}", exc_info=True)
         await _safe_reply(callback, "❌ 加入购物车失败", show_alert=True)
         return
+    mark_recent_write(tg_id)
 
     await _safe_reply(callback, f"✅ 已加入购物车：{product.name}", show_alert=False)
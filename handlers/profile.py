@@ -15,7 +15,7 @@ from aiogram.types import (
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from db.models import User
-from db.session import get_async_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 import logging
 from utils.formatting import _safe_reply
@@ -54,42 +54,41 @@ def get_user_id(obj: types.Message | types.CallbackQuery) -> Optional[int]:
 # /profile 查看资料
 # ======================
 @router.message(Command("profile"))
-async def get_user_profile(message: types.Message, state: FSMContext):
+async def get_user_profile(message: types.Message, state: FSMContext, db: AsyncSession):
     user_id = get_user_id(message)
     if not user_id:
         await _safe_reply(message, "⚠️ 无法获取用户ID")
         return
 
-    async with get_async_session() as session:
-        result = await session.execute(select(User).where(User.telegram_id == user_id))
-        user: Optional[User] = result.scalar_one_or_none()
-
-        if not user:
-            await _safe_reply(message, "⚠️ 未找到您的用户信息。请先使用 /start 注册。")
-            return
-
-        text = (
-            f"👤 用户信息：\n"
-            f"ID: {user.telegram_id}\n"
-            f"用户名: @{user.username or '无'}\n"
-            f"邮箱: {user.email or '未设置'}\n"
-            f"手机号: {user.phone or '未设置'}\n"
-            f"语言: {user.language or '未设置'}\n"
-            f"注册时间: {user.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
-        )
+    result = await db.execute(select(User).where(User.telegram_id == user_id))
+    user: Optional[User] = result.scalar_one_or_none()
 
-        keyboard = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="📧 修改邮箱"), KeyboardButton(text="📱 修改手机号")],
-                [KeyboardButton(text="🌐 修改语言"), KeyboardButton(text="❌ 取消")],
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True,
-        )
+    if not user:
+        await _safe_reply(message, "⚠️ 未找到您的用户信息。请先使用 /start 注册。")
+        return
 
-        await _safe_reply(message, text)
-        await _safe_reply(message, "请选择要修改的项目：", reply_markup=keyboard)
-        await state.set_state(ProfileStates.CHOICE)
+    text = (
+        f"👤 用户信息：\n"
+        f"ID: {user.telegram_id}\n"
+        f"用户名: @{user.username or '无'}\n"
+        f"邮箱: {user.email or '未设置'}\n"
+        f"手机号: {user.phone or '未设置'}\n"
+        f"语言: {user.language or '未设置'}\n"
+        f"注册时间: {user.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
+    )
+
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="📧 修改邮箱"), KeyboardButton(text="📱 修改手机号")],
+            [KeyboardButton(text="🌐 修改语言"), KeyboardButton(text="❌ 取消")],
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+
+    await _safe_reply(message, text)
+    await _safe_reply(message, "请选择要修改的项目：", reply_markup=keyboard)
+    await state.set_state(ProfileStates.CHOICE)
 
 
 # ======================
@@ -122,7 +121,7 @@ async def handle_choice(message: types.Message, state: FSMContext):
 # 更新邮箱
 # ======================
 @router.message(ProfileStates.AWAIT_EMAIL)
-async def update_email(message: types.Message, state: FSMContext):
+async def update_email(message: types.Message, state: FSMContext, db: AsyncSession):
     if not message.text or "@" not in message.text:
         await _safe_reply(message, "❌ 无效邮箱，请重新输入。")
         return
@@ -130,14 +129,13 @@ async def update_email(message: types.Message, state: FSMContext):
     if not user_id:
         await _safe_reply(message, "⚠️ 无法获取用户ID")
         return
-    async with get_async_session() as session:
-        user = await get_user(session, user_id)
-        if not user:
-            await _safe_reply(message, "⚠️ 用户未找到。")
-        else:
-            user.email = message.text.strip()
-            await session.commit()
-            await _safe_reply(message, f"✅ 邮箱已更新为：{user.email}")
+    user = await get_user(db, user_id)
+    if not user:
+        await _safe_reply(message, "⚠️ 用户未找到。")
+    else:
+        user.email = message.text.strip()
+        await db.commit()
+        await _safe_reply(message, f"✅ 邮箱已更新为：{user.email}")
 
     await state.clear()
 
@@ -147,7 +145,7 @@ async def update_email(message: types.Message, state: FSMContext):
 # 更新手机号
 # ======================
 @router.message(ProfileStates.AWAIT_PHONE)
-async def update_phone(message: types.Message, state: FSMContext):
+async def update_phone(message: types.Message, state: FSMContext, db: AsyncSession):
     if not message.text or not message.text.isdigit():
         await _safe_reply(message, "❌ 无效手机号，请重新输入。")
         return
@@ -155,32 +153,30 @@ async def update_phone(message: types.Message, state: FSMContext):
     if not user_id:
         await _safe_reply(message, "⚠️ 无法获取用户ID")
         return
-    async with get_async_session() as session:
-        user = await get_user(session, user_id)
-        if not user:
-            await _safe_reply(message, "⚠️ 用户未找到。")
-        else:
-            user.phone = message.text.strip()
-            await session.commit()
-            await _safe_reply(message, f"✅ 手机号已更新为：{user.phone}")
+    user = await get_user(db, user_id)
+    if not user:
+        await _safe_reply(message, "⚠️ 用户未找到。")
+    else:
+        user.phone = message.text.strip()
+        await db.commit()
+        await _safe_reply(message, f"✅ 手机号已更新为：{user.phone}")
     await state.clear()
 
 # ======================
 # 语言选择回调
 # ======================
 @router.callback_query(F.data.startswith("set_lang_"))
-async def set_language_callback(callback: types.CallbackQuery):
+async def set_language_callback(callback: types.CallbackQuery, db: AsyncSession):
     lang_code = (callback.data or "").replace("set_lang_", "")
     user_id = get_user_id(callback)
     if not user_id:
         await _safe_reply(callback, "⚠️ 无法获取用户ID", show_alert=True)
         return
-    async with get_async_session() as session:
-        user = await get_user(session, user_id)
-        if user:
-            user.language = lang_code
-            await session.commit()
-            await _safe_reply(callback, f"✅ 语言已更新为 {LANGUAGE_OPTIONS.get(lang_code, lang_code)}")
+    user = await get_user(db, user_id)
+    if user:
+        user.language = lang_code
+        await db.commit()
+        await _safe_reply(callback, f"✅ 语言已更新为 {LANGUAGE_OPTIONS.get(lang_code, lang_code)}")
        
 
 
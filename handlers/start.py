@@ -4,11 +4,12 @@ from typing import cast,Optional
 from aiogram import Bot,Router
 from aiogram.filters import Command
 from aiogram.types import Message,InlineKeyboardButton,InlineKeyboardMarkup,User as TelegramUser
-from sqlalchemy import select, func, case
+from sqlalchemy import select, case
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from db.session import get_async_session
-from db.models import User, Order
+from db.session import get_async_session, get_read_session
+from db.models import User
+from db.stats import read_site_stats
 from config.settings import settings
 from pydantic import BaseModel
 from utils.formatting import _safe_reply
@@ -34,27 +35,14 @@ class SiteStats(BaseModel):
     refunded_orders: int
 
 async def get_site_stats(db: AsyncSession) -> SiteStats:
-    total_users_q = select(func.coalesce(func.count(User.id), 0))
-    total_orders_q = select(func.coalesce(func.count(Order.id), 0))
-    total_revenue_q = select(func.coalesce(func.sum(Order.total_amount), 0.0)) \
-        .where(Order.status.in_(["paid", "shipped"]))
-    shipped_orders_q = select(func.coalesce(func.count(Order.id), 0)) \
-        .where(Order.status == "shipped")
-    refunded_orders_q = select(func.coalesce(func.count(Order.id), 0)) \
-        .where(Order.status == "refunded")
-
-    total_users = (await db.execute(total_users_q)).scalar_one()
-    total_orders = (await db.execute(total_orders_q)).scalar_one()
-    total_revenue = (await db.execute(total_revenue_q)).scalar_one()
-    shipped_orders = (await db.execute(shipped_orders_q)).scalar_one()
-    refunded_orders = (await db.execute(refunded_orders_q)).scalar_one()
-
+    """读 site_stats 单行计数器（增量维护 + 定期对账），不再扫 users / orders"""
+    row = await read_site_stats(db)
     return SiteStats(
-        total_users=total_users,
-        total_orders=total_orders,
-        total_revenue=float(total_revenue),
-        shipped_orders=shipped_orders,
-        refunded_orders=refunded_orders,
+        total_users=row.total_users,
+        total_orders=row.total_orders,
+        total_revenue=float(row.total_revenue),
+        shipped_orders=row.shipped_orders,
+        refunded_orders=row.refunded_orders,
     )
 
 async def get_user_by_id(db: AsyncSession, telegram_id: int) -> Optional[User]:
@@ -87,12 +75,8 @@ async def handle_start(message: Message, db: AsyncSession, bot: Bot):
 
     # 是管理员？显示统计数据
     if is_admin(user.telegram_id):
-        total_users = await db.execute(select(func.count(User.id)))
-        total_orders = await db.execute(select(func.count(Order.id)))
-        total_users = total_users.scalar_one()
-        total_orders = total_orders.scalar_one()
-        
-        stats = await get_site_stats(db)
+        async with get_read_session() as read_db:
+            stats = await get_site_stats(read_db)
         text = (
             "📊 <b>系统统计</b>：\n\n"
             f"👥 用户总数：<b>{stats.total_users}</b>\n"
@@ -5,17 +5,21 @@ import os
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 from config.settings import get_app_settings, AppSettings
 from config.loader import periodic_refresh
-from db.session import  engine,init_models
-from handlers import setup_all_handlers
+from db.session import  close_connections,init_models
+from handlers import create_bot, create_dispatcher
 from handlers.context import RedisService
+from services.activity import activity_buffer
+from utils.rate_limit import outbound_limiter
+from db.stats import run_reconcile_loop
+from db.partitions import run_partition_maintenance_loop
+from services.catalog import catalog
+from utils import cache
 from api import router as api_router  # API 路由
+from services.webhook import router as webhook_router, start_webhook, stop_webhook
+from services.update_queue import RedisUpdateQueue, UpdateWorker, build_update_queue, intake_dispatcher
 import uvicorn
 from fastapi.staticfiles import StaticFiles
 
@@ -58,18 +62,36 @@ async def lifespan(app: FastAPI):
     # 3. 初始化数据库
     await init_models()
     logger.info("✅ 数据库初始化完成")
+    # 两级缓存的 L2 + L1 失效订阅
+    cache.use_redis(app.state.redis)
+    cache_task = asyncio.create_task(cache.listen_invalidations())
+    # 商品目录快照 + 跨 worker 失效订阅
+    catalog_task = await catalog.start(app.state.redis)
     # 4. 定时刷新
     if settings.env in ("dev", "test"):
         asyncio.create_task(periodic_refresh(settings, interval=60))
 
+    # 活跃时间批量写回
+    if settings.activity_backend == "redis":
+        activity_buffer.use_redis(app.state.redis)
+    activity_task = asyncio.create_task(activity_buffer.run(settings.activity_flush_interval))
+
+    # 发往 Telegram 的限速额度：多进程共用
+    if settings.outbound_backend == "redis":
+        outbound_limiter.use_redis(app.state.redis)
+
+    # orders / order_items 未来分区
+    partition_task = asyncio.create_task(run_partition_maintenance_loop())
+
+    # site_stats 定期对账
+    stats_task = None
+    if settings.site_stats_reconcile_interval > 0:
+        stats_task = asyncio.create_task(run_reconcile_loop(settings.site_stats_reconcile_interval))
+
     # 5. 启动 Bot
-    bot = Bot(
-        token=settings.bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
-    dp = Dispatcher(storage=MemoryStorage())
-    setup_all_handlers(dp)
-    
+    bot = create_bot(settings)
+    dp = create_dispatcher(settings, bot)
+
      # 设置命令
     commands = get_bot_commands(settings.default_lang)
     await bot.set_my_commands(commands)
@@ -78,19 +100,68 @@ async def lifespan(app: FastAPI):
     app.state.bot = bot
     app.state.dp = dp
 
-    polling_task = asyncio.create_task(dp.start_polling(bot))
-    logger.info("✅ Telegram Bot 已启动轮询")
+    # update 队列：redis 时 handler 在 worker.py 里执行，本进程只负责接收入队
+    update_queue = build_update_queue(settings)
+    app.state.update_queue = update_queue
+    update_worker = None
+    if isinstance(update_queue, RedisUpdateQueue):
+        await update_queue.ensure_groups()
+        logger.info(f"✅ update 入队到 Redis Streams（{update_queue.partitions} 个分区）")
+    elif update_queue is not None:
+        update_worker = UpdateWorker(update_queue, bot, dp)
+        update_worker.start()
+
+    polling_task = None
+    if settings.bot_mode == "webhook":
+        await start_webhook(bot, dp)
+    else:
+        # 之前设置过 webhook 时 getUpdates 会冲突，先删掉
+        await bot.delete_webhook()
+        if update_queue:
+            # 逐条入队（handle_as_tasks=False）：同一会话的 update 按收到的顺序写入分区；
+            # 入队失败时 EnqueueMiddleware 一直重试，轮询停下来，不会跳过这条 update
+            polling_task = asyncio.create_task(
+                intake_dispatcher(update_queue).start_polling(
+                    bot, allowed_updates=dp.resolve_used_update_types(), handle_as_tasks=False
+                )
+            )
+        else:
+            polling_task = asyncio.create_task(
+                dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+            )
+        logger.info("✅ Telegram Bot 已启动轮询")
 
     yield  # lifespan 上下文开始，FastAPI 正常运行
 
-    polling_task.cancel()
+    if polling_task:
+        polling_task.cancel()
+        try:
+            await polling_task
+        except asyncio.CancelledError:
+            pass
+    else:
+        await stop_webhook(bot)
+    if update_worker:
+        await update_worker.stop()
+    if update_queue:
+        await update_queue.close()
+    partition_task.cancel()
+    if catalog_task:
+        catalog_task.cancel()
+    cache_task.cancel()
+    if stats_task:
+        stats_task.cancel()
+    activity_task.cancel()
     try:
-        await polling_task
+        await activity_task
     except asyncio.CancelledError:
         pass
+    flushed = await activity_buffer.flush()  # 停机前把缓冲写完
+    logger.info(f"✅ last_active 最终写回 {flushed} 条")
+    await dp.storage.close()
     await bot.session.close()
     await RedisService.close()
-    await engine.dispose()
+    await close_connections()
     logger.info("🛑 系统已关闭")
 
 app = FastAPI(
@@ -99,6 +170,8 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan,
 )
+# Telegram webhook：必须在挂载 "/" 的静态文件之前注册，否则会被 StaticFiles 接走
+app.include_router(webhook_router)
 app.mount("/", StaticFiles(directory="frontend/dist", html=True), name="frontend")
 # CORS
 app.add_middleware(
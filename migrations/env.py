@@ -8,6 +8,7 @@ from config.settings import get_app_settings
 from alembic import context
 from sqlalchemy.engine import Connection
 from db.models import Base 
+from db.sqlite import async_url
 target_metadata = Base.metadata
 # -----------------------------
 # 配置 Alembic logging
@@ -20,7 +21,7 @@ if config.config_file_name is not None:
 # 读取项目配置
 # -----------------------------
 settings = get_app_settings()
-DATABASE_URL: str = settings.database_url or "sqlite+aiosqlite:///default.db"
+DATABASE_URL: str = async_url(settings.database_url or "sqlite:///default.db")
 # -----------------------------
 # 绑定 MetaData
 # -----------------------------
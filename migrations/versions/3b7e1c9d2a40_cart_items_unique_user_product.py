@@ -0,0 +1,86 @@
+"""cart_items unique (user_id, product_id)
+
+Revision ID: 3b7e1c9d2a40
+Revises: efe772633963
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7e1c9d2a40'
+down_revision: Union[str, None] = 'efe772633963'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 先合并历史重复行：数量累加到最早的一行，其余删除
+    if op.get_bind().dialect.name == "sqlite":
+        _dedupe_sqlite()
+        # SQLite 不支持 ALTER TABLE ADD CONSTRAINT，batch 模式重建表
+        with op.batch_alter_table('cart_items') as batch_op:
+            batch_op.create_unique_constraint('uq_cart_items_user_product', ['user_id', 'product_id'])
+        return
+    _dedupe_postgresql()
+    op.create_unique_constraint(
+        'uq_cart_items_user_product', 'cart_items', ['user_id', 'product_id']
+    )
+
+
+def _dedupe_postgresql() -> None:
+    op.execute("""
+        WITH ranked AS (
+            SELECT id,
+                   SUM(quantity) OVER (PARTITION BY user_id, product_id) AS total,
+                   ROW_NUMBER() OVER (PARTITION BY user_id, product_id ORDER BY created_at, id) AS rn
+            FROM cart_items
+        )
+        UPDATE cart_items c
+        SET quantity = r.total
+        FROM ranked r
+        WHERE c.id = r.id AND r.rn = 1
+    """)
+    op.execute("""
+        DELETE FROM cart_items c
+        USING (
+            SELECT id,
+                   ROW_NUMBER() OVER (PARTITION BY user_id, product_id ORDER BY created_at, id) AS rn
+            FROM cart_items
+        ) r
+        WHERE c.id = r.id AND r.rn > 1
+    """)
+
+
+def _dedupe_sqlite() -> None:
+    # 没有 UPDATE ... FROM / DELETE ... USING：按 rowid 保留每组最早插入的一行
+    op.execute("""
+        UPDATE cart_items
+        SET quantity = (
+            SELECT SUM(c.quantity) FROM cart_items c
+            WHERE c.user_id = cart_items.user_id AND c.product_id = cart_items.product_id
+        )
+        WHERE rowid IN (
+            SELECT MIN(rowid) FROM cart_items
+            GROUP BY user_id, product_id
+            HAVING COUNT(*) > 1
+        )
+    """)
+    op.execute("""
+        DELETE FROM cart_items
+        WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM cart_items
+            GROUP BY user_id, product_id
+        )
+    """)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        with op.batch_alter_table('cart_items') as batch_op:
+            batch_op.drop_constraint('uq_cart_items_user_product', type_='unique')
+        return
+    op.drop_constraint('uq_cart_items_user_product', 'cart_items', type_='unique')
@@ -0,0 +1,49 @@
+"""site_stats counters table
+
+Revision ID: 5c2a8f4e91b7
+Revises: 3b7e1c9d2a40
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2a8f4e91b7'
+down_revision: Union[str, None] = '3b7e1c9d2a40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'site_stats',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('total_users', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('total_orders', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('total_revenue', sa.Numeric(14, 2), nullable=False, server_default='0'),
+        sa.Column('shipped_orders', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('refunded_orders', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('reconciled_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    # 用现有数据初始化唯一一行
+    op.execute("""
+        INSERT INTO site_stats (id, total_users, total_orders, total_revenue,
+                                shipped_orders, refunded_orders, reconciled_at)
+        SELECT 1,
+               (SELECT COUNT(*) FROM users),
+               COUNT(*),
+               COALESCE(SUM(total_amount) FILTER (WHERE status IN ('PAID', 'SHIPPED')), 0),
+               COUNT(*) FILTER (WHERE status = 'SHIPPED'),
+               COUNT(*) FILTER (WHERE status = 'REFUNDED'),
+               now()
+        FROM orders
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('site_stats')
@@ -0,0 +1,25 @@
+"""users (created_at, id) index for keyset pagination
+
+Revision ID: 7d41b0e6c3f2
+Revises: 5c2a8f4e91b7
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d41b0e6c3f2'
+down_revision: Union[str, None] = '5c2a8f4e91b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_created_at_id', 'users', ['created_at', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_created_at_id', table_name='users')
@@ -0,0 +1,84 @@
+"""hot path indexes, drop duplicate pk indexes
+
+Revision ID: 9a6f3d2c8e15
+Revises: 7d41b0e6c3f2
+Create Date: 2026-10-17 13:00:00.000000
+
+全部用 CREATE / DROP INDEX CONCURRENTLY，线上表不锁写；
+CONCURRENTLY 不能在事务里执行，所以放在 autocommit_block 里。
+中途失败可能留下 INVALID 索引，重跑前先 DROP INDEX CONCURRENTLY 掉。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a6f3d2c8e15'
+down_revision: Union[str, None] = '7d41b0e6c3f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# UUIDMixin 曾经给主键又加了 index=True，与主键索引重复
+DUPLICATE_PK_INDEXES = {
+    'users': 'ix_users_id',
+    'products': 'ix_products_id',
+    'cart_items': 'ix_cart_items_id',
+    'orders': 'ix_orders_id',
+    'order_items': 'ix_order_items_id',
+    'configs': 'ix_configs_id',
+}
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        # 我的订单 / 最近未支付订单：WHERE user_id = ? ORDER BY created_at DESC
+        op.create_index(
+            'ix_orders_user_id_created_at', 'orders',
+            ['user_id', sa.text('created_at DESC')],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # 后台按状态筛订单：WHERE status = ? ORDER BY created_at DESC
+        op.create_index(
+            'ix_orders_status_created_at', 'orders',
+            ['status', sa.text('created_at DESC')],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # 上架商品列表（部分索引）
+        op.create_index(
+            'ix_products_active_created_at', 'products', ['created_at'],
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # selectinload(Order.items)
+        op.create_index(
+            'ix_order_items_order_id', 'order_items', ['order_id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # cart_items(user_id, product_id) 已由 uq_cart_items_user_product 覆盖
+
+        for table, name in DUPLICATE_PK_INDEXES.items():
+            op.drop_index(
+                name, table_name=table,
+                postgresql_concurrently=True, if_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table, name in DUPLICATE_PK_INDEXES.items():
+            op.create_index(
+                name, table, ['id'],
+                postgresql_concurrently=True, if_not_exists=True,
+            )
+        for table, name in (
+            ('order_items', 'ix_order_items_order_id'),
+            ('products', 'ix_products_active_created_at'),
+            ('orders', 'ix_orders_status_created_at'),
+            ('orders', 'ix_orders_user_id_created_at'),
+        ):
+            op.drop_index(
+                name, table_name=table,
+                postgresql_concurrently=True, if_exists=True,
+            )
@@ -0,0 +1,117 @@
+"""partition orders / order_items by created_at month
+
+Revision ID: b8e2f71a4c09
+Revises: 9a6f3d2c8e15
+Create Date: 2026-10-17 14:00:00.000000
+
+把 orders / order_items 改成按 created_at 月分区的表（PostgreSQL 声明式分区）：
+1. 旧表改名为 *_legacy，用 LIKE 建同结构的分区父表；
+2. 为历史数据覆盖的每个月 + 未来 3 个月建分区，外加 DEFAULT 分区兜底
+   （维护循环没及时建分区时的行先落在这里，ensure_future_partitions 建分区前会把它们搬出来）；
+3. 拷贝数据、删除旧表，再建主键 / 索引 / 外键。
+
+分区表的主键和唯一约束必须包含分区键，所以：
+- 主键变为 (id, created_at)，ORM 里仍只用 id 定位；
+- out_no 唯一约束变为 (out_no, created_at)，out_no 本身是 uuid4，不会实际冲突；
+- order_items.order_id -> orders.id 的数据库外键去掉（引用不到唯一列），由应用保证。
+
+整个迁移在一个事务里拷贝全表，会锁表，请在维护窗口执行。
+之后的分区由 python -m db.partitions maintain（main.lifespan 每天跑一次）补齐。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e2f71a4c09'
+down_revision: Union[str, None] = '9a6f3d2c8e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+CREATE_MONTH_PARTITIONS = """
+DO $$
+DECLARE
+    m date := date_trunc('month', COALESCE((SELECT min(created_at) FROM {legacy}), now()))::date;
+    last date := (date_trunc('month', now()) + interval '{ahead} months')::date;
+BEGIN
+    WHILE m <= last LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+            '{table}_p' || to_char(m, 'YYYYMM'), m, (m + interval '1 month')::date
+        );
+        m := (m + interval '1 month')::date;
+    END LOOP;
+END $$;
+"""
+
+
+def _partition(table: str) -> None:
+    legacy = f"{table}_legacy"
+    op.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    op.execute(
+        f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+        f"INCLUDING COMMENTS) PARTITION BY RANGE (created_at)"
+    )
+    op.execute(CREATE_MONTH_PARTITIONS.format(table=table, legacy=legacy, ahead=MONTHS_AHEAD))
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    op.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+
+
+def upgrade() -> None:
+    _partition('orders')
+    _partition('order_items')
+    op.execute("DROP TABLE order_items_legacy")
+    op.execute("DROP TABLE orders_legacy")
+
+    op.create_primary_key('orders_pkey', 'orders', ['id', 'created_at'])
+    op.create_unique_constraint('uq_orders_out_no_created_at', 'orders', ['out_no', 'created_at'])
+    op.create_index('ix_orders_out_no', 'orders', ['out_no'])
+    op.create_index('ix_orders_user_id_created_at', 'orders', ['user_id', sa.text('created_at DESC')])
+    op.create_index('ix_orders_status_created_at', 'orders', ['status', sa.text('created_at DESC')])
+    op.create_foreign_key('orders_user_id_fkey', 'orders', 'users', ['user_id'], ['id'])
+
+    op.create_primary_key('order_items_pkey', 'order_items', ['id', 'created_at'])
+    op.create_index('ix_order_items_order_id', 'order_items', ['order_id'])
+    op.create_foreign_key(
+        'order_items_product_id_fkey', 'order_items', 'products',
+        ['product_id'], ['id'], ondelete='CASCADE',
+    )
+
+
+def _unpartition(table: str) -> None:
+    partitioned = f"{table}_partitioned"
+    op.execute(f"ALTER TABLE {table} RENAME TO {partitioned}")
+    op.execute(
+        f"CREATE TABLE {table} (LIKE {partitioned} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+        f"INCLUDING COMMENTS)"
+    )
+    op.execute(f"INSERT INTO {table} SELECT * FROM {partitioned}")
+
+
+def downgrade() -> None:
+    # 已归档（DETACH 到冷库）的分区不会被搬回来
+    _unpartition('orders')
+    _unpartition('order_items')
+    op.execute("DROP TABLE order_items_partitioned CASCADE")
+    op.execute("DROP TABLE orders_partitioned CASCADE")
+
+    op.create_primary_key('orders_pkey', 'orders', ['id'])
+    op.create_index('ix_orders_out_no', 'orders', ['out_no'], unique=True)
+    op.create_index('ix_orders_user_id_created_at', 'orders', ['user_id', sa.text('created_at DESC')])
+    op.create_index('ix_orders_status_created_at', 'orders', ['status', sa.text('created_at DESC')])
+    op.create_foreign_key('orders_user_id_fkey', 'orders', 'users', ['user_id'], ['id'])
+
+    op.create_primary_key('order_items_pkey', 'order_items', ['id'])
+    op.create_index('ix_order_items_order_id', 'order_items', ['order_id'])
+    op.create_foreign_key(
+        'order_items_order_id_fkey', 'order_items', 'orders',
+        ['order_id'], ['id'], ondelete='CASCADE',
+    )
+    op.create_foreign_key(
+        'order_items_product_id_fkey', 'order_items', 'products',
+        ['product_id'], ['id'], ondelete='CASCADE',
+    )
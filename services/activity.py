@@ -0,0 +1,222 @@
+# services/activity.py
+"""
+last_active 写回缓冲（write-behind）
+
+每条消息只在内存 / Redis hash 里记一笔 telegram_id -> 时间，
+后台每 ACTIVITY_FLUSH_INTERVAL 秒批量 UPDATE 一次；同一用户多次活跃只保留最新时间。
+
+Redis 模式（多实例共用一个 hash）：刷盘时把 hash 改名成本次独有的
+activity:last_active:flushing:{时间戳}:{uuid} 再读，各实例互不覆盖、互不删除；
+进程在写库中途退出留下的 flushing key，由下一个启动的实例在第一次刷盘时接管。
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from config.settings import get_app_settings
+from db.crud import UserCRUD
+from db.session import get_async_session
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+FLUSH_SIZE = registry.histogram(
+    "activity_flush_size", "每次写回的用户数",
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+)
+FLUSH_LAG = registry.histogram("activity_flush_lag_seconds", "最早一条活跃记录到写回的延迟")
+FLUSH_SECONDS = registry.histogram("activity_flush_seconds", "单次写回耗时")
+FLUSH_ERRORS = registry.counter("activity_flush_errors_total", "写回失败次数")
+PENDING = registry.gauge("activity_pending", "待写回的用户数")
+
+REDIS_KEY = "activity:last_active"
+REDIS_FLUSHING_PREFIX = f"{REDIS_KEY}:flushing:"
+ORPHAN_MIN_AGE = 60  # flushing key 存在超过 max(这么多秒, 2 × 刷盘超时) 视为遗留
+
+
+class ActivityBuffer:
+    def __init__(
+        self,
+        redis: Optional[Redis] = None,
+        batch_size: int = settings.activity_flush_batch_size,
+        max_pending: int = settings.activity_max_pending,
+        flush_timeout: float = settings.activity_flush_timeout,
+    ):
+        self.redis = redis
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.flush_timeout = flush_timeout
+        self._pending: Dict[int, float] = {}  # telegram_id -> unix 时间戳
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._orphans_checked = False
+
+    def use_redis(self, redis: Optional[Redis]) -> None:
+        """多实例部署时共用 Redis hash；传 None 回到进程内缓冲"""
+        self.redis = redis
+
+    async def record(self, telegram_id: int, ts: Optional[float] = None) -> None:
+        ts = ts or time.time()
+        if self.redis is not None:
+            try:
+                await self.redis.hset(REDIS_KEY, str(telegram_id), repr(ts))
+                return
+            except RedisError as e:
+                logger.warning(f"⚠️ Redis 记录活跃失败，改用内存缓冲: {e}")
+        if ts > self._pending.get(telegram_id, 0):
+            self._pending[telegram_id] = ts
+        PENDING.set(len(self._pending))
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    async def _take_memory(self) -> Dict[int, float]:
+        pending, self._pending = self._pending, {}
+        PENDING.set(0)
+        return pending
+
+    @staticmethod
+    def _flushing_key() -> str:
+        return f"{REDIS_FLUSHING_PREFIX}{int(time.time())}:{uuid.uuid4().hex}"
+
+    async def _rename(self, src: str, dst: str) -> bool:
+        """src 不存在（没有新记录 / 已被别的实例接管）返回 False；连接错误照常抛出"""
+        try:
+            await self.redis.rename(src, dst)
+            return True
+        except ResponseError as e:
+            if "no such key" in str(e).lower():
+                return False
+            raise
+
+    async def _claim_orphans(self) -> List[str]:
+        """接管其他进程写库中途退出留下的 flushing key（改名成自己的，RENAME 保证只有一个实例拿到）"""
+        min_age = max(ORPHAN_MIN_AGE, self.flush_timeout * 2)
+        claimed = []
+        async for key in self.redis.scan_iter(match=f"{REDIS_FLUSHING_PREFIX}*", count=1000):
+            key = key.decode() if isinstance(key, bytes) else key
+            try:
+                created = int(key[len(REDIS_FLUSHING_PREFIX):].split(":", 1)[0])
+            except ValueError:
+                created = 0
+            if time.time() - created < min_age:
+                continue  # 可能还在别的实例手里
+            own = self._flushing_key()
+            if await self._rename(key, own):
+                claimed.append(own)
+        if claimed:
+            logger.info(f"♻️ 接管 {len(claimed)} 个遗留的活跃记录批次")
+        return claimed
+
+    async def _take_redis(self) -> Tuple[Dict[int, float], List[str]]:
+        # 先把 hash 改名成本次独有的 key 再读，读的过程中新的活跃记录写进新 hash
+        assert self.redis is not None
+        keys: List[str] = []
+        own = self._flushing_key()
+        if await self._rename(REDIS_KEY, own):
+            keys.append(own)
+        if not self._orphans_checked:
+            keys += await self._claim_orphans()
+            self._orphans_checked = True
+        taken: Dict[int, float] = {}
+        try:
+            for key in keys:
+                for k, v in (await self.redis.hgetall(key)).items():
+                    try:
+                        tg_id, ts = int(k), float(v)
+                    except (TypeError, ValueError):
+                        continue
+                    if ts > taken.get(tg_id, 0):
+                        taken[tg_id] = ts
+        except RedisError:
+            self._orphans_checked = False  # 已改名的 key 留给之后的遗留扫描
+            raise
+        return taken, keys
+
+    def _restore(self, taken: Dict[int, float]) -> None:
+        """写库失败时放回内存（不超过上限，超出部分丢弃）"""
+        for tg_id, ts in taken.items():
+            if len(self._pending) >= self.max_pending:
+                logger.warning(f"⚠️ 活跃缓冲已满，丢弃 {len(taken)} 条中的剩余记录")
+                break
+            if ts > self._pending.get(tg_id, 0):
+                self._pending[tg_id] = ts
+        PENDING.set(len(self._pending))
+
+    async def _write(self, taken: Dict[int, float]) -> None:
+        items = sorted(taken.items())  # 固定加锁顺序，避免多实例互相死锁
+        for i in range(0, len(items), self.batch_size):
+            rows: List[Tuple[int, datetime]] = [
+                (tg_id, datetime.fromtimestamp(ts, timezone.utc))
+                for tg_id, ts in items[i:i + self.batch_size]
+            ]
+            async with get_async_session() as session:
+                await UserCRUD.bulk_update_last_active(session, rows)
+                await session.commit()
+
+    async def flush(self) -> int:
+        """写回一次，返回写回的用户数；超时或失败时记录放回缓冲"""
+        async with self._lock:
+            self._wakeup.clear()
+            use_redis = self.redis is not None
+            flushing: List[str] = []
+            try:
+                if use_redis:
+                    taken, flushing = await self._take_redis()
+                else:
+                    taken = await self._take_memory()
+            except RedisError as e:
+                FLUSH_ERRORS.inc()
+                logger.error(f"❌ 读取 Redis 活跃记录失败: {e}")
+                return 0
+            if use_redis and self._pending:
+                # Redis 曾不可用时落在内存里的记录
+                for tg_id, ts in (await self._take_memory()).items():
+                    if ts > taken.get(tg_id, 0):
+                        taken[tg_id] = ts
+            if not taken:
+                await self._drop_flushing(flushing)
+                return 0
+
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._write(taken), timeout=self.flush_timeout)
+            except Exception as e:  # 含 asyncio.TimeoutError
+                FLUSH_ERRORS.inc()
+                logger.error(f"❌ last_active 写回失败（{len(taken)} 条）: {e}")
+                self._restore(taken)
+                await self._drop_flushing(flushing)
+                return 0
+
+            await self._drop_flushing(flushing)
+            FLUSH_SECONDS.observe(time.perf_counter() - start)
+            FLUSH_SIZE.observe(len(taken))
+            FLUSH_LAG.observe(max(time.time() - min(taken.values()), 0.0))
+            logger.debug(f"✅ last_active 写回 {len(taken)} 条")
+            return len(taken)
+
+    async def _drop_flushing(self, keys: List[str]) -> None:
+        if not keys:
+            return
+        try:
+            await self.redis.delete(*keys)
+        except RedisError as e:
+            logger.warning(f"⚠️ 删除 {keys} 失败: {e}")
+
+    async def run(self, interval: float = settings.activity_flush_interval) -> None:
+        """后台循环：到点或缓冲满了就写回"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+activity_buffer = ActivityBuffer()
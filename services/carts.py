@@ -1,9 +1,10 @@
 # services/cart.py
 import logging
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select,insert, update, delete
+from sqlalchemy import select, update, delete
 from sqlalchemy.exc import SQLAlchemyError
 from db.models import CartItem, Product
+from db.crud import CartCRUD
 from typing import List
 from decimal import Decimal
 from uuid import UUID
@@ -25,33 +26,19 @@ class CartService:
         if product.stock < quantity:
             return {"success": False, "message": "库存不足"}
 
-        # 2. 检查购物车里是否已有该商品
-        result = await db.execute(
-            select(CartItem).where(
-                CartItem.user_id == user_id,
-                CartItem.product_id == product_id,
-            )
-        )
-        cart_item = result.scalar_one_or_none()
-
-        if cart_item:
-            # 已存在则更新数量
-            await db.execute(
-                update(CartItem)
-                .where(CartItem.id == cart_item.id)
-                .values(quantity=cart_item.quantity + quantity)
-            )
-        else:
-            # 不存在则插入新纪录
-            await db.execute(
-                insert(CartItem).values(
-                    user_id=user_id,
-                    product_id=product_id,
-                    quantity=quantity,
-                )
+        # 2. 单条 upsert：已有则叠加数量，没有则插入
+        try:
+            await CartCRUD.add_item(
+                db,
+                user_id=user_id,
+                product_id=product_id,
+                quantity=quantity,
+                product_name=product.name,
+                unit_price=product.price,
             )
-
-        await db.commit()
+        except RuntimeError as e:
+            logger.error(f"加入购物车失败 user_id={user_id}, product_id={product_id}: {e}")
+            return {"success": False, "message": "加入购物车失败"}
         return {"success": True, "message": "商品已加入购物车"}
     @staticmethod
     async def remove_item(db: AsyncSession, user_id: UUID, product_id: UUID) -> bool:
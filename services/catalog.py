@@ -0,0 +1,241 @@
+# services/catalog.py
+"""
+商品目录进程内快照
+
+- 启动时整表加载上架商品（ProductRow），每次重建 / 局部更新 version + 1；
+- 本进程 ORM 改动 Product（新增 / 编辑 / 下架 / 删除）提交后，对应 id 标脏，
+  下次读取只补查这几行；同时通过 Redis pub/sub 广播，其他 worker 收到后同样标脏；
+- 订阅断开重连时整表重建（期间可能漏消息），CATALOG_MAX_AGE 到期也整表重建兜底。
+
+绕过 ORM 的商品写入（Core UPDATE / 手工 SQL）请自己调用 catalog.changed(ids)。
+"""
+import asyncio
+import json
+import logging
+import time
+from itertools import chain
+from typing import Dict, Iterable, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config.settings import get_app_settings
+from db.crud import ProductCRUD
+from db.dto import ProductRow
+from db.models import Product
+from db.session import get_primary_read_session
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+CHANNEL = "catalog:invalidate"
+WORKER_ID = uuid4().hex  # 忽略自己发出的广播
+_SESSION_KEY = "catalog_changed_ids"
+
+HITS = registry.counter("catalog_cache_hits_total", "目录快照命中")
+MISSES = registry.counter("catalog_cache_misses_total", "目录快照失效后重建 / 补查")
+REBUILD_SECONDS = registry.histogram("catalog_rebuild_seconds", "目录重建 / 补查耗时")
+INVALIDATIONS = registry.counter("catalog_invalidations_total", "收到的失效通知（本进程 + 广播）")
+
+
+class CatalogCache:
+    def __init__(self, max_age: float = settings.catalog_max_age):
+        self.max_age = max_age
+        self.version = 0
+        self.redis: Optional[Redis] = None
+        self._products: Dict[UUID, ProductRow] = {}
+        self._ordered: Tuple[ProductRow, ...] = ()
+        self._loaded_at = 0.0
+        self._full_rebuild = True
+        self._dirty: Set[UUID] = set()
+        self._lock = asyncio.Lock()
+        self._publish_tasks: Set[asyncio.Task] = set()
+
+    # -------- 读取 --------
+    def _fresh(self) -> bool:
+        return (
+            not self._full_rebuild
+            and not self._dirty
+            and time.monotonic() - self._loaded_at < self.max_age
+        )
+
+    async def _ensure(self) -> None:
+        if self._fresh():
+            HITS.inc()
+            return
+        MISSES.inc()
+        async with self._lock:
+            if self._fresh():
+                return
+            full = self._full_rebuild or time.monotonic() - self._loaded_at >= self.max_age
+            dirty, self._dirty, self._full_rebuild = self._dirty, set(), False
+            start = time.perf_counter()
+            try:
+                # 失效发生在主库提交之后，紧接着补查：有副本时读主库，否则会把副本上的旧行当成最新的
+                async with get_primary_read_session() as session:
+                    if full:
+                        rows = await ProductCRUD.list_active(session)
+                    else:
+                        rows = await ProductCRUD.list_active_by_ids(session, dirty)
+            except Exception:
+                # 下次读取再试，期间继续用旧快照
+                self._full_rebuild = self._full_rebuild or full
+                self._dirty |= dirty
+                raise
+            self._apply(rows, dirty, full)
+            REBUILD_SECONDS.observe(time.perf_counter() - start)
+
+    def _apply(self, rows, dirty: Set[UUID], full: bool) -> None:
+        if full:
+            products = {row.id: row for row in rows}
+            self._loaded_at = time.monotonic()
+        else:
+            fetched = {row.id: row for row in rows}
+            # 新上架的排在最前（与 created_at DESC 一致），已有的原位替换，其余脏 id 视为下架
+            products = {pid: row for pid, row in fetched.items() if pid not in self._products}
+            for pid, row in self._products.items():
+                if pid in fetched:
+                    products[pid] = fetched[pid]
+                elif pid not in dirty:
+                    products[pid] = row
+        self._products = products
+        self._ordered = tuple(products.values())
+        self.version += 1
+        logger.debug(f"📚 商品目录 v{self.version}: {len(products)} 个商品（{'重建' if full else '补查'}）")
+
+    async def active_products(self) -> Tuple[ProductRow, ...]:
+        """上架商品，按上架时间倒序；返回的是共享快照，不要修改"""
+        await self._ensure()
+        return self._ordered
+
+    async def snapshot(self) -> Tuple[int, Tuple[ProductRow, ...]]:
+        """(version, 上架商品)：两者同时取出，渲染缓存用这个 version 做 key"""
+        await self._ensure()
+        return self.version, self._ordered
+
+    async def get(self, product_id: UUID) -> Optional[ProductRow]:
+        """上架商品；已下架 / 不存在返回 None"""
+        await self._ensure()
+        return self._products.get(product_id)
+
+    async def get_versioned(self, product_id: UUID) -> Tuple[int, Optional[ProductRow]]:
+        await self._ensure()
+        return self.version, self._products.get(product_id)
+
+    async def search(self, text: Optional[str] = None) -> Tuple[ProductRow, ...]:
+        products = await self.active_products()
+        if not text:
+            return products
+        needle = text.casefold()
+        return tuple(p for p in products if needle in p.name.casefold())
+
+    # -------- 失效 --------
+    def invalidate(self, product_ids: Optional[Iterable[UUID]] = None) -> None:
+        """只标脏不查库；product_ids 为 None 时整表重建"""
+        INVALIDATIONS.inc()
+        if product_ids is None:
+            self._full_rebuild = True
+        else:
+            self._dirty.update(product_ids)
+
+    def changed(self, product_ids: Iterable[UUID]) -> None:
+        """本进程改了商品：标脏并广播给其他 worker"""
+        ids = set(product_ids)
+        self.invalidate(ids)
+        if self.redis is None:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._publish(ids))
+        except RuntimeError:
+            return  # 没有事件循环（脚本 / 迁移），没有别的 worker 要通知
+        self._publish_tasks.add(task)
+        task.add_done_callback(self._publish_tasks.discard)
+
+    async def _publish(self, ids: Set[UUID]) -> None:
+        payload = json.dumps({"origin": WORKER_ID, "ids": [str(i) for i in ids]})
+        try:
+            await self.redis.publish(CHANNEL, payload)
+        except RedisError as e:
+            logger.warning(f"⚠️ 目录失效广播失败（其他 worker 将在 {self.max_age:.0f}s 内过期）: {e}")
+
+    def _on_message(self, data) -> None:
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            logger.warning(f"⚠️ 无法解析目录失效消息: {data!r}")
+            return
+        if message.get("origin") == WORKER_ID:
+            return
+        ids = message.get("ids")
+        self.invalidate(None if ids is None else {UUID(i) for i in ids})
+
+    async def listen(self, retry_delay: float = 1.0) -> None:
+        """订阅失效广播；断线重连后整表重建"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                self.invalidate()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._on_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ 目录失效订阅断开，{retry_delay:.0f}s 后重连: {e}")
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(retry_delay)
+
+    async def start(self, redis: Optional[Redis]) -> Optional[asyncio.Task]:
+        """启动时预加载；有 Redis 时返回订阅任务"""
+        self.redis = redis
+        await self._ensure()
+        logger.info(f"✅ 商品目录已加载: {len(self._products)} 个商品")
+        if redis is None:
+            return None
+        return asyncio.create_task(self.listen())
+
+    def stats(self) -> Dict[str, float]:
+        lookups = HITS.value + MISSES.value
+        return {
+            "version": self.version,
+            "products": len(self._products),
+            "hit_ratio": round(HITS.value / lookups, 4) if lookups else 0.0,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else 0.0,
+        }
+
+
+catalog = CatalogCache()
+registry.register_collector("catalog_cache", catalog.stats)
+
+
+# -------- ORM 钩子：提交后失效 --------
+@event.listens_for(Session, "after_flush")
+def _track_product_changes(session: Session, flush_context) -> None:
+    ids = {
+        obj.id
+        for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, Product) and obj.id is not None
+    }
+    if ids:
+        session.info.setdefault(_SESSION_KEY, set()).update(ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session) -> None:
+    ids = session.info.pop(_SESSION_KEY, None)
+    if ids:
+        catalog.changed(ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session: Session) -> None:
+    session.info.pop(_SESSION_KEY, None)
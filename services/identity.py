@@ -0,0 +1,91 @@
+# services/identity.py
+"""
+用户身份缓存：telegram_id -> UserIdentity（内部 id / 角色 / is_admin / 封禁 / 语言）
+
+- 每个 update 由 IdentityMiddleware 取一次并以 `identity` 注入 handler，
+  权限校验、封禁检查、下单取 user.id 都读这里，不再各自 SELECT users；
+- 底层是 TwoTierCache("identity")，标签 user:<telegram_id>；
+- 本进程 ORM 改动 User（/ban、/unban、/setadmin、资料编辑……）提交后自动按标签失效，
+  顺带失效其他缓存里同标签的条目（如 /api/users 的 user_out_cache）。
+
+绕过 ORM 的用户写入（Core UPDATE / 手工 SQL）如果改了上述字段，请自己调用 invalidate_identity()。
+"""
+import logging
+from itertools import chain
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config.settings import get_app_settings
+from db.dto import UserIdentity
+from db.loaders import identity_loader
+from db.models import Role, User
+from utils.cache import TwoTierCache, invalidate_tags_soon
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+_SESSION_KEY = "identity_changed_telegram_ids"
+
+identity_cache = TwoTierCache(
+    "identity", ttl=settings.identity_cache_ttl, l1_ttl=settings.identity_l1_ttl
+)
+
+
+def _tag(telegram_id: int) -> str:
+    return f"user:{telegram_id}"
+
+
+async def _load(telegram_id: int) -> Optional[list]:
+    identity = await identity_loader.load(telegram_id)
+    if identity is None:
+        return None
+    # 缓存里只放 msgpack 能序列化的基本类型，角色存枚举值
+    return [
+        identity.id, identity.telegram_id, identity.role.value,
+        identity.is_admin, identity.is_blocked, identity.language,
+    ]
+
+
+async def get_identity(telegram_id: int) -> Optional[UserIdentity]:
+    """
+    未注册返回 None（不缓存，注册后下一次读取即可命中）。
+    未命中时交给 identity_loader 与其他并发 update 合批查询（有副本时读主库）。
+    """
+    cached = await identity_cache.get_or_load(
+        telegram_id, lambda: _load(telegram_id), tags=[_tag(telegram_id)]
+    )
+    if cached is None:
+        return None
+    user_id, tg_id, role, is_admin, is_blocked, language = cached
+    return UserIdentity(user_id, tg_id, Role(role), is_admin, is_blocked, language)
+
+
+async def invalidate_identity(telegram_id: int) -> None:
+    await identity_cache.invalidate_tag(_tag(telegram_id))
+
+
+# -------- ORM 钩子：提交后失效 --------
+@event.listens_for(Session, "after_flush")
+def _track_user_changes(session: Session, flush_context) -> None:
+    # 已删除的行不能再从库里刷新属性，只取已加载的值
+    telegram_ids = {
+        obj.telegram_id for obj in chain(session.new, session.dirty) if isinstance(obj, User)
+    } | {obj.__dict__.get("telegram_id") for obj in session.deleted if isinstance(obj, User)}
+    telegram_ids.discard(None)
+    if telegram_ids:
+        session.info.setdefault(_SESSION_KEY, set()).update(telegram_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session) -> None:
+    telegram_ids = session.info.pop(_SESSION_KEY, None)
+    if telegram_ids:
+        invalidate_tags_soon(*(_tag(tg_id) for tg_id in telegram_ids))
+        logger.debug(f"🪪 用户身份缓存失效: {sorted(telegram_ids)}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session: Session) -> None:
+    session.info.pop(_SESSION_KEY, None)
@@ -4,21 +4,22 @@ from typing import List,Union, Optional, Dict, Any
 from uuid import UUID
 import logging
 from decimal import Decimal
-from datetime import datetime, timezone
+from datetime import datetime
 from aiogram import Router, F, Bot
 from aiogram.types import CallbackQuery, Message
 from aiogram.filters import Command
-from sqlalchemy import update, select, insert
+from sqlalchemy import select, insert
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
-from db.session import get_async_session
+from db.session import get_async_session, transaction
 from config.settings import settings
 from db.models import Order, OrderItem,OrderStatus
 from utils.formatting import format_order_detail, format_product_list, format_order_status,_safe_reply,parse_order_id
 from utils.callback_utils import parse_callback_uuid, parse_callback_int
 
-from db.crud import UserCRUD,OrderCRUD, ProductCRUD, CartCRUD
+from db.crud import OrderCRUD, ProductCRUD, CartCRUD
 from handlers.payment import PaymentService
+from services.identity import get_identity
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG if settings.env != "prod" else logging.INFO)
 
@@ -42,13 +43,18 @@ async def get_order_by_id(session: AsyncSession, order_id: UUID):
         logger.exception(f"查询订单失败: {e}")
         return None
 #
-async def get_latest_unpaid_order(user_id: UUID, db: AsyncSession) -> Optional[Order]:
+async def get_latest_unpaid_order(
+    user_id: UUID, db: AsyncSession, since: Optional[datetime] = None
+) -> Optional[Order]:
+    """since（例如 hot_window_start()）只看这之后创建的订单，分区裁剪后只扫近期分区"""
     stmt = (
         select(Order)
         .where(Order.user_id == user_id, Order.status != OrderStatus.PAID.value)
         .order_by(Order.created_at.desc())
         .limit(1)
     )
+    if since is not None:
+        stmt = stmt.where(Order.created_at >= since)
     result = await db.execute(stmt)
     return result.scalar_one_or_none()
 #
@@ -155,18 +161,16 @@ async def checkout_cart(user, cart_items: List[Dict], db: AsyncSession) -> Dict:
 # -------------------------------
 #
 async def mark_order_paid(order_id: UUID, payment_id: str, db: AsyncSession) -> bool:
-    async with db.begin():
-        result = await db.execute(
-            update(Order)
-            .where(Order.id == order_id)
-            .values(
-                status=OrderStatus.PAID.value,
-                payment_id=payment_id,
-                paid_at=datetime.now(timezone.utc)
-            )
-            .execution_options(synchronize_session="fetch")
-        )
-    return result.rowcount > 0
+    # 走 ORM 改状态，site_stats 增量钩子才能拿到新旧状态
+    async with transaction(db):
+        order = await db.get(Order, order_id, with_for_update=True)
+        if order is None:
+            return False
+        order.status = OrderStatus.PAID
+        order.is_paid = True
+        order.payment_date = datetime.utcnow()  # payment_date 是不带时区的列
+    logger.info(f"订单 {order_id} 已支付 payment_id={payment_id}")
+    return True
 #
 async def mark_order_as_refunded(order_id: UUID, session: AsyncSession) -> bool:
     """标记订单为已退款"""
@@ -199,7 +203,7 @@ async def handle_list_orders(message: Message):
         return
 
     async with get_async_session() as session:
-        user = await UserCRUD.get_by_telegram_id(session, message.from_user.id)
+        user = await get_identity(message.from_user.id)
         if not user:
             await _safe_reply(message,"❌ 用户不存在")
             return
@@ -227,7 +231,7 @@ async def handle_payment(message: Message, bot: Bot):
             return
 
         async with get_async_session() as session:
-            user = await UserCRUD.get_by_telegram_id(session, message.from_user.id)
+            user = await get_identity(message.from_user.id)
             if not user:
                 await _safe_reply(message,"❌ 用户不存在")
                 return
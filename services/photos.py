@@ -0,0 +1,119 @@
+# services/photos.py
+"""
+商品图片：按 file_id 复用
+
+- 发送时优先用 Product.image_file_id，没有再用 image_url（Telegram 每次都要去拉远程图片）；
+- 按 URL 第一次发送成功后，把返回的 file_id 批量回填到 products.image_file_id，
+  并通知目录快照刷新，之后的渲染都按 file_id 发送；
+- /warm_photos：后台把目录里还没有 file_id 的图片逐个发到私有会话，顺带批量回填。
+
+改 image_url 时请同时把 image_file_id 置空，否则会继续发旧图。
+"""
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+from sqlalchemy.exc import SQLAlchemyError
+
+from config.settings import get_app_settings
+from db.crud import ProductCRUD
+from db.dto import ProductRow
+from db.session import get_async_session, transaction
+from services.catalog import catalog
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+FILE_ID_SENDS = registry.counter("product_photo_file_id_sends_total", "按 file_id 发送的商品图片")
+URL_SENDS = registry.counter("product_photo_url_sends_total", "按 URL 发送的商品图片（Telegram 需拉取远程图片）")
+FILLED = registry.counter("product_photo_file_ids_filled_total", "回填的 file_id 数")
+
+# (商品 id, 发送时的 image_url, file_id)
+FileIdRow = Tuple[UUID, str, str]
+
+
+def photo_ref(product: ProductRow) -> Optional[str]:
+    """answer_photo 的 photo 参数；没有图片返回 None"""
+    if product.image_file_id:
+        FILE_ID_SENDS.inc()
+        return product.image_file_id
+    if product.image_url:
+        URL_SENDS.inc()
+        return product.image_url
+    return None
+
+
+def learned_file_id(product: ProductRow, message: Optional[Message]) -> Optional[FileIdRow]:
+    """按 URL 发送后，从返回的消息里取最大尺寸的 file_id"""
+    if product.image_file_id or not product.image_url:
+        return None
+    photos = getattr(message, "photo", None)
+    if not photos:
+        return None
+    return product.id, product.image_url, photos[-1].file_id
+
+
+async def save_file_ids(rows: Iterable[Optional[FileIdRow]]) -> int:
+    """尽力而为：写库失败只记日志，下次按 URL 发送时再回填"""
+    rows = [row for row in rows if row is not None]
+    if not rows:
+        return 0
+    try:
+        async with get_async_session() as session:
+            async with transaction(session):
+                filled = await ProductCRUD.fill_image_file_ids(session, rows)
+    except SQLAlchemyError as e:
+        logger.warning(f"⚠️ 回填商品图片 file_id 失败（{len(rows)} 条）: {e}")
+        return 0
+    catalog.changed({pid for pid, _, _ in rows})
+    FILLED.inc(filled)
+    logger.info(f"🖼️ 回填商品图片 file_id: {filled}/{len(rows)}")
+    return filled
+
+
+# -----------------------------
+# 预热
+# -----------------------------
+async def _upload(bot: Bot, chat_id: int, product: ProductRow) -> Optional[Message]:
+    for _ in range(3):
+        try:
+            return await bot.send_photo(chat_id, photo=product.image_url, disable_notification=True)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            logger.warning(f"⚠️ 商品 {product.id} 图片无法发送（{product.image_url}）: {e}")
+            return None
+    return None
+
+
+async def warm_product_photos(
+    bot: Bot,
+    chat_id: int,
+    interval: float = settings.photo_warmup_interval,
+    batch_size: int = 50,
+) -> Tuple[int, int]:
+    """把目录里只有 image_url 的商品图片各上传一次；返回 (回填数, 待处理数)"""
+    pending = [p for p in await catalog.active_products() if p.image_url and not p.image_file_id]
+    logger.info(f"🔥 商品图片预热开始: {len(pending)} 张")
+    rows: List[Optional[FileIdRow]] = []
+    filled = 0
+    for product in pending:
+        message = await _upload(bot, chat_id, product)
+        rows.append(learned_file_id(product, message))
+        if message is not None:
+            try:
+                await bot.delete_message(chat_id, message.message_id)
+            except TelegramBadRequest:
+                pass
+        if len(rows) >= batch_size:
+            filled += await save_file_ids(rows)
+            rows = []
+        await asyncio.sleep(interval)
+    filled += await save_file_ids(rows)
+    logger.info(f"✅ 商品图片预热完成: {filled}/{len(pending)}")
+    return filled, len(pending)
@@ -2,10 +2,15 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from db.models import Product
-from typing import Sequence,Any,List
+from typing import Sequence,Any
 from uuid import UUID
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from db.session import get_async_session
+from db.crud import ProductCRUD
+from db.dto import ProductRow
+from services.catalog import catalog
+from services.photos import learned_file_id, photo_ref, save_file_ids
+from services.views import RenderedView, views
 from utils.formatting import format_product_detail
 from utils.formatting import _safe_reply
 from decimal import Decimal
@@ -19,19 +24,16 @@ def translate(key: str, lang: str = "zh") -> str:
         "discount": {"zh": "折扣", "en": "Discount"},
         "sales": {"zh": "销量", "en": "Sales"},
         "stock": {"zh": "库存", "en": "Stock"},
+        "yuan": {"zh": "元", "en": "CNY"},
     }
     return translations.get(key, {}).get(lang, key)
 
-# ✅ 获取所有上架商品（传入 session 版本）
-async def get_all_products() -> List[Product]:
+# ✅ 获取所有上架商品（目录快照）
+async def get_all_products() -> Sequence[ProductRow]:
     """获取所有上架商品"""
-    async with get_async_session() as session:
-        stmt = select(Product).where(Product.is_active == True)
-        result = await session.execute(stmt)
-        products = list(result.scalars().all())
-        return products
+    return await catalog.active_products()
 
-def build_product_keyboard(product: Product) -> InlineKeyboardMarkup:
+def build_product_keyboard(product: Product | ProductRow) -> InlineKeyboardMarkup:
     buttons = []
     if product.stock > 0:
         buttons.append([InlineKeyboardButton(text="🛒 加入购物车", callback_data=f"addcart:{product.id}")])
@@ -40,18 +42,25 @@ def build_product_keyboard(product: Product) -> InlineKeyboardMarkup:
         buttons.append([InlineKeyboardButton(text="❌ 已售罄", callback_data="soldout")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def build_product_caption(product: Product) -> str:
+def build_product_caption(product: Product | ProductRow, lang: str = "zh") -> str:
     return (
         f"📦 <b>{product.name}</b>\n"
-        f"💰 价格: {product.price} 元\n"
-        f"📦 库存: {product.stock}\n\n"
+        f"💰 {translate('price', lang)}: {product.price} {translate('yuan', lang)}\n"
+        f"📦 {translate('stock', lang)}: {product.stock}\n\n"
         f"{product.description or ''}"
     )
 
+def product_card_view(version: int, product: ProductRow, lang: str = "zh") -> RenderedView:
+    """商品卡片（说明 + 加购 / 购买按钮）的缓存渲染；version 是 product 所在的 catalog 快照版本"""
+    return views.get_or_render(
+        version,
+        ("card", product.id, lang),
+        lambda: (build_product_caption(product, lang), build_product_keyboard(product)),
+    )
+
 # ✅ 获取商品详情（字典格式）
 async def list_active_products(session: AsyncSession) -> list[dict]:
-    result = await session.execute(select(Product).where(Product.is_active == True))
-    products = result.scalars().all()
+    products = await ProductCRUD.list_active(session)
     return [
         {
             "id": p.id,
@@ -59,7 +68,7 @@ async def list_active_products(session: AsyncSession) -> list[dict]:
             "price": float(p.price),
             "stock": p.stock,
             "description": p.description,
-            "image_url": getattr(p, "image_url", None),
+            "image_url": p.image_url,
         }
         for p in products
     ]    
@@ -80,39 +89,30 @@ async def get_product_by_id(db: AsyncSession, product_id: UUID) -> dict[str, Any
     }
 
 # ✅ 商品菜单展示
-async def show_main_menu(callback: CallbackQuery):
-    """展示商品菜单"""
+async def show_main_menu(callback: CallbackQuery, lang: str = "zh"):
+    """展示商品菜单：上架商品来自目录快照，卡片文案和按钮来自渲染缓存"""
     msg = callback.message
     if not isinstance(msg, Message):
         await _safe_reply(callback,"消息不可用", show_alert=True)
         return  
 
-    async with get_async_session() as session:
-        products = (await session.execute(select(Product))).scalars().all()
+    version, products = await catalog.snapshot()
 
     if not products:
         await _safe_reply(msg or callback,"📭 暂无商品")
         return
 
+    learned = []
     for product in products:
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="🛒 加入购物车", callback_data=f"addcart:{product.id}")],
-                [InlineKeyboardButton(text=f"💳 立即购买 {product.price} 元", callback_data=f"buy:{product.id}")]
-            ]
-        )
-        caption = (
-            f"📦 <b>{product.name}</b>\n"
-            f"💰 价格: {product.price} 元\n"
-            f"📉 折扣: {getattr(product, 'discount', '无')}\n"
-            f"🔥 销量: {getattr(product, 'sales', 0)} 件\n"
-            f"📦 库存: {product.stock}\n\n"
-            f"{product.description or ''}"
-        )
-        if product.image_url:
-            await msg.answer_photo(photo=product.image_url, caption=caption, reply_markup=keyboard)
+        view = product_card_view(version, product, lang)
+        photo = photo_ref(product)
+        if photo:
+            sent = await msg.answer_photo(photo=photo, caption=view.caption, reply_markup=view.reply_markup)
+            learned.append(learned_file_id(product, sent))
         else:
-            await _safe_reply(msg or callback,caption, reply_markup=keyboard)
+            await _safe_reply(msg or callback, view.caption, reply_markup=view.reply_markup)
+    # 按 URL 发出去的图片：一次性回填 file_id，下次直接按 file_id 发送
+    await save_file_ids(learned)
 
 # ✅ 创建商品
 async def create_product_db(
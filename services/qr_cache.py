@@ -0,0 +1,232 @@
+# services/qr_cache.py
+"""
+二维码图片缓存（按内容寻址）
+
+key = (sha256(payload), size, style)：同一内容、同一尺寸和样式的二维码只渲染一次。
+
+- 内存：按字节数限额的 LRU（QR_CACHE_MEMORY_BYTES）；
+- 磁盘：QR_CACHE_DIR 下一个 key 一个 PNG，总大小超过 QR_CACHE_DISK_BYTES 时按最近访问时间淘汰；
+- Telegram file_id：第一次上传后记下 photo 的 file_id（TwoTierCache，多个 worker 共享），
+  之后同一张图直接按 file_id 发送，不再上传字节。
+
+只缓存会重复发送的内容（商品链接、邀请链接等）；一次性的支付会话链接直接渲染上传，
+不要放进来，否则只是在磁盘和 Redis 里堆垃圾。
+
+    key = qr_key(url, None, "invite")
+    await qr_cache.send(key, lambda: render_png(url), lambda photo: message.answer_photo(photo=photo))
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from config.settings import get_app_settings
+from utils.cache import TwoTierCache
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+MEMORY_HITS = registry.counter("qr_cache_memory_hits_total", "二维码内存命中")
+DISK_HITS = registry.counter("qr_cache_disk_hits_total", "二维码磁盘命中")
+RENDERS = registry.counter("qr_cache_renders_total", "实际渲染的二维码")
+FILE_ID_HITS = registry.counter("qr_cache_file_id_hits_total", "按 file_id 发送（未重新上传）")
+DISK_EVICTIONS = registry.counter("qr_cache_disk_evictions_total", "磁盘淘汰的文件数")
+
+# key -> 已上传图片的 file_id（file_id 只对本 bot 有效）
+qr_file_ids = TwoTierCache("qr_file_id", ttl=settings.qr_file_id_ttl)
+
+
+def qr_key(payload: str, size: Optional[int], style: str) -> str:
+    digest = hashlib.sha256(payload.encode()).hexdigest()
+    return f"{digest}-{size or 'auto'}-{style}"
+
+
+# -----------------------------
+# 磁盘层（同步实现，由 asyncio.to_thread 调用）
+# -----------------------------
+class _DiskStore:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._total: Optional[int] = None  # 第一次写入时扫描目录得到
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.png")
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(self._file(key))  # mtime 当作最近访问时间
+        except OSError:
+            pass
+        return data
+
+    def write(self, key: str, data: bytes) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        if self._total is None:
+            self._total = sum(e.stat().st_size for e in os.scandir(self.path) if e.is_file())
+        target = self._file(key)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+        self._total += len(data)
+        if self._total > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """删到限额的 90%，避免每次写入都扫描目录"""
+        entries = sorted(
+            (e for e in os.scandir(self.path) if e.is_file() and e.name.endswith(".png")),
+            key=lambda e: e.stat().st_mtime,
+        )
+        total = sum(e.stat().st_size for e in entries)
+        target = int(self.max_bytes * 0.9)
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            DISK_EVICTIONS.inc()
+        self._total = total
+
+
+class QRCache:
+    def __init__(
+        self,
+        path: str = settings.qr_cache_dir,
+        disk_bytes: int = settings.qr_cache_disk_bytes,
+        memory_bytes: int = settings.qr_cache_memory_bytes,
+        file_ids: TwoTierCache = qr_file_ids,
+    ):
+        self.memory_bytes = memory_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_total = 0
+        self._disk = _DiskStore(path, disk_bytes)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.file_ids = file_ids
+
+    # -------- 内存层 --------
+    def _memory_get(self, key: str) -> Optional[bytes]:
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+        return data
+
+    def _memory_set(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_total -= len(old)
+        self._memory[key] = data
+        self._memory_total += len(data)
+        while self._memory_total > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_total -= len(evicted)
+
+    # -------- PNG --------
+    async def get_or_render(self, key: str, render: Callable[[], bytes]) -> bytes:
+        """内存 → 磁盘 → 渲染（线程池）；同一 key 的并发请求只渲染一次"""
+        data = self._memory_get(key)
+        if data is not None:
+            MEMORY_HITS.inc()
+            return data
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await self._load(key, render)
+            self._memory_set(key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load(self, key: str, render: Callable[[], bytes]) -> bytes:
+        try:
+            data = await asyncio.to_thread(self._disk.read, key)
+        except OSError as e:
+            logger.warning(f"⚠️ 读取二维码磁盘缓存失败: {e}")
+            data = None
+        if data is not None:
+            DISK_HITS.inc()
+            return data
+        RENDERS.inc()
+        data = await asyncio.to_thread(render)
+        try:
+            await asyncio.to_thread(self._disk.write, key, data)
+        except OSError as e:
+            logger.warning(f"⚠️ 写入二维码磁盘缓存失败: {e}")
+        return data
+
+    # -------- Telegram file_id --------
+    async def photo(
+        self, key: str, render: Callable[[], bytes], filename: str = "qrcode.png"
+    ) -> Union[str, BufferedInputFile]:
+        """已上传过：返回 file_id；否则返回要上传的图片，发送后请调用 remember()"""
+        file_id = await self.file_ids.get(key)
+        if file_id:
+            FILE_ID_HITS.inc()
+            return file_id
+        return BufferedInputFile(await self.get_or_render(key, render), filename=filename)
+
+    async def remember(self, key: str, message: Optional[Message]) -> None:
+        photos = getattr(message, "photo", None)
+        if photos:
+            await self.file_ids.set(key, photos[-1].file_id)
+
+    async def forget(self, key: str) -> None:
+        """file_id 失效（Telegram 报错）时调用，下次重新上传"""
+        await self.file_ids.delete(key)
+
+    async def send(
+        self,
+        key: str,
+        render: Callable[[], bytes],
+        send: Callable[[Union[str, BufferedInputFile]], Awaitable[Message]],
+    ) -> Message:
+        """photo() + 发送 + remember()；file_id 被 Telegram 拒绝时改为重新上传一次"""
+        photo = await self.photo(key, render)
+        try:
+            message = await send(photo)
+        except TelegramBadRequest as e:
+            if not isinstance(photo, str):
+                raise
+            logger.warning(f"⚠️ 二维码 file_id 失效，重新上传: {e}")
+            await self.forget(key)
+            message = await send(BufferedInputFile(await self.get_or_render(key, render), filename="qrcode.png"))
+        await self.remember(key, message)
+        return message
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "memory_items": len(self._memory),
+            "memory_bytes": self._memory_total,
+            "disk_bytes": self._disk._total or 0,
+        }
+
+
+qr_cache = QRCache()
+registry.register_collector("qr_cache", qr_cache.stats)
@@ -3,7 +3,6 @@ import io
 import logging
 from typing import Optional, Union, Tuple
 import qrcode
-from aiogram.types import BufferedInputFile
 from aiogram import Bot
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -12,6 +11,7 @@ from qrcode.image.styles.moduledrawers import RoundedModuleDrawer
 from qrcode.image.styledpil import StyledPilImage
 from qrcode.image.pil import PilImage
 from qrcode.image.styles.colormasks import SolidFillColorMask
+from services.qr_cache import qr_cache, qr_key
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +30,60 @@ class QRCodeService:
         self.db = db
         self.bot = bot
 
+    @staticmethod
+    def _render(data: str, size: int, fill_color: str, back_color: str, style: str) -> bytes:
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=ERROR_CORRECT_H,
+            box_size=10,
+            border=4,
+            image_factory=PilImage,  # ✅ 强制使用 PIL 工厂，避免 PyPNGImage
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+
+        # 样式控制
+        img_factory = {
+            "rounded": StyledPilImage,
+            "square": PilImage,
+            "gradient": StyledPilImage,
+        }.get(style, PilImage)
+
+        drawer = RoundedModuleDrawer() if style == "rounded" else None
+
+        if style == "gradient":
+            color_mask = SolidFillColorMask(
+                front_color=(0, 0, 0),
+                back_color=(255, 255, 255),
+            )
+            img = qr.make_image(
+                image_factory=img_factory,
+                module_drawer=drawer,
+                color_mask=color_mask,
+            )
+        else:
+            img = qr.make_image(
+                image_factory=img_factory,
+                module_drawer=drawer,
+                fill_color=fill_color,
+                back_color=back_color,
+            )
+
+        # ✅ 确保拿到 PIL.Image
+        pil_img = img.get_image() if hasattr(img, "get_image") else img
+
+        # ✅ 这里 resize 就不会再报错
+        pil_img = pil_img.resize((size, size))
+
+        output = io.BytesIO()
+        pil_img.save(output, format="PNG")
+        return output.getvalue()
+
+    @staticmethod
+    def cache_key(data: str, size: int, fill_color: str, back_color: str, style: str) -> str:
+        # 颜色也影响图片内容，一起算进样式
+        return qr_key(data, size, f"{style}.{fill_color}.{back_color}".replace("#", ""))
+
     async def generate_qr(
         self,
         data: str,
@@ -38,57 +92,15 @@ class QRCodeService:
         back_color: str = "white",
         style: str = "rounded",
     ) -> QRCodeResponse:
+        """同一 (内容, 尺寸, 样式) 只渲染一次，之后走 qr_cache（内存 / 磁盘）"""
         try:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=ERROR_CORRECT_H,
-                box_size=10,
-                border=4,
-                image_factory=PilImage,  # ✅ 强制使用 PIL 工厂，避免 PyPNGImage
+            image_bytes = await qr_cache.get_or_render(
+                self.cache_key(data, size, fill_color, back_color, style),
+                lambda: self._render(data, size, fill_color, back_color, style),
             )
-            qr.add_data(data)
-            qr.make(fit=True)
-
-            # 样式控制
-            img_factory = {
-                "rounded": StyledPilImage,
-                "square": PilImage,
-                "gradient": StyledPilImage,
-            }.get(style, PilImage)
-
-            drawer = RoundedModuleDrawer() if style == "rounded" else None
-
-            if style == "gradient":
-                color_mask = SolidFillColorMask(
-                    front_color=(0, 0, 0),
-                    back_color=(255, 255, 255),
-                )
-                img = qr.make_image(
-                    image_factory=img_factory,
-                    module_drawer=drawer,
-                    color_mask=color_mask,
-                )
-            else:
-                img = qr.make_image(
-                    image_factory=img_factory,
-                    module_drawer=drawer,
-                    fill_color=fill_color,
-                    back_color=back_color,
-                )
-
-            # ✅ 确保拿到 PIL.Image
-            pil_img = img.get_image() if hasattr(img, "get_image") else img
-
-            # ✅ 这里 resize 就不会再报错
-            pil_img = pil_img.resize((size, size))
-
-            output = io.BytesIO()
-            pil_img.save(output, format="PNG")
-            output.seek(0)
-
             return QRCodeResponse(
                 qr_id=None,
-                image_bytes=output.getvalue(),
+                image_bytes=image_bytes,
                 status="success",
             )
 
@@ -97,21 +109,26 @@ class QRCodeService:
             return QRCodeResponse(status=f"error: {str(e)}")
         
     async def send_telegram_qr(
-        self, chat_id: Union[int, str], qr_data: str, caption: Optional[str] = None
+        self,
+        chat_id: Union[int, str],
+        qr_data: str,
+        caption: Optional[str] = None,
+        size: int = 300,
+        fill_color: str = "black",
+        back_color: str = "white",
+        style: str = "rounded",
     ) -> QRCodeResponse:
-        """发送QR到Telegram (类型安全版本)"""
-        qr_result = await self.generate_qr(qr_data)
-        if qr_result.status != "success" or not qr_result.image_bytes:
-            return QRCodeResponse(status="生成二维码失败")
-
+        """发送QR到Telegram；同一张图上传过一次后按 file_id 发送"""
+        key = self.cache_key(qr_data, size, fill_color, back_color, style)
         try:
-            await self.bot.send_photo(
-                chat_id=chat_id,
-                photo=BufferedInputFile(file=qr_result.image_bytes, filename="qr.png"),
-                caption=caption or "您的二维码",
+            await qr_cache.send(
+                key,
+                lambda: self._render(qr_data, size, fill_color, back_color, style),
+                lambda photo: self.bot.send_photo(
+                    chat_id=chat_id, photo=photo, caption=caption or "您的二维码"
+                ),
             )
-            return qr_result
+            return QRCodeResponse(status="success")
         except ValueError as e:
             logger.error(f"发送QR失败: {e}", exc_info=True)
             return QRCodeResponse(status=f"send_error: {str(e)}")
-
@@ -0,0 +1,426 @@
+# services/update_queue.py
+"""
+Update 队列：接收（轮询 / webhook）和执行 handler 分开（UPDATE_QUEUE=redis / local）
+
+接收端只把原始 update 按 chat_id 的 crc32 分到 UPDATE_QUEUE_PARTITIONS 个分区里入队，
+立即返回；handler 在 worker 进程里执行（python worker.py --index i --count n），
+worker i 负责 partition % n == i 的分区，每个分区一个循环顺序处理：
+
+- 同一个会话永远落在同一分区、由同一个 worker 顺序处理，保持先后顺序；
+  不同会话分散到不同分区并行，慢 handler（二维码、Stripe）只挡住自己分区；
+- redis：每个分区一个 Stream（updates:{p}），消费组 handlers，处理完 XACK；
+  worker 重启后先重放自己名下未 ack 的条目，再读新的；
+  别的消费者名下（扩缩容后分区换了主人）空闲超过 UPDATE_QUEUE_CLAIM_IDLE 的条目用 XAUTOCLAIM 接管；
+  投递超过 UPDATE_QUEUE_MAX_DELIVERIES 次的条目转入 updates:dead 后 ack，不再阻塞分区；
+- local：同样语义的进程内实现，worker 以任务形式跑在 API 进程里，用于开发和测试。
+
+至少一次投递：handler 执行完、ack 之前崩溃，重启后这条 update 会再处理一次。
+"""
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import Update
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from config.settings import AppSettings, get_app_settings
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+STREAM_PREFIX = "updates"
+DEAD_STREAM = "updates:dead"
+GROUP = "handlers"
+
+ENQUEUED = registry.counter("update_queue_enqueued_total", "入队的 update")
+PROCESSED = registry.counter("update_queue_processed_total", "处理完并 ack 的 update")
+REDELIVERED = registry.counter("update_queue_redelivered_total", "重新投递的 update（worker 崩溃 / 被接管）")
+DEAD = registry.counter("update_queue_dead_total", "超过最大投递次数转入死信的 update")
+FAILED = registry.counter("update_queue_handler_errors_total", "处理时抛异常的 update（仍然 ack）")
+DELAY_SECONDS = registry.histogram("update_queue_delay_seconds", "入队到开始处理的等待时间")
+
+
+@dataclass(slots=True, frozen=True)
+class QueuedUpdate:
+    id: str
+    data: bytes
+    deliveries: int
+
+    @property
+    def enqueued_at(self) -> float:
+        """Stream id 的前半段是入队时的毫秒时间戳"""
+        return int(self.id.split("-", 1)[0]) / 1000
+
+
+def chat_id_of(update: Dict[str, Any]) -> int:
+    """update 里唯一的负载字段里找 chat.id；没有会话（inline 查询等）用发起人 id"""
+    for field, payload in update.items():
+        if field == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+def partition_of(update: Dict[str, Any], partitions: int) -> int:
+    # crc32 而不是 hash()：各进程的 hash 种子不同
+    return zlib.crc32(str(chat_id_of(update)).encode()) % partitions
+
+
+# -----------------------------
+# 本地实现（进程内，语义与 Redis Streams 一致）
+# -----------------------------
+class _LocalStream:
+    def __init__(self):
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.new: Deque[str] = deque()
+        # id -> [消费者, 投递时间, 投递次数]
+        self.pending: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self.event = asyncio.Event()
+        self.seq = 0
+
+
+class LocalUpdateQueue:
+    def __init__(
+        self,
+        partitions: int = settings.update_queue_partitions,
+        maxlen: int = settings.update_queue_maxlen,
+        claim_idle: float = settings.update_queue_claim_idle,
+    ):
+        self.partitions = partitions
+        self.maxlen = maxlen
+        self.claim_idle = claim_idle
+        self._streams = [_LocalStream() for _ in range(partitions)]
+        self._recovered: Set[Tuple[int, str]] = set()
+        self.dead: List[Tuple[int, QueuedUpdate]] = []
+
+    async def push(self, partition: int, data: bytes) -> str:
+        stream = self._streams[partition]
+        stream.seq += 1
+        entry_id = f"{int(time.time() * 1000)}-{stream.seq}"
+        stream.entries[entry_id] = data
+        stream.new.append(entry_id)
+        while len(stream.entries) > self.maxlen:
+            stream.entries.popitem(last=False)
+        stream.event.set()
+        return entry_id
+
+    def _deliver(self, stream: _LocalStream, ids: Sequence[str], consumer: str) -> List[QueuedUpdate]:
+        now = time.monotonic()
+        delivered = []
+        for entry_id in ids:
+            data = stream.entries.get(entry_id)
+            if data is None:  # 已被 maxlen 裁掉
+                stream.pending.pop(entry_id, None)
+                continue
+            info = stream.pending.get(entry_id)
+            deliveries = (info[2] if info else 0) + 1
+            stream.pending[entry_id] = [consumer, now, deliveries]
+            delivered.append(QueuedUpdate(entry_id, data, deliveries))
+        return delivered
+
+    async def read(self, partition: int, consumer: str, count: int, block: float) -> List[QueuedUpdate]:
+        stream = self._streams[partition]
+        if (partition, consumer) not in self._recovered:
+            own = [i for i, info in stream.pending.items() if info[0] == consumer][:count]
+            if own:
+                return self._deliver(stream, own, consumer)
+            self._recovered.add((partition, consumer))
+        now = time.monotonic()
+        stuck = [i for i, info in stream.pending.items() if now - info[1] >= self.claim_idle][:count]
+        if stuck:
+            return self._deliver(stream, stuck, consumer)
+        if not stream.new:
+            stream.event.clear()
+            try:
+                await asyncio.wait_for(stream.event.wait(), timeout=block)
+            except asyncio.TimeoutError:
+                return []
+        ids = [stream.new.popleft() for _ in range(min(count, len(stream.new)))]
+        return self._deliver(stream, ids, consumer)
+
+    async def ack(self, partition: int, ids: Sequence[str]) -> None:
+        stream = self._streams[partition]
+        for entry_id in ids:
+            stream.pending.pop(entry_id, None)
+
+    async def dead_letter(self, partition: int, item: QueuedUpdate) -> None:
+        self.dead.append((partition, item))
+
+    async def backlog(self, partition: int) -> Tuple[int, int]:
+        """(未投递条数, 已投递未 ack 条数)"""
+        stream = self._streams[partition]
+        return len(stream.new), len(stream.pending)
+
+    async def close(self) -> None:
+        pass
+
+
+# -----------------------------
+# Redis Streams
+# -----------------------------
+class RedisUpdateQueue:
+    def __init__(
+        self,
+        redis: Redis,
+        partitions: int = settings.update_queue_partitions,
+        maxlen: int = settings.update_queue_maxlen,
+        claim_idle: float = settings.update_queue_claim_idle,
+    ):
+        self.redis = redis
+        self.partitions = partitions
+        self.maxlen = maxlen
+        self.claim_idle = claim_idle
+        self._recovered: Set[Tuple[int, str]] = set()
+        self._last_claim: Dict[Tuple[int, str], float] = {}
+
+    @staticmethod
+    def stream(partition: int) -> str:
+        return f"{STREAM_PREFIX}:{partition}"
+
+    async def ensure_groups(self) -> None:
+        for partition in range(self.partitions):
+            try:
+                await self.redis.xgroup_create(self.stream(partition), GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def push(self, partition: int, data: bytes) -> str:
+        entry_id = await self.redis.xadd(
+            self.stream(partition), {"d": data}, maxlen=self.maxlen, approximate=True
+        )
+        return entry_id.decode()
+
+    async def _delivered(
+        self, partition: int, entries: Sequence[Tuple[bytes, Optional[Dict[bytes, bytes]]]], redelivery: bool
+    ) -> List[QueuedUpdate]:
+        if not entries:
+            return []
+        # 已被 MAXLEN 裁掉的条目只剩 id：直接 ack
+        trimmed = [entry_id for entry_id, fields in entries if not fields]
+        if trimmed:
+            await self.redis.xack(self.stream(partition), GROUP, *trimmed)
+        entries = [(entry_id.decode(), fields[b"d"]) for entry_id, fields in entries if fields]
+        if not entries:
+            return []
+        counts: Dict[str, int] = {}
+        if redelivery:
+            rows = await self.redis.xpending_range(
+                self.stream(partition), GROUP, min=entries[0][0], max=entries[-1][0], count=len(entries)
+            )
+            counts = {row["message_id"].decode(): row["times_delivered"] for row in rows}
+        return [QueuedUpdate(entry_id, data, counts.get(entry_id, 1)) for entry_id, data in entries]
+
+    async def read(self, partition: int, consumer: str, count: int, block: float) -> List[QueuedUpdate]:
+        stream, key = self.stream(partition), (partition, consumer)
+        if key not in self._recovered:
+            # 先重放自己名下未 ack 的（上次崩溃 / 重启前没处理完的）
+            response = await self.redis.xreadgroup(GROUP, consumer, {stream: "0"}, count=count)
+            entries = response[0][1] if response else []
+            if entries:
+                return await self._delivered(partition, entries, redelivery=True)
+            self._recovered.add(key)
+        now = time.monotonic()
+        if now - self._last_claim.get(key, 0.0) >= self.claim_idle / 2:
+            self._last_claim[key] = now
+            response = await self.redis.xautoclaim(
+                stream, GROUP, consumer, min_idle_time=int(self.claim_idle * 1000), start_id="0-0", count=count
+            )
+            if response[1]:
+                return await self._delivered(partition, response[1], redelivery=True)
+        response = await self.redis.xreadgroup(
+            GROUP, consumer, {stream: ">"}, count=count, block=int(block * 1000)
+        )
+        return await self._delivered(partition, response[0][1] if response else [], redelivery=False)
+
+    async def ack(self, partition: int, ids: Sequence[str]) -> None:
+        await self.redis.xack(self.stream(partition), GROUP, *ids)
+
+    async def dead_letter(self, partition: int, item: QueuedUpdate) -> None:
+        await self.redis.xadd(
+            DEAD_STREAM,
+            {"partition": partition, "id": item.id, "deliveries": item.deliveries, "d": item.data},
+            maxlen=self.maxlen,
+            approximate=True,
+        )
+
+    async def backlog(self, partition: int) -> Tuple[int, int]:
+        groups = await self.redis.xinfo_groups(self.stream(partition))
+        for group in groups:
+            if group["name"] in (GROUP, GROUP.encode()):
+                # lag 需要 Redis 7+；旧版本返回 None 时退回到 XLEN（上界）
+                lag = group.get("lag")
+                if lag is None:
+                    lag = await self.redis.xlen(self.stream(partition))
+                return int(lag), int(group["pending"])
+        return 0, 0
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+UpdateQueue = LocalUpdateQueue | RedisUpdateQueue
+
+
+def build_update_queue(settings: AppSettings) -> Optional[UpdateQueue]:
+    if settings.update_queue == "redis":
+        # 数据是原始字节，不用 decode_responses
+        return RedisUpdateQueue(Redis.from_url(settings.redis_url))
+    if settings.update_queue == "local":
+        return LocalUpdateQueue()
+    return None
+
+
+# -----------------------------
+# 接收端
+# -----------------------------
+async def enqueue(queue: UpdateQueue, raw: bytes) -> None:
+    """webhook：原始请求体直接入队（只解析出 chat_id 用来分区）"""
+    await queue.push(partition_of(json.loads(raw), queue.partitions), raw)
+    ENQUEUED.inc()
+
+
+class EnqueueMiddleware(BaseMiddleware):
+    """
+    轮询接收端的 Dispatcher 上唯一的中间件：入队后不再往下执行 handler。
+
+    轮询在处理前就已推进 offset，入队失败不能丢：一直重试（退避到 max_backoff 秒），
+    期间轮询停住（需要 handle_as_tasks=False），进程被停掉时新的 offset 还没确认给
+    Telegram，重启后这条 update 会重新拿到。
+    """
+
+    def __init__(self, queue: UpdateQueue, max_backoff: float = 30.0):
+        self.queue = queue
+        self.max_backoff = max_backoff
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]) -> Any:
+        raw = event.model_dump_json(exclude_unset=True, by_alias=True).encode()
+        delay = 0.5
+        while True:
+            try:
+                await enqueue(self.queue, raw)
+                return
+            except RedisError as e:
+                logger.warning(f"⚠️ update {event.update_id} 入队失败，{delay:.1f} 秒后重试: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+
+def intake_dispatcher(queue: UpdateQueue) -> Dispatcher:
+    """配合 start_polling(..., handle_as_tasks=False) 使用，保证入队顺序"""
+    dp = Dispatcher()
+    dp.update.outer_middleware(EnqueueMiddleware(queue))
+    return dp
+
+
+# -----------------------------
+# 消费端
+# -----------------------------
+class UpdateWorker:
+    def __init__(
+        self,
+        queue: UpdateQueue,
+        bot: Bot,
+        dp: Dispatcher,
+        index: int = 0,
+        count: int = 1,
+        batch: int = settings.update_queue_batch,
+        max_deliveries: int = settings.update_queue_max_deliveries,
+        block: float = 2.0,
+    ):
+        self.queue = queue
+        self.bot = bot
+        self.dp = dp
+        self.consumer = f"worker-{index}"
+        self.partitions = [p for p in range(queue.partitions) if p % count == index]
+        self.batch = batch
+        self.max_deliveries = max_deliveries
+        self.block = block
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self._watcher: Optional[asyncio.Task] = None
+        self._backlog: Dict[int, Tuple[int, int]] = {}
+
+    def start(self) -> None:
+        registry.register_collector("update_queue", self.stats)
+        self._tasks = [asyncio.create_task(self._consume(p)) for p in self.partitions]
+        self._watcher = asyncio.create_task(self._watch_backlog())
+        logger.info(f"✅ {self.consumer} 开始处理分区 {self.partitions}")
+
+    async def stop(self, timeout: float = settings.webhook_drain_timeout) -> None:
+        """等当前 update 处理完（最多 timeout 秒）；被取消的未 ack，之后会重投"""
+        self._stopping = True
+        if self._watcher:
+            self._watcher.cancel()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout + self.block)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.info(f"🛑 {self.consumer} 已停止")
+
+    async def _consume(self, partition: int) -> None:
+        while not self._stopping:
+            try:
+                batch = await self.queue.read(partition, self.consumer, self.batch, self.block)
+                for item in batch:
+                    await self._handle(partition, item)
+                    await self.queue.ack(partition, [item.id])
+            except RedisError as e:
+                logger.warning(f"⚠️ 分区 {partition} 读取 / ack 失败，1 秒后重试: {e}")
+                await asyncio.sleep(1)
+
+    async def _handle(self, partition: int, item: QueuedUpdate) -> None:
+        if item.deliveries > 1:
+            REDELIVERED.inc()
+        if item.deliveries > self.max_deliveries:
+            DEAD.inc()
+            logger.error(f"☠️ 分区 {partition} 的 update {item.id} 已投递 {item.deliveries} 次，转入死信")
+            await self.queue.dead_letter(partition, item)
+            return
+        DELAY_SECONDS.observe(max(0.0, time.time() - item.enqueued_at))
+        try:
+            update = Update.model_validate_json(item.data, context={"bot": self.bot})
+        except ValidationError as e:
+            logger.warning(f"⚠️ 无法解析的 update {item.id}: {e}")
+            return
+        try:
+            await self.dp.feed_update(self.bot, update)
+            PROCESSED.inc()
+        except Exception as e:
+            # handler 的 bug 重投也不会好：记日志后照样 ack
+            FAILED.inc()
+            logger.exception(f"❌ 处理 update {update.update_id} 失败: {e}")
+
+    async def _watch_backlog(self, interval: float = 5.0) -> None:
+        while not self._stopping:
+            for partition in self.partitions:
+                try:
+                    self._backlog[partition] = await self.queue.backlog(partition)
+                except RedisError as e:
+                    logger.warning(f"⚠️ 读取分区 {partition} 积压失败: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "consumer": self.consumer,
+            "lag": sum(lag for lag, _ in self._backlog.values()),
+            "partitions": {
+                str(p): {"lag": lag, "pending": pending} for p, (lag, pending) in sorted(self._backlog.items())
+            },
+        }
@@ -0,0 +1,165 @@
+# services/views.py
+"""
+商品菜单 / 卡片 / 详情的渲染结果缓存
+
+key = (catalog.version, 视图名, 商品 id, 语言)：目录任何变化 version + 1，
+发现版本变了就整体丢弃旧条目，不需要单独失效。version 必须是渲染所用数据所属的版本
+（catalog.snapshot() / get_versioned() 一起取出），调用方 await 期间目录更新了也不会
+把旧数据存到新版本下；比缓存当前版本旧的渲染结果照常返回，但不缓存。
+
+缓存的是最终 caption 和 reply_markup：InlineKeyboardMarkup 只在首次渲染时构造，
+同时预先序列化成 JSON；PreparedMarkupMiddleware 发请求前直接换成这段 JSON，
+热路径上既不碰数据库 / ORM，也不再构造和 model_dump pydantic 模型。
+缓存里的 markup 是共享对象，不要修改。
+"""
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Optional, Sequence, Tuple
+from uuid import UUID
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from pydantic import PrivateAttr
+
+from config.settings import get_app_settings
+from db.dto import ProductRow, UserIdentity
+from services.catalog import catalog
+from utils.formatting import build_product_detail_kb, build_product_menu
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+
+class PreparedInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """带预序列化 JSON 的键盘；Telegram 请求里的 reply_markup 就是这段字符串"""
+
+    _json: str = PrivateAttr(default="")
+
+    @property
+    def prepared_json(self) -> str:
+        return self._json
+
+
+def prepare_markup(markup: InlineKeyboardMarkup) -> PreparedInlineKeyboardMarkup:
+    prepared = PreparedInlineKeyboardMarkup.model_validate(markup.model_dump())
+    # 与 aiogram 发请求时的序列化一致：去掉值为 None 的字段
+    prepared._json = json.dumps(
+        prepared.model_dump(mode="json", exclude_none=True), ensure_ascii=False, separators=(",", ":")
+    )
+    return prepared
+
+
+@dataclass(slots=True, frozen=True)
+class RenderedView:
+    caption: str
+    reply_markup: Optional[PreparedInlineKeyboardMarkup]
+
+
+class ViewCache:
+    def __init__(self, maxsize: int = settings.view_cache_size):
+        self.maxsize = maxsize
+        self._views: "OrderedDict[Tuple[Hashable, ...], RenderedView]" = OrderedDict()
+        self._version = -1
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(
+        self,
+        version: int,
+        key: Tuple[Hashable, ...],
+        render: Callable[[], Tuple[str, Optional[InlineKeyboardMarkup]]],
+    ) -> RenderedView:
+        """version：render 用到的数据来自哪个 catalog 版本"""
+        if version < self._version:
+            caption, markup = render()
+            return RenderedView(caption, prepare_markup(markup) if markup is not None else None)
+        if version > self._version:
+            self._views.clear()
+            self._version = version
+        full_key = (version, *key)
+        view = self._views.get(full_key)
+        if view is not None:
+            self.hits += 1
+            self._views.move_to_end(full_key)
+            return view
+        self.misses += 1
+        caption, markup = render()
+        view = RenderedView(caption, prepare_markup(markup) if markup is not None else None)
+        self._views[full_key] = view
+        while len(self._views) > self.maxsize:
+            self._views.popitem(last=False)
+        return view
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "version": self._version,
+            "views": len(self._views),
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+views = ViewCache()
+registry.register_collector("view_cache", views.stats)
+
+
+def view_lang(identity: Optional[UserIdentity]) -> str:
+    return (identity and identity.language) or settings.default_lang
+
+
+# -----------------------------
+# 渲染函数（只依赖 ProductRow，不访问数据库）
+# 商品卡片的 build_product_caption / build_product_keyboard 在 services.products
+# -----------------------------
+def _build_buy_list(products: Sequence[ProductRow]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{p.name} — ¥{p.price} (库存: {p.stock})", callback_data=f"buy:{p.id}")]
+        for p in products
+    ])
+
+
+def _detail_text(product: ProductRow) -> str:
+    return (
+        f"📦 商品：{product.name}\n"
+        f"💰 价格：¥{product.price}\n"
+        f"📝 介绍：{product.description or '暂无介绍'}"
+    )
+
+
+# -----------------------------
+# 视图：没有上架商品 / 商品不存在时返回 None
+# -----------------------------
+async def product_menu_view(lang: str) -> Optional[RenderedView]:
+    """/menu：商品名 + 价格，点进详情"""
+    version, products = await catalog.snapshot()
+    if not products:
+        return None
+    return views.get_or_render(
+        version, ("menu", None, lang), lambda: ("🛍️ 请选择商品：", build_product_menu(products))
+    )
+
+
+async def product_buy_list_view(lang: str) -> Optional[RenderedView]:
+    """/products：带库存的直接购买列表"""
+    version, products = await catalog.snapshot()
+    if not products:
+        return None
+    return views.get_or_render(
+        version,
+        ("buy_list", None, lang),
+        lambda: ("📦 可选商品列表：点击下方按钮直接购买", _build_buy_list(products)),
+    )
+
+
+async def product_detail_view(product_id: UUID, lang: str) -> Optional[RenderedView]:
+    version, product = await catalog.get_versioned(product_id)
+    if product is None:
+        return None
+    return views.get_or_render(
+        version,
+        ("detail", product_id, lang),
+        lambda: (_detail_text(product), build_product_detail_kb(product.id)),
+    )
+
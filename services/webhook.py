@@ -0,0 +1,165 @@
+# services/webhook.py
+"""
+Webhook 模式接收 Telegram update（BOT_MODE=webhook）
+
+轮询模式下每个 uvicorn worker 都会 getUpdates，多个 worker 互相抢 update；
+webhook 模式由 Telegram 把 update POST 到 WEBHOOK_BASE_URL + WEBHOOK_PATH，
+负载均衡分给任意 worker / 实例，可以水平扩容。
+
+- 校验 X-Telegram-Bot-Api-Secret-Token，不对返回 401；
+- 解析后立即返回 200，处理放到后台任务：Telegram 不用等 handler，
+  每个 worker 同时处理 WEBHOOK_CONCURRENCY 个，其余排队；
+- 排队 + 处理中超过 WEBHOOK_MAX_PENDING 时返回 503，Telegram 会稍后重投（背压）；
+- UPDATE_QUEUE 开启时只入队、不在本进程执行 handler（见 services.update_queue）；
+- handler 不在 webhook 响应里回复（不用 "reply in webhook"），统一走 Bot API 请求。
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+from typing import Any, Dict, List, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import APIRouter, Request, Response
+from pydantic import ValidationError
+from redis.exceptions import RedisError
+
+from config.settings import get_app_settings
+from services.update_queue import enqueue
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+RECEIVED = registry.counter("webhook_updates_total", "收到并接受的 update")
+UNAUTHORIZED = registry.counter("webhook_unauthorized_total", "secret token 不匹配的请求")
+REJECTED = registry.counter("webhook_rejected_total", "积压过多返回 503 的 update")
+FAILED = registry.counter("webhook_handler_errors_total", "处理时抛异常的 update")
+PROCESS_SECONDS = registry.histogram("webhook_process_seconds", "单个 update 的处理耗时（不含排队）")
+
+
+def webhook_secret() -> str:
+    """Telegram 只允许 A-Z a-z 0-9 _ -，最长 256；未配置时由 bot token 派生，所有 worker 算出来相同"""
+    if settings.webhook_secret:
+        return settings.webhook_secret
+    return hashlib.sha256(f"webhook:{settings.bot_token}".encode()).hexdigest()
+
+
+def webhook_url() -> str:
+    if not settings.webhook_base_url:
+        raise RuntimeError("BOT_MODE=webhook 需要配置 WEBHOOK_BASE_URL")
+    return settings.webhook_base_url.rstrip("/") + settings.webhook_path
+
+
+class WebhookDispatcher:
+    """把 update 交给 Dispatcher.feed_update，控制并发和积压"""
+
+    def __init__(
+        self,
+        concurrency: int = settings.webhook_concurrency,
+        max_pending: int = settings.webhook_max_pending,
+    ):
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._running = 0
+
+    def submit(self, bot: Bot, dp: Dispatcher, update: Update) -> bool:
+        """积压已满返回 False（调用方回 503）"""
+        if len(self._tasks) >= self.max_pending:
+            REJECTED.inc()
+            return False
+        RECEIVED.inc()
+        task = asyncio.create_task(self._process(bot, dp, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _process(self, bot: Bot, dp: Dispatcher, update: Update) -> None:
+        async with self._semaphore:
+            self._running += 1
+            start = asyncio.get_running_loop().time()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                FAILED.inc()
+                logger.exception(f"❌ 处理 update {update.update_id} 失败: {e}")
+            finally:
+                self._running -= 1
+                PROCESS_SECONDS.observe(asyncio.get_running_loop().time() - start)
+
+    async def drain(self, timeout: float = settings.webhook_drain_timeout) -> None:
+        """停机：等处理中 / 排队的 update 做完，超时的取消"""
+        if not self._tasks:
+            return
+        logger.info(f"⏳ 等待 {len(self._tasks)} 个 update 处理完成")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"⚠️ 停机超时，取消 {len(pending)} 个未完成的 update")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self._tasks), "running": self._running}
+
+
+webhook_dispatcher = WebhookDispatcher()
+registry.register_collector("webhook", webhook_dispatcher.stats)
+
+router = APIRouter()
+
+
+@router.post(settings.webhook_path, include_in_schema=False)
+async def telegram_webhook(request: Request) -> Response:
+    token = request.headers.get(SECRET_HEADER, "")
+    if not hmac.compare_digest(token.encode(), webhook_secret().encode()):
+        UNAUTHORIZED.inc()
+        return Response(status_code=401)
+    body = await request.body()
+    queue = getattr(request.app.state, "update_queue", None)
+    if queue is not None:
+        # UPDATE_QUEUE 开启：入队即返回，handler 由队列的 worker 执行
+        try:
+            await enqueue(queue, body)
+        except ValueError as e:
+            logger.warning(f"⚠️ 无法解析的 webhook 请求: {e}")
+        except RedisError as e:
+            logger.warning(f"⚠️ update 入队失败，让 Telegram 稍后重投: {e}")
+            return Response(status_code=503)
+        return Response(status_code=200)
+
+    bot: Bot = request.app.state.bot
+    dp: Dispatcher = request.app.state.dp
+    try:
+        update = Update.model_validate_json(body, context={"bot": bot})
+    except ValidationError as e:
+        # 回 200：非 2xx 会让 Telegram 反复重投同一条坏数据
+        logger.warning(f"⚠️ 无法解析的 webhook 请求: {e}")
+        return Response(status_code=200)
+    if not webhook_dispatcher.submit(bot, dp, update):
+        return Response(status_code=503)
+    return Response(status_code=200)
+
+
+# -----------------------------
+# 启停
+# -----------------------------
+async def start_webhook(bot: Bot, dp: Dispatcher) -> None:
+    allowed: List[str] = dp.resolve_used_update_types()
+    await bot.set_webhook(
+        url=webhook_url(),
+        secret_token=webhook_secret(),
+        max_connections=settings.webhook_max_connections,
+        allowed_updates=allowed,
+    )
+    logger.info(f"✅ Webhook 已设置: {webhook_url()}（{', '.join(allowed)}）")
+
+
+async def stop_webhook(bot: Bot) -> None:
+    await webhook_dispatcher.drain()
+    if settings.webhook_delete_on_shutdown:
+        await bot.delete_webhook()
+        logger.info("🛑 Webhook 已删除")
@@ -0,0 +1,112 @@
+# tests/test_update_queue.py
+"""
+LocalUpdateQueue + UpdateWorker：同一会话按入队顺序处理、未 ack 的条目重投、超过投递次数转死信
+
+    python -m pytest -q tests/test_update_queue.py
+"""
+import asyncio
+import json
+import random
+from collections import defaultdict
+from typing import Dict, List
+
+from aiogram import Bot
+
+from services.update_queue import LocalUpdateQueue, UpdateWorker, enqueue
+
+BOT = Bot(token="123456:TEST-token-for-update-queue")
+
+
+def _raw(update_id: int, chat_id: int) -> bytes:
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": str(update_id),
+        },
+    }).encode()
+
+
+class RecordingDispatcher:
+    """只记录 feed_update 的调用顺序；hang_on 里的 update 永远处理不完（模拟崩溃）"""
+
+    def __init__(self, hang_on=()):
+        self.seen: Dict[int, List[int]] = defaultdict(list)
+        self.hang_on = set(hang_on)
+
+    async def feed_update(self, bot, update):
+        if update.update_id in self.hang_on:
+            await asyncio.Event().wait()
+        await asyncio.sleep(random.random() / 1000)  # 让不同分区交错执行
+        self.seen[update.message.chat.id].append(update.update_id)
+
+
+async def _until(predicate, timeout: float = 5.0) -> None:
+    async def wait():
+        while not predicate():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(wait(), timeout)
+
+
+def test_per_chat_order_is_preserved():
+    async def scenario():
+        queue = LocalUpdateQueue(partitions=4, maxlen=10_000, claim_idle=60)
+        dp = RecordingDispatcher()
+        worker = UpdateWorker(queue, BOT, dp, batch=5, block=0.05)
+        expected: Dict[int, List[int]] = defaultdict(list)
+        for update_id in range(300):
+            chat_id = random.choice([11, 22, 33, 44, -55])
+            expected[chat_id].append(update_id)
+            await enqueue(queue, _raw(update_id, chat_id))
+        worker.start()
+        await _until(lambda: sum(map(len, dp.seen.values())) == 300)
+        await worker.stop(timeout=1)
+        assert dp.seen == expected
+
+    asyncio.run(scenario())
+
+
+def test_unacked_update_is_redelivered_in_order():
+    async def scenario():
+        queue = LocalUpdateQueue(partitions=1, maxlen=100, claim_idle=0.1)
+        for update_id in (1, 2, 3):
+            await enqueue(queue, _raw(update_id, 7))
+
+        crashed = RecordingDispatcher(hang_on={2})
+        first = UpdateWorker(queue, BOT, crashed, batch=10, block=0.05)
+        first.start()
+        await _until(lambda: crashed.seen[7] == [1])
+        await first.stop(timeout=0.1)  # 卡在 2 上被取消：2、3 都没有 ack
+
+        recovered = RecordingDispatcher()
+        second = UpdateWorker(queue, BOT, recovered, batch=10, block=0.05)
+        second.start()
+        await _until(lambda: recovered.seen[7] == [2, 3])
+        await second.stop(timeout=1)
+        assert await queue.backlog(0) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_update_goes_to_dead_letters_after_max_deliveries():
+    async def scenario():
+        queue = LocalUpdateQueue(partitions=1, maxlen=100, claim_idle=0.05)
+        await enqueue(queue, _raw(1, 7))
+        for _ in range(2):
+            worker = UpdateWorker(queue, BOT, RecordingDispatcher(hang_on={1}), max_deliveries=2, block=0.05)
+            worker.start()
+            await asyncio.sleep(0.1)
+            await worker.stop(timeout=0)
+
+        dp = RecordingDispatcher()
+        worker = UpdateWorker(queue, BOT, dp, max_deliveries=2, block=0.05)
+        worker.start()
+        await _until(lambda: len(queue.dead) == 1)
+        await worker.stop(timeout=1)
+        assert dp.seen == {}
+        assert queue.dead[0][1].deliveries == 3
+        assert await queue.backlog(0) == (0, 0)
+
+    asyncio.run(scenario())
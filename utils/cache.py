@@ -1,18 +1,436 @@
-from redis.asyncio import Redis  # 引入 FastAPI 实例
+# utils/cache.py
+"""
+两级缓存：L1 进程内 LRU + TTL，L2 Redis（msgpack）
+
+    user_cache = TwoTierCache("user", ttl=300, l1_ttl=30)
+
+    @cached(user_cache, key=lambda session, tg_id: tg_id, tags=lambda session, tg_id: [f"user:{tg_id}"])
+    async def load_user(session, tg_id): ...
+
+    await user_cache.invalidate_tag(f"user:{tg_id}")
+
+- 读取顺序 L1 → L2 → loader，回填时两级都写；
+- single-flight：同一进程内同一 key 的并发未命中只跑一次 loader，其余请求等同一个结果；
+- 标签失效：写入时登记 key 的标签（Redis SET + 本地索引），invalidate_tag() 删掉全部 L1 / L2 条目，
+  并通过 pub/sub 通知其他 worker 清 L1（没有 Redis 时只清本进程）；
+- Redis 出错只记日志并退化为 L1 + loader，不影响请求。
+
+值需要能被 msgpack 序列化：dict / list / str / 数字 / None，外加 UUID、Decimal、datetime、date。
+"""
+import asyncio
+import functools
 import json
-from fastapi import Request
-# 不依赖 main.app，直接操作 Redis 实例
-redis = Redis(
-    host="localhost",
-    port=6379,
-    db=0,
-    decode_responses=True  # 确保 get 返回的是 str 而不是 bytes
-)
-
-async def cache_get(request: Request, key: str) -> str | None:
-    redis: Redis = request.app.state.redis
-    return await redis.get(key)
-
-async def cache_set(request: Request, key: str, value: str, expire: int = 3600):
-    redis: Redis = request.app.state.redis
-    await redis.set(key, value, ex=expire)
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+import msgpack
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "cache"
+CHANNEL = "cache:invalidate"
+WORKER_ID = uuid4().hex
+
+_MISSING = object()
+
+
+class _LeaderCancelled(Exception):
+    """single-flight 的加载协程被取消"""
+
+
+# -----------------------------
+# msgpack 扩展类型
+# -----------------------------
+_EXT_UUID, _EXT_DECIMAL, _EXT_DATETIME, _EXT_DATE = 1, 2, 3, 4
+
+
+def _encode_ext(obj: Any) -> msgpack.ExtType:
+    if isinstance(obj, UUID):
+        return msgpack.ExtType(_EXT_UUID, obj.bytes)
+    if isinstance(obj, Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(obj).encode())
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(_EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, date):
+        return msgpack.ExtType(_EXT_DATE, obj.isoformat().encode())
+    raise TypeError(f"无法缓存 {type(obj).__name__} 类型的值")
+
+
+def _decode_ext(code: int, data: bytes) -> Any:
+    if code == _EXT_UUID:
+        return UUID(bytes=data)
+    if code == _EXT_DECIMAL:
+        return Decimal(data.decode())
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == _EXT_DATE:
+        return date.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def dumps(value: Any) -> bytes:
+    return msgpack.packb(value, default=_encode_ext, use_bin_type=True)
+
+
+def loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, ext_hook=_decode_ext, raw=False)
+
+
+# -----------------------------
+# L1：进程内 LRU + TTL
+# -----------------------------
+class LRUCache:
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# -----------------------------
+# L2：共享 Redis（所有缓存实例共用一个客户端）
+# -----------------------------
+_redis: Optional[Redis] = None
+_caches: Dict[str, "TwoTierCache"] = {}
+_background: Set[asyncio.Task] = set()
+
+
+def use_redis(redis: Optional[Redis]) -> None:
+    """启动时注入 Redis；传 None 只用 L1"""
+    global _redis
+    _redis = redis
+
+
+class TwoTierCache:
+    def __init__(
+        self,
+        name: str,
+        ttl: float = 300,
+        l1_ttl: Optional[float] = None,
+        l1_maxsize: int = 10_000,
+        cache_none: bool = False,
+    ):
+        if name in _caches:
+            raise ValueError(f"缓存 {name} 已存在")
+        self.name = name
+        self.ttl = ttl
+        self.l1_ttl = min(l1_ttl, ttl) if l1_ttl is not None else ttl  # L1 不能比 L2 更久
+        self.cache_none = cache_none
+        self.l1 = LRUCache(l1_maxsize)
+        self._tags: Dict[str, Set[str]] = {}  # 标签 -> 本进程 L1 里的 key
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._generation = 0  # 任何失效都 +1，加载期间发生失效的结果不回填
+        self.counters = dict.fromkeys(
+            ("l1_hits", "l2_hits", "misses", "loads", "coalesced", "l2_errors"), 0
+        )
+        _caches[name] = self
+        registry.register_collector(f"cache_{name}", self.stats)
+
+    # -------- key --------
+    def _key(self, key: Hashable) -> str:
+        return f"{KEY_PREFIX}:{self.name}:{key}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{KEY_PREFIX}:{self.name}:tag:{tag}"
+
+    # -------- 读写 --------
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        value = await self._lookup(self._key(key))
+        return default if value is _MISSING else value
+
+    async def _lookup(self, full_key: str) -> Any:
+        value = self._l1_get(full_key)
+        if value is not _MISSING:
+            return value
+        return await self._l2_get(full_key)
+
+    def _l1_get(self, full_key: str) -> Any:
+        value = self.l1.get(full_key)
+        if value is not _MISSING:
+            self.counters["l1_hits"] += 1
+        return value
+
+    async def _l2_get(self, full_key: str) -> Any:
+        if _redis is None:
+            return _MISSING
+        try:
+            raw = await _redis.get(full_key)
+        except RedisError as e:
+            self._l2_error("读取", e)
+            return _MISSING
+        if raw is None:
+            return _MISSING
+        value = loads(raw)
+        self.counters["l2_hits"] += 1
+        self.l1.set(full_key, value, self.l1_ttl)
+        return value
+
+    async def set(
+        self, key: Hashable, value: Any, tags: Iterable[str] = (), ttl: Optional[float] = None
+    ) -> None:
+        await self._store(self._key(key), value, tuple(tags), ttl or self.ttl)
+
+    async def _store(self, full_key: str, value: Any, tags: Tuple[str, ...], ttl: float) -> None:
+        self.l1.set(full_key, value, min(self.l1_ttl, ttl))
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(full_key)
+        if len(self._tags) > 2 * self.l1.maxsize:
+            self._prune_tags()
+        if _redis is None:
+            return
+        try:
+            async with _redis.pipeline(transaction=False) as pipe:
+                pipe.set(full_key, dumps(value), ex=int(max(ttl, 1)))
+                for tag in tags:
+                    tag_key = self._tag_key(tag)
+                    pipe.sadd(tag_key, full_key)
+                    pipe.expire(tag_key, int(max(ttl, 1)), gt=True)
+                    pipe.expire(tag_key, int(max(ttl, 1)), nx=True)
+                await pipe.execute()
+        except RedisError as e:
+            self._l2_error("写入", e)
+
+    async def delete(self, key: Hashable) -> None:
+        full_key = self._key(key)
+        self._generation += 1
+        self.l1.pop(full_key)
+        if _redis is not None:
+            try:
+                await _redis.delete(full_key)
+            except RedisError as e:
+                self._l2_error("删除", e)
+        await _publish({"cache": self.name, "keys": [full_key]})
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        tags: Iterable[str] = (),
+        ttl: Optional[float] = None,
+    ) -> Any:
+        """命中直接返回；未命中时同一 key 只有一个协程执行 loader"""
+        full_key = self._key(key)
+        value = self._l1_get(full_key)
+        if value is not _MISSING:
+            return value
+        inflight = self._inflight.get(full_key)
+        if inflight is not None:
+            self.counters["coalesced"] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                return await self.get_or_load(key, loader, tags, ttl)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[full_key] = future
+        try:
+            value = await self._l2_get(full_key)
+            if value is _MISSING:
+                self.counters["misses"] += 1
+                self.counters["loads"] += 1
+                generation = self._generation
+                value = await loader()
+                if (value is not None or self.cache_none) and generation == self._generation:
+                    await self._store(full_key, value, tuple(tags), ttl or self.ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            # 发起加载的请求被取消时，让等待者自己重试，而不是跟着被取消
+            future.set_exception(_LeaderCancelled() if isinstance(e, asyncio.CancelledError) else e)
+            future.exception()  # 没有人等待时不打印 "exception was never retrieved"
+            raise
+        finally:
+            self._inflight.pop(full_key, None)
+
+    # -------- 失效 --------
+    async def invalidate_tag(self, *tags: str) -> None:
+        """删掉带这些标签的全部条目（L1 + L2），并通知其他 worker"""
+        self._generation += 1
+        self._drop_local_tags(tags)
+        if _redis is not None:
+            try:
+                for tag in tags:
+                    tag_key = self._tag_key(tag)
+                    keys = await _redis.smembers(tag_key)
+                    await _redis.delete(tag_key, *keys)
+            except RedisError as e:
+                self._l2_error("按标签删除", e)
+        await _publish({"cache": self.name, "tags": list(tags)})
+
+    def invalidate_tag_soon(self, *tags: str) -> None:
+        """
+        给同步上下文（ORM 提交钩子）用：本进程 L1 立即失效，
+        L2 删除和广播放到后台任务；没有事件循环时只清本地。
+        """
+        self._drop_local({"tags": tags})
+        try:
+            task = asyncio.get_running_loop().create_task(self.invalidate_tag(*tags))
+        except RuntimeError:
+            return
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+    def _prune_tags(self) -> None:
+        """本地标签索引里去掉已被 LRU 淘汰 / 过期的 key"""
+        for tag in list(self._tags):
+            alive = {k for k in self._tags[tag] if self.l1.get(k) is not _MISSING}
+            if alive:
+                self._tags[tag] = alive
+            else:
+                del self._tags[tag]
+
+    def _drop_local_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            for full_key in self._tags.pop(tag, ()):
+                self.l1.pop(full_key)
+
+    def _drop_local(self, message: Dict[str, Any]) -> None:
+        self._generation += 1
+        self._drop_local_tags(message.get("tags") or ())
+        for full_key in message.get("keys") or ():
+            self.l1.pop(full_key)
+
+    def clear_local(self) -> None:
+        self._generation += 1
+        self.l1.clear()
+        self._tags.clear()
+
+    # -------- 指标 --------
+    def _l2_error(self, action: str, e: Exception) -> None:
+        self.counters["l2_errors"] += 1
+        logger.warning(f"⚠️ 缓存 {self.name} Redis {action}失败，退化为本地缓存: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        c = self.counters
+        hits = c["l1_hits"] + c["l2_hits"] + c["coalesced"]  # 合并等待的请求也没有打到数据库
+        lookups = hits + c["misses"]
+        return {
+            **c,
+            "l1_size": len(self.l1),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def invalidate_tags_soon(*tags: str) -> None:
+    """所有缓存实例按标签失效（约定 user:<telegram_id> 这类标签在各缓存里含义相同）"""
+    for cache in _caches.values():
+        cache.invalidate_tag_soon(*tags)
+
+
+# -----------------------------
+# 跨 worker 的 L1 失效广播
+# -----------------------------
+async def _publish(message: Dict[str, Any]) -> None:
+    if _redis is None:
+        return
+    try:
+        await _redis.publish(CHANNEL, json.dumps({**message, "origin": WORKER_ID}))
+    except RedisError as e:
+        logger.warning(f"⚠️ 缓存失效广播失败: {e}")
+
+
+def _on_message(data: Any) -> None:
+    try:
+        message = json.loads(data)
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ 无法解析缓存失效消息: {data!r}")
+        return
+    if message.get("origin") == WORKER_ID:
+        return
+    cache = _caches.get(message.get("cache"))
+    if cache is not None:
+        cache._drop_local(message)
+
+
+async def listen_invalidations(retry_delay: float = 1.0) -> None:
+    """后台订阅；重连后清空全部 L1（断线期间可能漏消息）"""
+    while True:
+        if _redis is None:
+            return
+        pubsub = _redis.pubsub()
+        try:
+            await pubsub.subscribe(CHANNEL)
+            for cache in _caches.values():
+                cache.clear_local()
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _on_message(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ 缓存失效订阅断开，{retry_delay:.0f}s 后重连: {e}")
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+        await asyncio.sleep(retry_delay)
+
+
+# -----------------------------
+# 装饰器
+# -----------------------------
+def cached(
+    cache: TwoTierCache,
+    key: Optional[Callable[..., Hashable]] = None,
+    tags: Optional[Callable[..., Iterable[str]]] = None,
+    ttl: Optional[float] = None,
+):
+    """
+    缓存 async 函数的返回值。key / tags 接收与被装饰函数相同的参数；
+    不给 key 时用全部参数拼 key，参数里有会话等对象时必须自己给 key。
+    """
+
+    def decorator(fn: Callable[..., Awaitable[Any]]):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            else:
+                cache_key = ":".join(
+                    [fn.__qualname__, *map(str, args), *(f"{k}={v}" for k, v in sorted(kwargs.items()))]
+                )
+            return await cache.get_or_load(
+                cache_key,
+                lambda: fn(*args, **kwargs),
+                tags=tags(*args, **kwargs) if tags else (),
+                ttl=ttl,
+            )
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
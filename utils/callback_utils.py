@@ -1,7 +1,12 @@
 # utils/callback_utils.py
-from typing import Optional
+import base64
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
 from uuid import UUID
 
+_EPOCH = datetime(1970, 1, 1)
+
 def parse_callback_uuid(data: str, prefix: str) -> Optional[UUID]:
     if not data or not data.startswith(prefix):
         return None
@@ -20,3 +25,28 @@ def parse_callback_int(data: str, prefix: str) -> Optional[int]:
     if len(parts) != 2 or not parts[1].isdigit():
         return None
     return int(parts[1])
+
+
+# -----------------------------
+# keyset 分页游标 (created_at, id)
+# -----------------------------
+_CURSOR_STRUCT = struct.Struct(">q16s")  # 微秒时间戳 + UUID 字节，共 24 字节
+
+
+def encode_keyset_cursor(created_at: datetime, row_id: UUID) -> str:
+    """编码成 32 个字符的 urlsafe base64，塞得进 callback_data（64 字节上限）"""
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    micros = (created_at - _EPOCH) // timedelta(microseconds=1)
+    raw = _CURSOR_STRUCT.pack(micros, row_id.bytes)
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_keyset_cursor(cursor: str) -> Optional[Tuple[datetime, UUID]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        micros, id_bytes = _CURSOR_STRUCT.unpack(raw)
+    except (ValueError, struct.error):
+        return None
+    created_at = (_EPOCH + timedelta(microseconds=micros)).replace(tzinfo=timezone.utc)
+    return created_at, UUID(bytes=id_bytes)
@@ -11,9 +11,8 @@ from utils.formatting import _safe_reply
 from aiogram import Bot, Router
 from aiogram.filters import Command
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from db.models import User as Users
-from db.session import  get_async_session
+from utils.middlewares import session_scope
+from services.identity import get_identity
 from config.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -28,28 +27,20 @@ R = TypeVar("R")
 def db_session(
     func: Callable[..., Coroutine[Any, Any, R]],
 ) -> Callable[..., Coroutine[Any, Any, R]]:
-    """自动创建 AsyncSession"""
+    """注入 AsyncSession：优先用 DbSessionMiddleware 的 `db`，不在 update 上下文时才新开"""
 
     @functools.wraps(func)
     async def wrapper(*args, **kwargs) -> R:
-        db: Optional[AsyncSession] = kwargs.get("db")
-        if db is None:
-            async with get_async_session() as session:
-                kwargs["db"] = session
-                return await func(*args, **kwargs)
-        else:
+        async with session_scope(kwargs.get("db")) as session:
+            kwargs["db"] = session
             return await func(*args, **kwargs)
 
     return wrapper
 
 
 async def db_check_is_admin(user_id: int) -> bool:
-    async with get_async_session() as session:
-        result = await session.execute(
-            select(Users.is_admin).where(Users.telegram_id == user_id)
-        )
-        is_admin = result.scalar_one_or_none()
-        return bool(is_admin)
+    identity = await get_identity(user_id)
+    return bool(identity and identity.is_admin)
 
 
 
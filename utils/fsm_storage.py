@@ -0,0 +1,131 @@
+# utils/fsm_storage.py
+"""
+Redis FSM 存储（FSM_STORAGE=redis）
+
+MemoryStorage 的状态重启就丢、多个 worker 之间不共享，放弃流程的用户也一直占着内存。
+这里每个 StorageKey 一个 Redis hash：
+
+    fsm:{bot_id}:{chat_id}:{user_id}:{destiny}
+        s  当前状态
+        d  数据（msgpack，编码与 utils.cache 相同，支持 UUID / Decimal / datetime）
+        t  当前状态的 TTL 秒数
+
+- TTL 按状态取：FSM_STATE_TTLS 里的完整状态名 → StatesGroup 名 → FSM_TTL，
+  每次写入都续期，到期整个 key 消失（放弃的流程自动清理）；
+- 一次往返：get_state 用 HMGET 同时取回状态和数据，数据暂存在当前 task，
+  同一 update 里紧接着的第一次 get_data（FSMContextMiddleware 之后 handler 的 get_data /
+  update_data）直接用它；快照只用一次，之后的 get_data、以及 set_data 之后都重新读 Redis，
+  handler 跑得再久也不会一直拿着中间件开头读到的数据；
+- set_data 用 Lua 脚本在一次往返里写数据并按已存的 t 续期；
+- 状态和数据都清空时 hash 没有字段，Redis 自动删除 key。
+"""
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from redis.asyncio import Redis
+
+from config.settings import AppSettings
+from utils.cache import dumps, loads
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_HITS = registry.counter("fsm_prefetch_hits_total", "get_data 直接使用 get_state 一并取回的数据")
+
+# KEYS[1] = key；ARGV[1] = msgpack 数据（空串表示清空）；ARGV[2] = 默认 TTL
+_SET_DATA = """
+if ARGV[1] == '' then
+    redis.call('HDEL', KEYS[1], 'd')
+else
+    redis.call('HSET', KEYS[1], 'd', ARGV[1])
+end
+local ttl = tonumber(redis.call('HGET', KEYS[1], 't') or ARGV[2])
+redis.call('EXPIRE', KEYS[1], ttl)
+"""
+
+# get_state 顺带读到的 (task, redis key, 数据)，只给随后第一次 get_data 用；每个 update 在自己的
+# task 里处理，互不可见。记下 task：handler 里 create_task 出去的后台任务会复制上下文，但不应该拿到这份快照
+_prefetched: ContextVar[Optional[Tuple[Optional[asyncio.Task], str, Optional[bytes]]]] = ContextVar(
+    "fsm_prefetched", default=None
+)
+
+
+def _remember(redis_key: str, data: Optional[bytes]) -> None:
+    _prefetched.set((asyncio.current_task(), redis_key, data))
+
+
+class RedisFSMStorage(BaseStorage):
+    def __init__(
+        self,
+        redis: Redis,
+        default_ttl: int = 86400,
+        state_ttls: Optional[Mapping[str, int]] = None,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.redis = redis
+        self.default_ttl = default_ttl
+        self.state_ttls = dict(state_ttls or {})
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._set_data = redis.register_script(_SET_DATA)
+
+    def ttl_for(self, state: Optional[str]) -> int:
+        if not state:
+            return self.default_ttl
+        ttl = self.state_ttls.get(state)
+        if ttl is None:
+            ttl = self.state_ttls.get(state.split(":", 1)[0], self.default_ttl)
+        return ttl
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        redis_key = self.key_builder.build(key)
+        state = state.state if isinstance(state, State) else state
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if state is None:
+                pipe.hdel(redis_key, "s", "t")
+            else:
+                pipe.hset(redis_key, mapping={"s": state, "t": self.ttl_for(state)})
+            pipe.expire(redis_key, self.ttl_for(state))
+            await pipe.execute()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        redis_key = self.key_builder.build(key)
+        state, data = await self.redis.hmget(redis_key, ["s", "d"])
+        _remember(redis_key, data)
+        return state.decode() if isinstance(state, bytes) else state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        redis_key = self.key_builder.build(key)
+        packed = dumps(data) if data else b""
+        await self._set_data(keys=[redis_key], args=[packed, self.default_ttl])
+        _prefetched.set(None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        redis_key = self.key_builder.build(key)
+        prefetched = _prefetched.get()
+        if prefetched is not None and prefetched[1] == redis_key and prefetched[0] is asyncio.current_task():
+            _prefetched.set(None)  # 只用一次
+            PREFETCH_HITS.inc()
+            data = prefetched[2]
+        else:
+            data = await self.redis.hget(redis_key, "d")
+        return loads(data) if data else {}
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def build_fsm_storage(settings: AppSettings) -> BaseStorage:
+    if settings.fsm_storage == "redis":
+        logger.info(f"✅ FSM 存储: Redis（默认 TTL {settings.fsm_ttl}s）")
+        # 数据是 msgpack 二进制，不能用 decode_responses 的连接
+        return RedisFSMStorage(
+            Redis.from_url(settings.redis_url),
+            default_ttl=settings.fsm_ttl,
+            state_ttls=settings.fsm_state_ttls,
+        )
+    return MemoryStorage()
@@ -5,6 +5,7 @@ from aiogram.exceptions import TelegramAPIError
 from typing import List, Optional
 import logging
 import asyncio
+from utils.rate_limit import bulk_lane
 
 logger = logging.getLogger(__name__)
 
@@ -40,27 +41,29 @@ async def broadcast_message(
     text: str,
     parse_mode: Optional[str] = None,
     disable_notification: bool = False,
-    chunk_size: int = 30,
+    concurrency: int = 30,
 ) -> int:
     """
-    并发广播（按块执行，防速率封禁）
+    并发广播：限速由 bot.session 上的 OutboundRateLimitMiddleware 负责（广播道，给交互回复让路，
+    429 自动等待重发）；这里只用 concurrency 个发送协程，避免一次给每个用户建一个任务
     """
     success = 0
+    pending = iter(user_ids)
 
-    for i in range(0, len(user_ids), chunk_size):
-        chunk = user_ids[i:i + chunk_size]
-        tasks = [
-            send_message_safe(
-                bot,
-                user_id=uid,
-                text=text,
-                parse_mode=parse_mode,
-                disable_notification=disable_notification
-            ) for uid in chunk
-        ]
-        results = await asyncio.gather(*tasks)
-        success += sum(results)
-        await asyncio.sleep(0.5)  # 稍微限速
+    async def sender() -> None:
+        nonlocal success
+        with bulk_lane():
+            for uid in pending:
+                if await send_message_safe(
+                    bot,
+                    user_id=uid,
+                    text=text,
+                    parse_mode=parse_mode,
+                    disable_notification=disable_notification,
+                ):
+                    success += 1
+
+    await asyncio.gather(*(sender() for _ in range(min(concurrency, len(user_ids)))))
 
     logger.info(f"[messaging] 广播完成: {success}/{len(user_ids)} 成功")
     return success
@@ -0,0 +1,116 @@
+# utils/metrics.py
+"""
+进程内轻量指标（计数器 / 仪表 / 直方图）
+
+不依赖 prometheus_client，/api/metrics 直接返回 registry.snapshot() 的 JSON。
+"""
+import bisect
+import logging
+from typing import Callable, Dict, Any, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Counter:
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self.value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Gauge:
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self.value: float = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Histogram:
+    def __init__(
+        self, name: str, description: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个是 +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = 0
+        buckets: Dict[str, int] = {}
+        for le, n in zip(self.buckets, self.counts):
+            cumulative += n
+            buckets[f"le_{le:g}"] = cumulative
+        buckets["le_inf"] = cumulative + self.counts[-1]
+        return {"count": self.count, "sum": round(self.sum, 6), "buckets": buckets}
+
+
+class MetricsRegistry:
+    """按名字登记指标；collector 在 snapshot 时被调用，用于池状态等"拉取式"数据"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Counter | Gauge | Histogram] = {}
+        self._collectors: Dict[str, Callable[[], Any]] = {}
+
+    def _get_or_create(self, cls, name: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, **kwargs)
+            self._metrics[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError(f"指标 {name} 已注册为 {type(metric).__name__}")
+        return metric
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self._get_or_create(Counter, name, description=description)
+
+    def gauge(self, name: str, description: str = "") -> Gauge:
+        return self._get_or_create(Gauge, name, description=description)
+
+    def histogram(
+        self, name: str, description: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, description=description, buckets=buckets)
+
+    def register_collector(self, name: str, collector: Callable[[], Any]) -> None:
+        self._collectors[name] = collector
+
+    def snapshot(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {name: m.snapshot() for name, m in self._metrics.items()}
+        for name, collector in self._collectors.items():
+            try:
+                data[name] = collector()
+            except Exception as e:
+                logger.warning(f"指标收集失败 {name}: {e}")
+        return data
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,223 @@
+# utils/middlewares.py
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, AsyncGenerator
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from config.settings import get_app_settings
+from db.session import async_session_maker, get_async_session
+from services.activity import activity_buffer
+from services.identity import get_identity
+from services.views import PreparedInlineKeyboardMarkup
+from utils.rate_limit import OutboundLimiter, outbound_limiter
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+# 当前 update 的会话（同一个 task 内的 handler / 出站请求都能拿到）
+_current_session: ContextVar[Optional[AsyncSession]] = ContextVar("current_db_session", default=None)
+
+
+def current_session() -> Optional[AsyncSession]:
+    return _current_session.get()
+
+
+async def release_current_session() -> None:
+    """提交当前事务，把连接还给连接池（会话仍可继续使用，下次查询再取连接）"""
+    session = _current_session.get()
+    if session is not None and session.in_transaction():
+        await session.commit()
+
+
+@asynccontextmanager
+async def session_scope(db: Optional[AsyncSession] = None) -> AsyncGenerator[AsyncSession, None]:
+    """优先复用传入的 / 当前 update 的会话；不在 aiogram 上下文时才新开"""
+    session = db or _current_session.get()
+    if session is not None:
+        yield session
+        return
+    async with get_async_session() as session:
+        yield session
+
+
+# -----------------------------
+# 每个 update 一个 AsyncSession
+# -----------------------------
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    outer middleware：为每个 update 创建一个 AsyncSession 并以 `db` 注入 handler。
+    AsyncSession 在第一次查询时才会从池里取连接，所以不访问数据库的 update 不占连接。
+    handler 正常结束统一 commit，抛异常统一 rollback。
+    """
+
+    def __init__(self, session_maker: async_sessionmaker[AsyncSession] = async_session_maker):
+        self.session_maker = session_maker
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(data.get("db"), AsyncSession):
+            return await handler(event, data)
+
+        async with self.session_maker() as session:
+            token = _current_session.set(session)
+            data["db"] = session
+            try:
+                result = await handler(event, data)
+                if session.in_transaction():
+                    await session.commit()
+                return result
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                _current_session.reset(token)
+
+
+# -----------------------------
+# 调用 Telegram API 前释放连接
+# -----------------------------
+class ReleaseDbSessionMiddleware(BaseRequestMiddleware):
+    """
+    bot.session 的请求中间件：发请求前提交当前 update 的事务，
+    避免在等待 Telegram 网络 I/O 时一直占着数据库连接。
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        # 提交失败直接抛出：不能在写入失败时还给用户发"成功"
+        await release_current_session()
+        return await make_request(bot, method)
+
+
+# -----------------------------
+# 预序列化的键盘直接以 JSON 发出
+# -----------------------------
+class PreparedMarkupMiddleware(BaseRequestMiddleware):
+    """
+    bot.session 的请求中间件：reply_markup 是渲染缓存里的 PreparedInlineKeyboardMarkup 时，
+    换成它预先算好的 JSON 字符串（aiogram 对 str 原样发送），省掉每次请求的 model_dump + 序列化。
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(markup, PreparedInlineKeyboardMarkup):
+            method.reply_markup = markup.prepared_json
+        return await make_request(bot, method)
+
+
+# -----------------------------
+# 发往 Telegram 的限速
+# -----------------------------
+class OutboundRateLimitMiddleware(BaseRequestMiddleware):
+    """
+    bot.session 的请求中间件：向会话发消息 / 改消息前先从 outbound_limiter 取令牌；
+    收到 429 时把这个会话暂停 retry_after（连续 429 逐次加长）后重发，最多 OUTBOUND_MAX_RETRIES 次；
+    会话本来空闲（429 来自全局额度）时所有会话一起暂停，见 OutboundLimiter.penalize。
+    answer_callback_query 等不计入消息额度的方法不限速。
+    """
+
+    LIMITED_PREFIXES = ("Send", "Copy", "Forward", "EditMessage")
+    UNLIMITED = frozenset({"SendChatAction"})
+
+    def __init__(
+        self,
+        limiter: OutboundLimiter = outbound_limiter,
+        max_retries: int = settings.outbound_max_retries,
+    ):
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or name in self.UNLIMITED or not name.startswith(self.LIMITED_PREFIXES):
+            return await make_request(bot, method)
+        attempt = 0
+        while True:
+            await self.limiter.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = e.retry_after * attempt
+                scope = "全局" if await self.limiter.penalize(chat_id, delay) else "会话"
+                logger.warning(f"⚠️ {name} 到 {chat_id} 被限速（{scope}），{delay} 秒后第 {attempt} 次重发")
+
+
+# -----------------------------
+# 记录用户活跃（批量写回 last_active）
+# -----------------------------
+class ActivityMiddleware(BaseMiddleware):
+    """每个 update 只把 (telegram_id, 时间) 记进 activity_buffer，不再逐条写库"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            await activity_buffer.record(user.id)
+        return await handler(event, data)
+
+
+# -----------------------------
+# 用户身份（走 identity 缓存）
+# -----------------------------
+class IdentityMiddleware(BaseMiddleware):
+    """
+    把发起者的 UserIdentity 以 `identity` 注入 handler，未注册用户为 None。
+    缓存命中时不访问数据库；未命中时由 identity_loader 合批查询，不占用本 update 的会话。
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        data["identity"] = await get_identity(user.id) if user is not None else None
+        return await handler(event, data)
+
+
+def setup_db_middlewares(dp, bot: Bot) -> None:
+    dp.update.outer_middleware(DbSessionMiddleware())
+    dp.update.outer_middleware(IdentityMiddleware())
+    dp.update.outer_middleware(ActivityMiddleware())
+    bot.session.middleware(ReleaseDbSessionMiddleware())
+    bot.session.middleware(PreparedMarkupMiddleware())
+    # 最内层：排队等令牌时数据库连接已经释放
+    bot.session.middleware(OutboundRateLimitMiddleware())
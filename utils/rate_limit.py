@@ -0,0 +1,245 @@
+# utils/rate_limit.py
+"""
+发往 Telegram 的消息限速（令牌桶）
+
+Telegram 的限制：全局约 30 条/秒，同一私聊约 1 条/秒，同一群组 20 条/分钟；
+超过会收到 429（TelegramRetryAfter）。每次发送前依次检查：
+
+- 全局桶：OUTBOUND_GLOBAL_RATE 条/秒；
+- 会话桶：私聊 OUTBOUND_CHAT_RATE 条/秒，群组 / 频道（chat_id < 0）OUTBOUND_GROUP_PER_MINUTE 条/分钟，
+  各自允许 OUTBOUND_CHAT_BURST 条突发；
+- 优先级：交互回复（默认）和广播（with bulk_lane()）两条道。广播只能用全局桶里
+  超过 OUTBOUND_BULK_RESERVE 的部分：广播把全局额度用满时，交互回复仍然立即有令牌可用，
+  跨进程同样有效；
+- 429：会话桶扣成负数（retry_after 秒后才攒够 1 个令牌），由 OutboundRateLimitMiddleware 等待后重发。
+  Telegram 不说明是哪个额度超了：这个会话最近没发过别的（会话桶除了这一条还是满的），
+  就不是会话额度的问题，全局桶也一起扣，所有会话都暂停 retry_after 秒。
+
+OUTBOUND_BACKEND=redis 时桶存在 Redis（Lua 脚本一次往返、用 Redis 的时钟），
+所有进程共用同一套额度；Redis 出错时退回进程内的桶。
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config.settings import get_app_settings
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+settings = get_app_settings()
+
+INTERACTIVE, BULK = "interactive", "bulk"
+KEY_PREFIX = "outbound"
+
+THROTTLED = registry.counter("outbound_throttled_total", "因限速等待过的发送")
+WAIT_SECONDS = registry.histogram("outbound_wait_seconds", "发送前排队等待的时间")
+RETRY_AFTER = registry.counter("outbound_retry_after_total", "收到的 429")
+
+_lane: ContextVar[str] = ContextVar("outbound_lane", default=INTERACTIVE)
+
+# (key, 每秒补充, 容量, 预留) —— 预留的令牌这次不能用
+BucketSpec = Tuple[str, float, float, float]
+
+# KEYS = 桶；ARGV = 每个桶的 (rate, capacity, reserve)；返回需要等待的秒数（字符串，0 表示已扣除）
+_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 2])
+    local capacity = tonumber(ARGV[i * 3 - 1])
+    local reserve = tonumber(ARGV[i * 3])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < 1 + reserve then
+        wait = math.max(wait, (1 + reserve - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 2])
+    local capacity = tonumber(ARGV[i * 3 - 1])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+return '0'
+"""
+
+# KEYS = 会话桶, 全局桶；ARGV = 会话 rate, capacity, 全局 rate, capacity, 暂停秒数（到期时正好攒够 1 个令牌）
+# 会话桶总是扣；会话桶除了刚发的这一条还是满的（429 不是它引起的）时全局桶也扣。返回 1 表示扣了全局桶
+_PENALIZE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local seconds = tonumber(ARGV[5])
+local function penalize(key, rate, capacity)
+    redis.call('HSET', key, 'tokens', tostring(1 - seconds * rate), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(seconds + capacity / rate) + 60)
+end
+local chat_rate = tonumber(ARGV[1])
+local chat_capacity = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or chat_capacity
+local ts = tonumber(bucket[2]) or now
+local idle = math.min(chat_capacity, tokens + math.max(0, now - ts) * chat_rate) >= chat_capacity - 1
+penalize(KEYS[1], chat_rate, chat_capacity)
+if idle then
+    penalize(KEYS[2], tonumber(ARGV[3]), tonumber(ARGV[4]))
+    return 1
+end
+return 0
+"""
+
+
+@contextmanager
+def bulk_lane() -> Iterator[None]:
+    """块内的发送走广播道（给交互回复让路）"""
+    token = _lane.set(BULK)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class _LocalBuckets:
+    """进程内实现，语义同 _TAKE / _PENALIZE"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        # key -> [tokens, ts, settled]；settled 之后令牌数不再为负（429 暂停到期的时间）
+        self._buckets: Dict[str, List[float]] = {}
+
+    def level(self, key: str, rate: float, capacity: float, now: Optional[float] = None) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return capacity
+        if now is None:
+            now = time.monotonic()
+        return min(capacity, bucket[0] + max(0.0, now - bucket[1]) * rate)
+
+    def take(self, specs: List[BucketSpec]) -> float:
+        now = time.monotonic()
+        levels = [self.level(key, rate, capacity, now) for key, rate, capacity, _ in specs]
+        wait = max(
+            ((1 + reserve - level) / rate for (_, rate, _, reserve), level in zip(specs, levels) if level < 1 + reserve),
+            default=0.0,
+        )
+        if wait > 0:
+            return wait
+        for (key, *_), level in zip(specs, levels):
+            self._buckets[key] = [level - 1, now, now]
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+        return 0.0
+
+    def penalize(self, key: str, rate: float, seconds: float) -> None:
+        now = time.monotonic()
+        self._buckets[key] = [1 - seconds * rate, now, now + seconds]
+
+    def _prune(self, now: float) -> None:
+        """删掉早已补满的会话桶（不存在等价于满桶）；429 暂停中的桶（令牌为负）要留着"""
+        stale = [key for key, (_, _, settled) in self._buckets.items() if now - settled > 120]
+        for key in stale:
+            del self._buckets[key]
+
+
+class OutboundLimiter:
+    def __init__(
+        self,
+        global_rate: float = settings.outbound_global_rate,
+        chat_rate: float = settings.outbound_chat_rate,
+        group_per_minute: float = settings.outbound_group_per_minute,
+        chat_burst: int = settings.outbound_chat_burst,
+        bulk_reserve: int = settings.outbound_bulk_reserve,
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_per_minute / 60
+        self.chat_burst = chat_burst
+        self.bulk_reserve = bulk_reserve
+        self.redis: Optional[Redis] = None
+        self._local = _LocalBuckets()
+        self._take = None
+        self._penalize = None
+
+    def use_redis(self, redis: Optional[Redis]) -> None:
+        """多进程共用额度；传 None 回到进程内的桶"""
+        self.redis = redis
+        if redis is not None:
+            self._take = redis.register_script(_TAKE)
+            self._penalize = redis.register_script(_PENALIZE)
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> Tuple[str, float]:
+        # 群组 / 超级群 / 频道的 id 为负；@username 只能是频道或公开群
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        return f"{KEY_PREFIX}:chat:{chat_id}", self.group_rate if is_group else self.chat_rate
+
+    def _specs(self, chat_id: Union[int, str], lane: str) -> List[BucketSpec]:
+        chat_key, chat_rate = self._chat_bucket(chat_id)
+        reserve = self.bulk_reserve if lane == BULK else 0
+        return [
+            (f"{KEY_PREFIX}:global", self.global_rate, self.global_rate, reserve),
+            (chat_key, chat_rate, self.chat_burst, 0),
+        ]
+
+    async def _try(self, specs: List[BucketSpec]) -> float:
+        if self.redis is not None:
+            try:
+                args = [v for _, rate, capacity, reserve in specs for v in (rate, capacity, reserve)]
+                wait = await self._take(keys=[key for key, *_ in specs], args=args)
+                return float(wait)
+            except RedisError as e:
+                logger.warning(f"⚠️ Redis 限速不可用，改用进程内限速: {e}")
+        return self._local.take(specs)
+
+    async def acquire(self, chat_id: Union[int, str], lane: Optional[str] = None) -> float:
+        """等到可以向 chat_id 发一条消息；返回等待的秒数"""
+        lane = lane or _lane.get()
+        specs = self._specs(chat_id, lane)
+        start = time.monotonic()
+        while True:
+            wait = await self._try(specs)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            THROTTLED.inc()
+        WAIT_SECONDS.observe(waited)
+        return waited
+
+    async def penalize(self, chat_id: Union[int, str], seconds: float) -> bool:
+        """
+        收到 429：这个会话 seconds 秒内不再发送；会话本来是空闲的（不是会话额度引起的）时
+        全局也暂停 seconds 秒。返回是否暂停了全局。
+        """
+        RETRY_AFTER.inc()
+        key, rate = self._chat_bucket(chat_id)
+        global_key = f"{KEY_PREFIX}:global"
+        if self.redis is not None:
+            try:
+                return bool(await self._penalize(
+                    keys=[key, global_key],
+                    args=[rate, self.chat_burst, self.global_rate, self.global_rate, seconds],
+                ))
+            except RedisError as e:
+                logger.warning(f"⚠️ Redis 限速不可用，改用进程内限速: {e}")
+        idle = self._local.level(key, rate, self.chat_burst) >= self.chat_burst - 1
+        self._local.penalize(key, rate, seconds)
+        if idle:
+            self._local.penalize(global_key, self.global_rate, seconds)
+        return idle
+
+
+outbound_limiter = OutboundLimiter()
@@ -0,0 +1,88 @@
+# worker.py
+"""
+update 处理进程（UPDATE_QUEUE=redis）
+
+API 进程（main.py）负责接收 update 并写入 Redis Streams，这里按分区消费并执行 handler：
+
+    python worker.py --index 0 --count 4   # 共 4 个进程，编号 0..3
+    UPDATE_WORKER_INDEX=1 UPDATE_WORKER_COUNT=4 python worker.py
+
+同一编号同时只能跑一个进程（消费者名 worker-{index} 决定崩溃后重放哪些条目）；
+调整 --count 后分区换了主人，旧主人名下未 ack 的条目在 UPDATE_QUEUE_CLAIM_IDLE 秒后被接管。
+"""
+import argparse
+import asyncio
+import logging
+import signal
+
+from config.settings import AppSettings, get_app_settings
+from db.session import close_connections
+from handlers import create_bot, create_dispatcher
+from handlers.context import RedisService
+from services.activity import activity_buffer
+from services.catalog import catalog
+from services.update_queue import RedisUpdateQueue, UpdateWorker, build_update_queue
+from utils import cache
+from utils.rate_limit import outbound_limiter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def run(settings: AppSettings, index: int, count: int) -> None:
+    await settings.refresh()
+    update_queue = build_update_queue(settings)
+    if not isinstance(update_queue, RedisUpdateQueue):
+        raise SystemExit("worker.py 需要 UPDATE_QUEUE=redis")
+    await update_queue.ensure_groups()
+
+    # handler 依赖的进程内状态：缓存、商品目录、活跃时间缓冲（与 main.lifespan 相同）
+    redis = await RedisService.get_redis()
+    cache.use_redis(redis)
+    cache_task = asyncio.create_task(cache.listen_invalidations())
+    catalog_task = await catalog.start(redis)
+    if settings.activity_backend == "redis":
+        activity_buffer.use_redis(redis)
+    activity_task = asyncio.create_task(activity_buffer.run(settings.activity_flush_interval))
+    if settings.outbound_backend == "redis":
+        outbound_limiter.use_redis(redis)
+
+    bot = create_bot(settings)
+    dp = create_dispatcher(settings, bot)
+    worker = UpdateWorker(update_queue, bot, dp, index=index, count=count)
+    worker.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    await worker.stop()
+    if catalog_task:
+        catalog_task.cancel()
+    cache_task.cancel()
+    activity_task.cancel()
+    try:
+        await activity_task
+    except asyncio.CancelledError:
+        pass
+    flushed = await activity_buffer.flush()
+    logger.info(f"✅ last_active 最终写回 {flushed} 条")
+    await update_queue.close()
+    await dp.storage.close()
+    await bot.session.close()
+    await RedisService.close()
+    await close_connections()
+    logger.info("🛑 worker 已关闭")
+
+
+if __name__ == "__main__":
+    settings = get_app_settings()
+    parser = argparse.ArgumentParser(description="update 处理进程")
+    parser.add_argument("--index", type=int, default=settings.update_worker_index)
+    parser.add_argument("--count", type=int, default=settings.update_worker_count)
+    args = parser.parse_args()
+    if not 0 <= args.index < args.count:
+        parser.error("--index 必须在 [0, --count) 范围内")
+    asyncio.run(run(settings, args.index, args.count))